@@ -8,6 +8,10 @@ from flask_wtf.csrf import CSRFProtect, generate_csrf
 from datetime import timedelta, datetime
 from dotenv import load_dotenv
 from .config import Config
+from .middleware.metrics import TimedQueuePool, init_metrics
+from .middleware.transactions import RequestSession
+from .utils.json_provider import APIJSONProvider
+from .utils.session_store import SQLiteSessionInterface
 import logging
 from logging.handlers import RotatingFileHandler
 from sqlalchemy import text
@@ -19,8 +23,9 @@ from flask_caching import Cache
 # Load environment variables
 load_dotenv()
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+# Initialize SQLAlchemy (safe-method requests get read-only transactions, see middleware/transactions.py;
+# the pool reports to /metrics, see middleware/metrics.py)
+db = SQLAlchemy(session_options={'class_': RequestSession}, engine_options={'poolclass': TimedQueuePool})
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -52,9 +57,10 @@ def create_app(config_class=Config):
     """Create and configure the Flask application"""
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config_class)
+    app.json = APIJSONProvider(app)
 
-    # Flask-Caching configuration (simple in-memory, can be swapped for Redis, etc.)
-    app.config['CACHE_TYPE'] = 'SimpleCache'
+    # Flask-Caching configuration: one cache shared by every worker on the host
+    app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'assets.utils.shared_cache.SharedMemoryCache')
     app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # 5 minutes
     cache = Cache(app)
     app.cache = cache  # Make cache accessible via app
@@ -67,11 +73,12 @@ def create_app(config_class=Config):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_url
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     
-    # Server-side session configuration
-    app.config["SESSION_TYPE"] = "filesystem"
+    # Server-side session configuration ("sqlite" is assets/utils/session_store.py;
+    # any other value is handed to Flask-Session, e.g. "filesystem")
+    app.config["SESSION_TYPE"] = os.getenv("SESSION_TYPE", "sqlite")
     app.config["SESSION_PERMANENT"] = True
     app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=7)
-    app.config["SESSION_FILE_DIR"] = os.path.join(app.root_path, "flask_session")
+    app.config["SESSION_FILE_DIR"] = os.path.join(app.root_path, "flask_session")  # Filesystem backend; sqlite imports from it
     app.config["SESSION_USE_SIGNER"] = True
     app.config["SESSION_COOKIE_SECURE"] = False  # Set to False to allow both HTTP and HTTPS
     app.config["SESSION_COOKIE_HTTPONLY"] = True
@@ -108,10 +115,22 @@ def create_app(config_class=Config):
     # Initialize extensions with app
     db.init_app(app)
     login_manager.init_app(app)
-    Session(app)
+    if app.config["SESSION_TYPE"] == "sqlite":
+        app.session_interface = SQLiteSessionInterface.from_app(app)
+    else:
+        Session(app)
     csrf.init_app(app)
     discord.init_app(app)
     migrate.init_app(app, db)
+    init_metrics(app)
+    from .middleware.db_pool import init_db_pool
+    init_db_pool(app)
+    from .middleware.profiler import init_profiler
+    init_profiler(app)
+    from .middleware.memory_tracking import init_memory_tracking
+    init_memory_tracking(app)
+    from .middleware.query_tracking import init_query_tracking
+    init_query_tracking(app)
 
     # Example: cache a simple function
     @app.cache.cached(timeout=60, key_prefix='expensive_computation')
@@ -124,7 +143,8 @@ def create_app(config_class=Config):
     app.expensive_computation = expensive_computation
     
     # Create flask_session directory if it doesn't exist
-    os.makedirs(app.config["SESSION_FILE_DIR"], exist_ok=True)
+    if app.config["SESSION_TYPE"] == "filesystem":
+        os.makedirs(app.config["SESSION_FILE_DIR"], exist_ok=True)
     
     # Add CSRF token to all templates
     @app.context_processor
@@ -173,6 +193,16 @@ def create_app(config_class=Config):
     app.register_blueprint(admin)
     app.register_blueprint(api)
     
+    # Register CLI commands
+    from .services.xp_levels import xp_cli
+    app.cli.add_command(xp_cli)
+    from .utils.session_store import sessions_cli
+    app.cli.add_command(sessions_cli)
+    from .services.guild_stats import guild_stats_cli
+    app.cli.add_command(guild_stats_cli)
+    from .middleware.memory_tracking import memory_cli
+    app.cli.add_command(memory_cli)
+    
     # Create database tables
     with app.app_context():
         try:
@@ -203,29 +233,6 @@ def create_app(config_class=Config):
         app.logger.error(f'Bad gateway error: {str(error)}')
         return render_template('errors/502.html'), 502
     
-    @app.before_request
-    def before_request():
-        # Only test connection for non-static routes
-        if not request.path.startswith('/static/'):
-            try:
-                # Use a lightweight connection test
-                db.session.execute(text('SELECT 1')).scalar()
-            except Exception as e:
-                app.logger.error(f'Database connection error: {str(e)}')
-                db.session.rollback()
-                # Don't raise the error, let the request continue
-    
-    @app.after_request
-    def after_request(response):
-        # Only commit for non-static routes
-        if not request.path.startswith('/static/'):
-            try:
-                db.session.commit()
-            except Exception as e:
-                app.logger.error(f'Database commit error: {str(e)}')
-                db.session.rollback()
-        return response
-    
     # Add request timeout handling
     @app.before_request
     def timeout_handler():
@@ -235,9 +242,11 @@ def create_app(config_class=Config):
     # Add memory cleanup
     @app.teardown_appcontext
     def cleanup(error):
-        # Clean up any resources
-        db.session.remove()
+        # Sessions are scoped to the app context's id, which a later request on
+        # another thread or greenlet can reuse; roll back first so remove() is
+        # the last touch and no session outlives its context
         if error:
             db.session.rollback()
+        db.session.remove()
     
     return app 
\ No newline at end of file
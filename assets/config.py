@@ -1,8 +1,39 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy.pool import NullPool
 
 load_dotenv()
 
+
+def _pool_options():
+    """Per-process pool settings for SQLALCHEMY_ENGINE_OPTIONS.
+
+    DB_POOL_SIZE is what one worker can use at once (gunicorn_config.py sets
+    it to the worker's threads). With DB_CONNECTION_BUDGET, the most
+    connections all DB_WORKERS workers of the server may hold together, each
+    worker's pool and overflow are cut to its share. DB_PGBOUNCER=1 leaves the
+    pooling to PgBouncer in transaction mode: every checkout opens a
+    connection to it and closes it on return.
+    """
+    if os.environ.get('DB_PGBOUNCER', '').lower() in ('1', 'true'):
+        return {'poolclass': NullPool}
+    pool_size = int(os.environ.get('DB_POOL_SIZE', 3))
+    max_overflow = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    budget = int(os.environ.get('DB_CONNECTION_BUDGET', 0))
+    if budget:
+        share = max(1, budget // int(os.environ.get('DB_WORKERS', 1)))
+        pool_size = min(pool_size, share)
+        max_overflow = min(max_overflow, share - pool_size)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        # Longest wait for a connection before a 503; whole seconds, engine_from_config truncates it to an int
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 3)),
+        'pool_recycle': 1800,  # Recycle connections after 30 minutes
+        'pool_pre_ping': True,  # Enable connection health checks
+    }
+
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
@@ -10,10 +41,7 @@ class Config:
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace('postgres://', 'postgresql://', 1)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_size': 3,  # Reduced pool size
-        'max_overflow': 5,  # Reduced max overflow
-        'pool_recycle': 1800,  # Recycle connections after 30 minutes
-        'pool_pre_ping': True,  # Enable connection health checks
+        **_pool_options(),
         'connect_args': {
             'sslmode': 'require',  # Force SSL
             'connect_timeout': 3,  # Reduced timeout
@@ -28,17 +56,80 @@ class Config:
     DISCORD_CLIENT_ID = os.environ.get('DISCORD_CLIENT_ID')
     DISCORD_CLIENT_SECRET = os.environ.get('DISCORD_CLIENT_SECRET')
     DISCORD_REDIRECT_URI = os.environ.get('DISCORD_REDIRECT_URI')
+    DISCORD_API_BASE_URL = os.environ.get('DISCORD_API_BASE_URL', 'https://discord.com/api')  # Point at a stub server in tests
+    DISCORD_API_TIMEOUT = (3, 5)  # (connect, read) seconds for each Discord API call
+    DISCORD_API_MAX_RATE_LIMIT_WAIT = 2  # Longest rate-limit reset worth waiting out during a request
+    DISCORD_GUILDS_CACHE_TIMEOUT = 60  # Seconds a token's guild list is reused across logins
     
     # Session configuration
     PERMANENT_SESSION_LIFETIME = 3600  # 1 hour
     SESSION_COOKIE_SECURE = True
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+    SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH')  # SQLite session store; defaults to instance/sessions.sqlite3
+    SESSION_REFRESH_INTERVAL = 3600  # Seconds an unchanged session goes before its expiry is pushed forward
+    SESSION_SWEEP_INTERVAL = 600  # Seconds between background deletes of expired sessions (0 disables)
+    PERMISSION_SNAPSHOT_TTL = 300  # Seconds before a session's roles and guild access are re-read from the DB
     
     # Application settings
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     SEND_FILE_MAX_AGE_DEFAULT = 31536000  # 1 year cache for static files
+    ACTIVITY_CHART_MAX_DAYS = 365  # Longest range /activity-chart will bucket
+    LEADERBOARD_TOTAL_TTL = 60  # Seconds a guild's leaderboard member count is reused across pages
+    GUILD_STATS_ACTIVE_WINDOW = 86400  # Seconds since their last XP for a member to count as active
+    GUILD_STATS_ACTIVE_REFRESH = 60  # Seconds between recounts of guild_stats.active_count (0 disables)
+    GUILD_ETAG_INTERVAL = 60  # Seconds a guild API ETag stays valid when the guild's data doesn't change
+    EVENTS_ICAL_PAST_DAYS = 90  # Days of past events kept in the guild calendar feed
+    EVENTS_ICAL_TOKEN_MAX_AGE = 180 * 86400  # Seconds a calendar subscription link works before members must re-subscribe
+    API_GZIP_MIN_SIZE = 1024  # Bytes below which JSON responses are sent uncompressed
+    API_GZIP_LEVEL = 6  # zlib level for compressed JSON responses
+
+    # Live activity stream (services/activity_stream.py, served by gunicorn_stream_config.py)
+    ACTIVITY_STREAM_ENABLED = os.environ.get('ACTIVITY_STREAM_ENABLED', '').lower() in ('1', 'true')  # Overview page subscribes
+    ACTIVITY_STREAM_WORKER = os.environ.get('ACTIVITY_STREAM_WORKER', '').lower() in ('1', 'true')  # This process may hold streams
+    ACTIVITY_STREAM_POLL = 2  # Seconds between a guild watcher's version checks
+    ACTIVITY_STREAM_OVERLAP = 10  # Seconds each read looks back for rows committed late
+    ACTIVITY_STREAM_HEARTBEAT = 15  # Seconds between keepalive comments on an idle stream
+    ACTIVITY_STREAM_QUEUE = 100  # Undelivered events before a slow subscriber is dropped
+
+    # SQL instrumentation (assets/middleware/query_tracking.py)
+    SQL_TRACKING_SAMPLE_RATE = float(os.environ.get('SQL_TRACKING_SAMPLE_RATE', 0.01))  # Share of requests whose statements are tallied
+    SQL_SLOW_QUERY_MS = int(os.environ.get('SQL_SLOW_QUERY_MS', 250))  # Statements at least this slow go to logs/slow_queries.log
+    SQL_REPEAT_THRESHOLD = 10  # Runs of one statement in a sampled request that get logged as a likely N+1
+    SQL_SERVER_TIMING = os.environ.get('SQL_SERVER_TIMING', '').lower() in ('1', 'true')  # Server-Timing header on sampled responses
+
+    # Prometheus metrics (assets/middleware/metrics.py)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # /metrics requires "Authorization: Bearer <token>"; unset, it only answers in debug or testing
+
+    # On-demand profiler (assets/middleware/profiler.py, /admin/profiles)
+    PROFILER_DIR = 'logs/profiles'
+    PROFILER_INTERVAL = 0.005  # Seconds between stack samples of a profiled request
+    PROFILER_MAX_ACTIVE = 2  # Requests profiled at once per worker; others run unprofiled
+    PROFILER_MAX_SAMPLES = 2000  # Samples kept per request (10 seconds at the default interval)
+    PROFILER_KEEP = 200  # Saved profiles kept; the oldest are deleted first
+    PROFILER_RULE_MAX_MINUTES = 60  # Longest a sampling rule can stay on
+    PROFILER_RULES_REFRESH = 5  # Seconds a worker reuses the sampling rules before re-reading them
+
+    # Per-request memory accounting (assets/middleware/memory_tracking.py); tracemalloc slows
+    # allocation-heavy requests, so turn it on for a canary or staging run, then `flask memory report`
+    MEMORY_TRACKING = os.environ.get('MEMORY_TRACKING', '').lower() in ('1', 'true')
+    MEMORY_TRACKING_FRAMES = 10  # Frames kept per allocation on requests traced for allocation sites
+    MEMORY_TRACKING_SITES_EVERY = 50  # Requests to a route between allocation-site snapshots; the first always gets one
+    MEMORY_TRACKING_DIR = 'logs/memory'
+    MEMORY_TRACKING_FLUSH = 30  # Seconds between writes of a worker's figures (and RSS readings) to MEMORY_TRACKING_DIR
+
+    # Shared cache (see assets/utils/shared_cache.py)
+    CACHE_DIR = os.environ.get('CACHE_DIR')  # Defaults to /dev/shm/<app>-<uid>; must be ours and not writable by others
+    CACHE_THRESHOLD = 5000  # Entries kept before least recently used ones are evicted
+    GUILD_CACHE_TIMEOUTS = {  # Seconds per cached guild payload; writes invalidate sooner
+        'stats': 60,
+        'info': 300,
+        'achievements': 300,
+    }
     
+    # Answer for requests that timed out waiting on the pool (assets/middleware/db_pool.py)
+    DB_POOL_RETRY_AFTER = 5  # Seconds sent in Retry-After
+
     # Worker settings
     WORKER_TIMEOUT = 30  # 30 seconds timeout
     WORKER_KEEPALIVE = 5  # 5 seconds keepalive 
\ No newline at end of file
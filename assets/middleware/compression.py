@@ -0,0 +1,33 @@
+"""
+gzip for JSON API responses.
+
+Responses of at least API_GZIP_MIN_SIZE bytes are compressed for clients that
+accept gzip; below that the CPU costs more than the bytes saved. Since the
+compressed bytes differ from the identity ones, a strong ETag on a
+compressed response gets GZIP_ETAG_SUFFIX (middleware/etags.py accepts both
+forms back in If-None-Match).
+"""
+import gzip
+from flask import current_app, request
+
+GZIP_ETAG_SUFFIX = '-gzip'
+
+
+def gzip_json_response(response):
+    """after_request hook: gzip a JSON body if it's big enough and the client accepts gzip."""
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or response.status_code in (204, 206, 304) or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config['API_GZIP_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=current_app.config['API_GZIP_LEVEL'], mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + GZIP_ETAG_SUFFIX)
+    return response
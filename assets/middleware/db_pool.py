@@ -0,0 +1,70 @@
+"""
+Connection pool guards: a fresh pool after fork, and a fast 503 when the pool is exhausted.
+
+A process forked after the engine connected (gunicorn --preload,
+multiprocessing) would share the parent's pooled sockets, so every app
+drops its inherited pool in the child without closing the parent's
+connections.
+
+A checkout that waits longer than DB_POOL_TIMEOUT raises
+sqlalchemy.exc.TimeoutError. Most views catch every exception and answer
+400 or 500 with the error text, so TimedQueuePool also marks the request
+(g.db_pool_exhausted) and any error response to a marked request is
+replaced with a 503 carrying Retry-After. Clients and the load balancer
+back off instead of the request sitting in the pool queue until the worker
+timeout kills it.
+"""
+import math
+import os
+import weakref
+
+from flask import current_app, g, jsonify, request
+from sqlalchemy import exc
+
+_apps = weakref.WeakSet()
+
+
+def _dispose_inherited_pools():
+    for app in list(_apps):
+        db = app.extensions.get('sqlalchemy')
+        if db is None:
+            continue
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)  # The parent still owns those sockets
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_inherited_pools)
+
+
+def pool_exhausted_response():
+    """503 telling the client when to retry; built without touching the database"""
+    retry_after = str(math.ceil(current_app.config['DB_POOL_RETRY_AFTER']))
+    message = "The server is busy, please retry shortly"
+    if request.path.startswith('/api/'):
+        response = jsonify({"success": False, "message": message})
+    else:
+        # Rendered straight from the environment: the context processors load current_user from the database
+        response = current_app.make_response(current_app.jinja_env.get_template('errors/503.html').render())
+    response.status_code = 503
+    response.headers['Retry-After'] = retry_after
+    return response
+
+
+def init_db_pool(app):
+    """Dispose the app's pool after fork and turn pool checkout timeouts into 503s"""
+    _apps.add(app)
+
+    @app.errorhandler(exc.TimeoutError)
+    def pool_timeout_error(error):
+        app.logger.warning(f"Database pool exhausted on {request.path}: {str(error)}")
+        return pool_exhausted_response()
+
+    @app.after_request
+    def replace_pool_timeout_errors(response):
+        # Views that catch the TimeoutError themselves answer with their own status and message
+        if g.get('db_pool_exhausted') and response.status_code >= 400 and response.status_code != 503:
+            app.logger.warning(f"Database pool exhausted on {request.path}, answering 503")
+            return pool_exhausted_response()
+        return response
@@ -0,0 +1,55 @@
+"""
+Conditional GETs for polled guild API endpoints.
+
+@guild_etag derives a strong ETag from the guild's data version
+(services/guild_versions.py), the endpoint and its query string, and answers
+a matching If-None-Match with 304 before the view runs, so a dashboard whose
+guild hasn't changed costs one primary key lookup per poll.
+
+Some payloads move with the clock alone (active member counts, "5 minutes
+ago", today's chart column), so the ETag also carries the current
+GUILD_ETAG_INTERVAL time bucket and changes at least that often.
+"""
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, make_response, request
+from flask_login import current_user
+from .compression import GZIP_ETAG_SUFFIX
+from ..services.guild_versions import request_guild_version
+
+
+def guild_etag_for(guild_id):
+    """The ETag of the current request's view of guild_id."""
+    bucket = int(time.time() // current_app.config['GUILD_ETAG_INTERVAL'])
+    key = f"{request.endpoint}|{request.query_string.decode('latin-1')}|{guild_id}|{request_guild_version(guild_id)}|{bucket}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def guild_etag(f):
+    """Decorator for GET views whose response depends only on the guild's data.
+
+    Goes under @login_required. Users who can't view the guild fall through
+    to the view and get its permission error instead of a 304.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        guild_id = kwargs.get('guild_id')
+        if not current_user.can_view_guild(guild_id):
+            return f(*args, **kwargs)
+
+        # The view's cached reads are keyed on the same request_guild_version, so tag and body agree
+        etag = guild_etag_for(guild_id)
+        matched = next((tag for tag in (etag, etag + GZIP_ETAG_SUFFIX) if request.if_none_match.contains_weak(tag)), None)
+        if matched:
+            etag = matched
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        # Browsers keep the body but revalidate on every poll
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
@@ -0,0 +1,388 @@
+"""
+Optional per-request memory accounting (MEMORY_TRACKING=1).
+
+tracemalloc traces every allocation while this is on, which slows
+allocation-heavy requests down, so it is meant for a canary worker or a
+staging run rather than the whole fleet.
+
+For each request the traced peak above the starting level is recorded,
+together with what the request left allocated ("retained") and, for
+routes with a guild_id, the guild's member count as the input size.
+tracemalloc's counters are per process, so a request that overlapped
+another one in the same worker (gthread, gevent) is counted but not
+measured. Retained memory runs from the request's start to the next
+request's start, so what the app context frees after the response (the
+database session, for one) isn't counted. Tracing keeps a single frame per
+allocation, which is all these figures need.
+
+The first request to each route, and every MEMORY_TRACKING_SITES_EVERY-th
+after it, is traced with MEMORY_TRACKING_FRAMES frames instead, to find
+its top allocation sites in assets/: tracing restarts at that depth so
+every trace belongs to the request, and a watcher thread snapshots the
+heap as its usage climbs. The snapshots are traced too, so those
+requests' sizes are not recorded.
+
+Each worker writes its figures, plus its RSS after every flush, to
+MEMORY_TRACKING_DIR. `flask memory report` merges the files and flags
+routes whose peak grows with guild size, routes that retain memory, and
+workers whose RSS keeps growing.
+"""
+import json
+import math
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+import click
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from sqlalchemy import text
+
+from .profiler import _sleep, _start_thread
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PROJECT_FILES = os.path.join(PROJECT_ROOT, 'assets', '*')
+
+SAMPLES_KEPT = 200  # (size, peak) pairs kept per route for the scaling fit
+CHECKPOINTS_KEPT = 120  # RSS readings kept per worker
+TOP_SITES = 5
+MEMBER_COUNT_TTL = 60  # Seconds a guild's member count is reused as its input size
+
+# Report thresholds
+SCALING_EXPONENT = 0.5  # Peak growing at least as fast as size ** 0.5 is flagged
+SCALING_MIN_RANGE = 10  # Largest over smallest guild size needed before fitting
+RETAINED_BYTES = 16 * 1024  # Mean memory left behind per request that is flagged
+RETAINED_MIN_REQUESTS = 20
+WORKER_RETAINED_BYTES = 4 * 1024 * 1024  # Memory a worker's requests leave behind per 1000 requests that is flagged
+# Warm-up and allocator churn alone grew a traced worker's RSS by up to 11MB per 1000 requests in local runs
+RSS_GROWTH_BYTES = 32 * 1024 * 1024  # Worker RSS growth per 1000 requests (after the first flush) that is flagged
+RSS_MIN_REQUESTS = 1000  # Requests between a worker's readings needed before judging its trend
+
+
+def rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Peak, not current, off Linux
+
+
+class RouteMemory:
+    """Measurements of one endpoint's requests in this worker."""
+
+    __slots__ = ('requests', 'overlapped', 'measured', 'peak_total', 'peak_max', 'retained_measured',
+                 'retained_total', 'samples', 'sites', 'sites_peak')
+
+    def __init__(self):
+        self.requests = 0
+        self.overlapped = 0
+        self.measured = 0
+        self.peak_total = 0
+        self.peak_max = 0
+        self.retained_measured = 0
+        self.retained_total = 0
+        self.samples = deque(maxlen=SAMPLES_KEPT)  # (input size, peak bytes)
+        self.sites = None
+        self.sites_peak = 0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'overlapped': self.overlapped,
+            'measured': self.measured,
+            'peak_total': self.peak_total,
+            'peak_max': self.peak_max,
+            'retained_measured': self.retained_measured,
+            'retained_total': self.retained_total,
+            'samples': list(self.samples),
+            'sites': self.sites,
+            'sites_peak': self.sites_peak,
+        }
+
+
+class SiteWatcher:
+    """Snapshots the heap from a background thread each time a request's usage grows by half."""
+
+    def __init__(self, frames, interval=0.002):
+        self.interval = interval
+        self.snapshot = None
+        self.peak = 0
+        self.done = False
+        tracemalloc.stop()  # Drops the earlier traces, so everything traced from here on is the request's
+        tracemalloc.start(frames)
+        self.level = 1024 * 1024  # Below 1MB the end-of-request snapshot says enough
+        _start_thread(self._run, ())
+
+    def _run(self):
+        while not self.done:
+            current = tracemalloc.get_traced_memory()[0]
+            if current >= self.level:
+                self.snapshot, self.peak = tracemalloc.take_snapshot(), current
+                self.level = current * 1.5
+            _sleep(self.interval)
+
+    def stop(self):
+        """Top sites in assets/ at the request's largest snapshot, as [[file:line, bytes], ...]
+
+        Tracing goes back to a single frame afterwards.
+        """
+        self.done = True
+        current = tracemalloc.get_traced_memory()[0]
+        if self.snapshot is None or current > self.peak:
+            self.snapshot, self.peak = tracemalloc.take_snapshot(), current
+        tracemalloc.stop()
+        tracemalloc.start(1)
+        top = sorted(_by_project_line(self.snapshot).items(), key=lambda item: -item[1])
+        return [list(item) for item in top[:TOP_SITES]]
+
+
+def _by_project_line(snapshot):
+    """{file:line: bytes}, each allocation charged to the innermost project frame that made it"""
+    sizes = {}
+    project = snapshot.filter_traces([
+        tracemalloc.Filter(True, PROJECT_FILES, all_frames=True),
+        tracemalloc.Filter(False, __file__),  # The watcher's own bookkeeping
+    ])
+    for trace in project.traces:
+        for frame in reversed(trace.traceback):  # Innermost last
+            if frame.filename.startswith(PROJECT_ROOT):
+                site = f"{os.path.relpath(frame.filename, PROJECT_ROOT)}:{frame.lineno}"
+                sizes[site] = sizes.get(site, 0) + trace.size
+                break
+    return sizes
+
+
+class WorkerMemory:
+    """Per-process request measurements and RSS readings, flushed to a JSON file."""
+
+    def __init__(self, directory, frames, sites_every, flush_interval):
+        self.directory = directory
+        self.frames = frames
+        self.sites_every = sites_every
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.in_flight = 0
+        self.epoch = 0  # Bumped on every request start and end, so a request can tell if it overlapped another
+        self.requests = 0
+        self.retained = 0  # Summed over measured requests
+        self.previous = None  # (route, traced bytes at its start, epoch after it ended) of the last measured request
+        self.started = time.time()
+        self.checkpoints = deque(maxlen=CHECKPOINTS_KEPT)  # (requests served, RSS, retained so far)
+        self.last_flush = time.monotonic()
+        self.member_counts = {}
+
+    def begin(self):
+        with self.lock:
+            alone = self.in_flight == 0
+            if alone and self.previous is not None and self.previous[2] == self.epoch:
+                previous, start = self.previous[:2]
+                retained = tracemalloc.get_traced_memory()[0] - start
+                previous.retained_measured += 1
+                previous.retained_total += retained
+                self.retained += retained
+            self.previous = None
+            self.in_flight += 1
+            self.epoch += 1
+            route = self.routes.setdefault(request.endpoint or '<unmatched>', RouteMemory())
+            route.requests += 1
+            detailed = alone and (route.requests - 1) % self.sites_every == 0
+            epoch = self.epoch
+        watcher = SiteWatcher(self.frames) if detailed else None
+        if alone and not watcher:
+            tracemalloc.reset_peak()
+        g.memory = {'epoch': epoch, 'alone': alone, 'route': route, 'watcher': watcher,
+                    'start': tracemalloc.get_traced_memory()[0]}
+
+    def end(self, state, peak, size):
+        route = state['route']
+        watcher = state['watcher']
+        with self.lock:
+            clean = state['alone'] and self.epoch == state['epoch']
+            self.in_flight -= 1
+            self.epoch += 1
+            self.requests += 1
+            if clean and not watcher:
+                self.previous = (route, state['start'], self.epoch)
+        if watcher:
+            sites = watcher.stop()
+            if clean and (route.sites is None or watcher.peak >= route.sites_peak):
+                route.sites, route.sites_peak = sites, watcher.peak
+        if not clean:
+            route.overlapped += 1
+        elif not watcher:
+            peak -= state['start']
+            route.measured += 1
+            route.peak_total += peak
+            route.peak_max = max(route.peak_max, peak)
+            if size is not None:
+                route.samples.append((size, peak))
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def input_size(self):
+        """Member count of the request's guild, or None for routes without a guild_id"""
+        guild_id = (request.view_args or {}).get('guild_id')
+        if guild_id is None:
+            return None
+        cached = self.member_counts.get(guild_id)
+        if cached and time.monotonic() - cached[1] < MEMBER_COUNT_TTL:
+            return cached[0]
+        from .. import db
+        count = db.session.execute(text("SELECT member_count FROM guild_stats WHERE guild_id = :guild_id"),
+                                   {'guild_id': str(guild_id)}).scalar() or 0
+        self.member_counts[guild_id] = (count, time.monotonic())
+        return count
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        self.checkpoints.append((self.requests, rss_bytes(), self.retained))
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({
+                'pid': os.getpid(),
+                'started': self.started,
+                'updated': time.time(),
+                'requests': self.requests,
+                'checkpoints': list(self.checkpoints),
+                'routes': {endpoint: route.as_dict() for endpoint, route in self.routes.items()},
+            }, f)
+        os.replace(path + '.tmp', path)
+
+
+def init_memory_tracking(app):
+    """Start tracemalloc and measure every request, when MEMORY_TRACKING is on"""
+    if not app.config['MEMORY_TRACKING']:
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(1)
+    worker = WorkerMemory(app.config['MEMORY_TRACKING_DIR'], app.config['MEMORY_TRACKING_FRAMES'],
+                          app.config['MEMORY_TRACKING_SITES_EVERY'], app.config['MEMORY_TRACKING_FLUSH'])
+
+    @app.before_request
+    def begin_memory_measurement():
+        worker.begin()
+
+    @app.teardown_request
+    def end_memory_measurement(error):
+        state = g.pop('memory', None)
+        if state is None:
+            return
+        # Read before the size lookup, so its query isn't charged to the request
+        peak = tracemalloc.get_traced_memory()[1]
+        size = None
+        try:
+            size = worker.input_size()
+        except Exception as e:
+            current_app.logger.warning(f"Memory tracking could not size {request.path}: {str(e)}")
+        worker.end(state, peak, size)
+
+
+def _merge(workers):
+    routes = {}
+    for worker in workers:
+        for endpoint, figures in worker['routes'].items():
+            route = routes.setdefault(endpoint, {
+                'requests': 0, 'overlapped': 0, 'measured': 0, 'peak_total': 0, 'peak_max': 0,
+                'retained_measured': 0, 'retained_total': 0, 'samples': [], 'sites': None, 'sites_peak': -1,
+            })
+            for key in ('requests', 'overlapped', 'measured', 'peak_total', 'retained_measured', 'retained_total'):
+                route[key] += figures[key]
+            route['peak_max'] = max(route['peak_max'], figures['peak_max'])
+            route['samples'] += figures['samples']
+            if figures['sites'] is not None and figures['sites_peak'] > route['sites_peak']:
+                route['sites'], route['sites_peak'] = figures['sites'], figures['sites_peak']
+    return routes
+
+
+def scaling_exponent(samples):
+    """k in peak ~ size ** k, fitted on the median peak at each guild size, or None without a wide enough range"""
+    by_size = {}
+    for size, peak in samples:
+        if size > 0 and peak > 0:
+            by_size.setdefault(size, []).append(peak)
+    if len(by_size) < 2 or max(by_size) < SCALING_MIN_RANGE * min(by_size):
+        return None
+    points = [(math.log(size), math.log(sorted(peaks)[len(peaks) // 2])) for size, peaks in by_size.items()]
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def _growth_per_1000(checkpoints, column):
+    """Growth of a checkpoint column per 1000 requests, skipping the first reading as warm-up"""
+    later = checkpoints[1:]
+    if len(later) < 2 or later[-1][0] - later[0][0] < RSS_MIN_REQUESTS:
+        return None
+    return (later[-1][column] - later[0][column]) / (later[-1][0] - later[0][0]) * 1000
+
+
+def _kb(size):
+    return f"{size / 1024:,.0f}KB"
+
+
+memory_cli = AppGroup('memory', help='Per-request memory figures recorded with MEMORY_TRACKING.')
+
+
+@memory_cli.command('report')
+@click.option('--check', is_flag=True, help='Exit with status 1 if any route or worker is flagged.')
+def report_command(check):
+    """Merge the workers' figures and flag size-proportional peaks, retained memory and RSS growth."""
+    directory = current_app.config['MEMORY_TRACKING_DIR']
+    workers = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.json'):
+                with open(os.path.join(directory, name)) as f:
+                    workers.append(json.load(f))
+    if not workers:
+        click.echo(f"No figures in {directory}; run the app with MEMORY_TRACKING=1 first")
+        return
+
+    flagged = False
+    click.echo(f"{'endpoint':45} {'measured':>8} {'mean peak':>10} {'max peak':>10} {'retained':>9}  scaling")
+    routes = _merge(workers)
+    for endpoint, route in sorted(routes.items(), key=lambda item: -item[1]['peak_max']):
+        measured = route['measured']
+        mean_peak = route['peak_total'] / measured if measured else 0
+        retained = route['retained_total'] / route['retained_measured'] if route['retained_measured'] else 0
+        exponent = scaling_exponent(route['samples'])
+        flags = []
+        if exponent is not None and exponent >= SCALING_EXPONENT:
+            flags.append('grows with guild size')
+        if route['retained_measured'] >= RETAINED_MIN_REQUESTS and retained >= RETAINED_BYTES:
+            flags.append('retains memory')
+        scaling = f"size^{exponent:.2f}" if exponent is not None else '-'
+        click.echo(f"{endpoint:45} {measured:>8} {_kb(mean_peak):>10} {_kb(route['peak_max']):>10} "
+                   f"{_kb(retained):>9}  {scaling}{'  <- ' + ', '.join(flags) if flags else ''}")
+        if flags and route['sites']:
+            for site, size in route['sites']:
+                click.echo(f"    {_kb(size):>10}  {site}")
+        flagged = flagged or bool(flags)
+
+    click.echo('')
+    for worker in workers:
+        rss = _growth_per_1000(worker['checkpoints'], 1)
+        retained = _growth_per_1000(worker['checkpoints'], 2)
+        current_rss = worker['checkpoints'][-1][1] if worker['checkpoints'] else 0
+        line = f"worker {worker['pid']}: {worker['requests']} requests, RSS {current_rss / 1024 / 1024:.0f}MB"
+        if rss is None:
+            click.echo(f"{line}, too few readings for a trend")
+            continue
+        line += f", RSS {rss / 1024:+,.0f}KB and retained {retained / 1024:+,.0f}KB per 1000 requests"
+        if retained >= WORKER_RETAINED_BYTES:
+            line += '  <- requests leave Python objects behind (leak)'
+            flagged = True
+        elif rss >= RSS_GROWTH_BYTES:
+            line += '  <- RSS growing without retained Python memory (fragmentation or native memory)'
+            flagged = True
+        click.echo(line)
+
+    if check and flagged:
+        raise SystemExit(1)
@@ -0,0 +1,159 @@
+"""
+Prometheus metrics for the dashboard, served at /metrics.
+
+Gunicorn workers each hold their own counters, so gunicorn_config.py points
+PROMETHEUS_MULTIPROC_DIR at a directory on tmpfs: every worker writes its
+samples to memory-mapped files there and a scrape of any worker adds up the
+files of all of them. Without that variable (flask run, scripts) the
+metrics cover the current process only.
+
+Exported:
+- request latency per blueprint, endpoint and method, request counts by
+  status, and requests in progress
+- connection pool checkouts, connections in use and in overflow, and the
+  time each checkout took (TimedQueuePool)
+- cache hits, misses and evictions from the shared cache's own counters
+- latency of each outbound Discord API call by route and status
+"""
+import os
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+REQUEST_LATENCY = Histogram(
+    'cldashboard_http_request_duration_seconds', 'Time to build the response',
+    ['blueprint', 'endpoint', 'method']
+)
+REQUESTS = Counter(
+    'cldashboard_http_requests_total', 'Responses sent',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'cldashboard_http_requests_in_progress', 'Requests being handled', multiprocess_mode='livesum'
+)
+
+POOL_CHECKOUTS = Counter('cldashboard_db_pool_checkouts_total', 'Connections handed out by the pool')
+POOL_TIMEOUTS = Counter('cldashboard_db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+POOL_CHECKOUT_LATENCY = Histogram(
+    'cldashboard_db_pool_checkout_seconds',
+    'Time to hand out a connection: waiting for a free one or opening a new one, plus the pre-ping',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+POOL_SIZE = Gauge('cldashboard_db_pool_size', 'Connections kept open by the pool', multiprocess_mode='livesum')
+POOL_CHECKED_OUT = Gauge('cldashboard_db_pool_checked_out', 'Connections in use', multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge(
+    'cldashboard_db_pool_overflow', 'Connections open beyond the pool size (up to max_overflow)',
+    multiprocess_mode='livesum'
+)
+
+DISCORD_LATENCY = Histogram(
+    'cldashboard_discord_request_duration_seconds', 'Outbound Discord API calls',
+    ['method', 'route', 'status']
+)
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports checkouts, usage and checkout latency.
+
+    Passed as the default poolclass to Flask-SQLAlchemy, so
+    SQLALCHEMY_ENGINE_OPTIONS (pool_size, max_overflow, pool_timeout) still
+    configure it; recreate() keeps the class, so it survives dispose().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        POOL_SIZE.set(self.size())
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.inc()
+            if has_request_context():
+                g.db_pool_exhausted = True  # Answered with a 503 even if the view catches it (middleware/db_pool.py)
+            raise
+        finally:
+            POOL_CHECKOUT_LATENCY.observe(time.perf_counter() - started)
+        POOL_CHECKOUTS.inc()
+        self._report_usage()
+        return connection
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._report_usage()
+
+    def _report_usage(self):
+        POOL_CHECKED_OUT.set(self.checkedout())
+        POOL_OVERFLOW.set(max(0, self.overflow()))
+
+
+class CacheCollector:
+    """Cache hit/miss/eviction totals, read from the cache backend's stats() at scrape time.
+
+    SharedMemoryCache already sums its counters across workers, so they are
+    exported as they are rather than through the multiprocess files.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.stats()
+        requests = CounterMetricFamily('cldashboard_cache_requests', 'Cache lookups', labels=['result'])
+        requests.add_metric(['hit'], stats['hits'])
+        requests.add_metric(['miss'], stats['misses'])
+        yield requests
+        yield CounterMetricFamily('cldashboard_cache_evictions', 'Entries evicted to stay under the threshold',
+                                  value=stats['evictions'])
+        yield GaugeMetricFamily('cldashboard_cache_entries', 'Entries in the cache', value=stats['entries'])
+        yield GaugeMetricFamily('cldashboard_cache_size_bytes', 'Size of the cached values', value=stats['size_bytes'])
+
+
+def observe_discord_call(method, route, status, started):
+    """Record a Discord API call that began at perf_counter() value started"""
+    DISCORD_LATENCY.labels(method, route, str(status)).observe(time.perf_counter() - started)
+
+
+def render_metrics(app):
+    """The metrics of every worker (or of this process) in the Prometheus text format"""
+    registry = CollectorRegistry()
+    if MULTIPROCESS:
+        MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    cache = app.cache.cache
+    if hasattr(cache, 'stats'):
+        registry.register(CacheCollector(cache))
+    return generate_latest(registry)
+
+
+def init_metrics(app):
+    """Time every request. Register before other before_request hooks so their work is included."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            # Unmatched URLs share one label so scanners can't create new series
+            labels = (request.blueprint or '', request.endpoint or '<unmatched>', request.method)
+            REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - started)
+            REQUESTS.labels(*labels, str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def finish_request(error):
+        if g.pop('request_started', None) is not None:
+            REQUESTS_IN_PROGRESS.dec()
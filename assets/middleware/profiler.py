@@ -0,0 +1,282 @@
+"""
+On-demand sampling profiler for owners.
+
+A request is profiled when an owner adds ?_profile=1 to its URL, or when a
+sampling rule set on /admin/profiles picks it (1 in N requests to an
+endpoint, until the rule expires). Rules live in the shared cache, so every
+worker follows them.
+
+Profiling doesn't trace calls. One sampler thread per worker wakes every
+PROFILER_INTERVAL seconds, reads the stacks of the threads that are serving
+profiled requests from sys._current_frames() and counts them. Everything
+below the request's full_dispatch_request frame is dropped. Under gevent,
+while another greenlet holds the thread the request's own greenlet is
+sampled where it is suspended, so waits on the database or Discord still
+show up. Unprofiled
+requests only pay a dict lookup, and at most PROFILER_MAX_ACTIVE requests
+per worker are profiled at once.
+
+Each profile is saved as collapsed stacks (`frame;frame;frame count`, the
+input format of flamegraph.pl and speedscope) in PROFILER_DIR, next to a
+JSON file describing the request.
+"""
+import _thread
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import Flask, current_app, g, request
+from flask_login import current_user
+
+try:
+    from gevent import monkey
+    from greenlet import getcurrent
+except ImportError:  # Plain threads only
+    monkey = getcurrent = None
+
+
+def _original(module, name, default):
+    """The unpatched function, so the sampler stays a real thread under gevent"""
+    return monkey.get_original(module, name) if monkey else default
+
+
+_start_thread = _original('_thread', 'start_new_thread', _thread.start_new_thread)
+_allocate_lock = _original('_thread', 'allocate_lock', _thread.allocate_lock)
+_get_ident = _original('_thread', 'get_ident', _thread.get_ident)
+_sleep = _original('time', 'sleep', time.sleep)
+
+RULES_CACHE_KEY = 'profiler:rules'
+
+# Longest sys.path prefix first, so frames show as package/module.py
+_PATH_PREFIXES = sorted({os.path.join(path, '') for path in sys.path if path}, key=len, reverse=True)
+
+
+def _short_path(filename):
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+class Profile:
+    """Stack samples of one request."""
+
+    def __init__(self, thread_id, anchor, endpoint, method, path, trigger):
+        self.thread_id = thread_id
+        self.greenlet = getcurrent() if getcurrent else None
+        self.anchor = anchor
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started = time.time()
+        self.started_counter = time.perf_counter()
+        self.duration = None
+        self.status = None
+        self.samples = 0
+        self.stacks = Counter()  # ((code, line), ...) outermost first -> samples
+
+
+class Sampler:
+    """Samples the stacks of every active Profile from one background thread per process."""
+
+    def __init__(self, interval=0.005, max_active=2, max_samples=2000):
+        self.interval = interval
+        self.max_active = max_active
+        self.max_samples = max_samples
+        self._lock = _allocate_lock()
+        self._active = {}
+        self._running = False
+
+    def start(self, anchor, endpoint, method, path, trigger):
+        """Begin sampling the calling thread; None when max_active requests are already profiled"""
+        profile = Profile(_get_ident(), anchor, endpoint, method, path, trigger)
+        with self._lock:
+            if len(self._active) >= self.max_active:
+                return None
+            self._active[id(profile)] = profile
+            if not self._running:
+                self._running = True
+                _start_thread(self._run, ())
+        return profile
+
+    def stop(self, profile):
+        with self._lock:
+            self._active.pop(id(profile), None)
+        profile.duration = time.perf_counter() - profile.started_counter
+        return profile
+
+    def _run(self):
+        while True:
+            _sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    self._running = False  # Restarted by the next start()
+                    return
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    if profile.samples < self.max_samples:
+                        self._sample(profile, frames.get(profile.thread_id))
+
+    @staticmethod
+    def _stack(frame, anchor):
+        """Frames from frame out to anchor, or None when anchor isn't among them"""
+        stack = []
+        while frame is not None and frame is not anchor:
+            stack.append((frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        if frame is None and anchor is not None:
+            return None
+        return tuple(reversed(stack))
+
+    def _sample(self, profile, frame):
+        stack = self._stack(frame, profile.anchor)
+        if stack is None and profile.greenlet is not None:
+            # Another greenlet is running; the request's is parked in a switch
+            stack = self._stack(profile.greenlet.gr_frame, profile.anchor)
+        if stack is None:
+            return
+        profile.samples += 1
+        profile.stacks[stack] += 1
+
+
+def _collapsed(profile):
+    lines = []
+    for stack, count in profile.stacks.most_common():
+        frames = ';'.join(f"{code.co_name} ({_short_path(code.co_filename)}:{line})" for code, line in stack)
+        lines.append(f"{frames or '<request>'} {count}")
+    return '\n'.join(lines) + '\n'
+
+
+def save_profile(app, profile):
+    """Write profile's collapsed stacks and description to PROFILER_DIR, then prune old profiles"""
+    directory = app.config['PROFILER_DIR']
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(profile.started))}-{os.getpid()}-{id(profile) % 100000}"
+    with open(os.path.join(directory, f'{profile_id}.collapsed'), 'w') as f:
+        f.write(_collapsed(profile))
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump({
+            'id': profile_id,
+            'endpoint': profile.endpoint,
+            'method': profile.method,
+            'path': profile.path,
+            'status': profile.status,
+            'trigger': profile.trigger,
+            'started': datetime.fromtimestamp(profile.started, timezone.utc).isoformat(),
+            'duration_ms': round(profile.duration * 1000, 1),
+            'samples': profile.samples,
+        }, f)
+    _prune(directory, app.config['PROFILER_KEEP'])
+    return profile_id
+
+
+def _prune(directory, keep):
+    # Profile ids start with their UTC timestamp, so name order is age order
+    described = sorted(name for name in os.listdir(directory) if name.endswith('.json'))
+    for name in described[:max(0, len(described) - keep)]:
+        for suffix in ('.json', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, name[:-len('.json')] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(app):
+    """Descriptions of the saved profiles, newest first"""
+    directory = app.config['PROFILER_DIR']
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # Pruned by another worker, or still being written
+    return profiles
+
+
+def profile_path(app, profile_id):
+    """Path of a saved profile's collapsed stacks, or None for an unknown id"""
+    if not profile_id.replace('-', '').isdigit():
+        return None
+    path = os.path.join(app.config['PROFILER_DIR'], f'{profile_id}.collapsed')
+    return os.path.abspath(path) if os.path.exists(path) else None
+
+
+def get_rules(app):
+    """{endpoint: {'every': N, 'expires': unix time}} of the sampling rules still in force"""
+    now = time.time()
+    rules = app.cache.get(RULES_CACHE_KEY) or {}
+    return {endpoint: rule for endpoint, rule in rules.items() if rule['expires'] > now}
+
+
+def set_rule(app, endpoint, every, minutes):
+    """Profile 1 in every requests to endpoint for the next minutes; every=0 removes the rule"""
+    rules = get_rules(app)
+    if every:
+        rules[endpoint] = {'every': every, 'expires': time.time() + minutes * 60}
+    else:
+        rules.pop(endpoint, None)
+    timeout = max((rule['expires'] for rule in rules.values()), default=time.time()) - time.time()
+    app.cache.set(RULES_CACHE_KEY, rules, timeout=max(1, int(timeout) + 1))
+
+
+def _anchor_frame():
+    """The full_dispatch_request frame the view runs under, or None when it can't be found"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code is not Flask.full_dispatch_request.__code__:
+        frame = frame.f_back
+    return frame
+
+
+def init_profiler(app):
+    """Profile owner-requested and rule-sampled requests"""
+    sampler = Sampler(
+        interval=app.config['PROFILER_INTERVAL'],
+        max_active=app.config['PROFILER_MAX_ACTIVE'],
+        max_samples=app.config['PROFILER_MAX_SAMPLES']
+    )
+    refresh = app.config['PROFILER_RULES_REFRESH']
+    rules = {'rules': {}, 'loaded': 0.0}  # This process's copy, re-read from the shared cache every refresh seconds
+
+    def sampled_by_rule():
+        now = time.monotonic()
+        if now - rules['loaded'] >= refresh:
+            rules['rules'], rules['loaded'] = get_rules(app), now
+        rule = rules['rules'].get(request.endpoint)
+        return rule is not None and rule['expires'] > time.time() and random.random() * rule['every'] < 1
+
+    @app.before_request
+    def start_profile():
+        if sampled_by_rule():
+            trigger = 'sample'
+        elif '_profile' in request.args and current_user.is_authenticated and current_user.is_owner:
+            trigger = 'owner'
+        else:
+            return
+        g.profile = sampler.start(_anchor_frame(), request.endpoint, request.method, request.full_path, trigger)
+
+    @app.after_request
+    def note_profile_status(response):
+        profile = g.get('profile')
+        if profile is not None:
+            profile.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(error):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        sampler.stop(profile)
+        try:
+            save_profile(current_app, profile)
+        except OSError as e:
+            current_app.logger.error(f"Could not save profile of {profile.path}: {str(e)}")
@@ -0,0 +1,132 @@
+"""
+Per-request SQL instrumentation.
+
+Engine event listeners time every statement, and any slower than
+SQL_SLOW_QUERY_MS goes to the slow-query log (logs/slow_queries.log) with
+the endpoint that ran it. That costs about 10us per statement
+(benchmarks/query_tracking.py), so it stays on for every request.
+
+A sampled SQL_TRACKING_SAMPLE_RATE of requests also collect a QueryStats:
+statement count, total database time, the slowest statement and how many
+times each statement ran. A statement repeated SQL_REPEAT_THRESHOLD times
+in one request, usually a lazy relationship loaded inside a loop (N+1), is
+logged as a warning. With SQL_SERVER_TIMING on, sampled responses carry a
+Server-Timing header that browser dev tools show next to the request.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from .. import db
+
+# Characters of a statement kept in log lines
+STATEMENT_LOG_LENGTH = 500
+
+
+class QueryStats:
+    """Statements run while handling one sampled request."""
+
+    __slots__ = ('count', 'duration', 'slowest', 'slowest_statement', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = 0.0
+        self.slowest_statement = None
+        self.statements = Counter()  # Statement text (parameters are bound separately) -> runs
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+        if duration > self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+    def repeated(self, threshold):
+        """(statement, runs) for statements run at least threshold times, most first."""
+        return [(statement, runs) for statement, runs in self.statements.most_common() if runs >= threshold]
+
+
+def current_query_stats():
+    """QueryStats of the current request, or None outside a sampled request."""
+    return g.get('query_stats') if has_request_context() else None
+
+
+def _one_line(statement):
+    return ' '.join(statement.split())[:STATEMENT_LOG_LENGTH]
+
+
+def _slow_query_logger(app):
+    logger = app.logger.getChild('slow_sql')
+    if not app.debug and not app.testing and not logger.handlers:
+        os.makedirs('logs', exist_ok=True)
+        handler = RotatingFileHandler('logs/slow_queries.log', maxBytes=1024 * 1024, backupCount=5)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+def init_query_tracking(app):
+    """Attach the statement timers to the app's engine and the sampling hooks to the app."""
+    slow_query = app.config['SQL_SLOW_QUERY_MS'] / 1000
+    sample_rate = app.config['SQL_TRACKING_SAMPLE_RATE']
+    repeat_threshold = app.config['SQL_REPEAT_THRESHOLD']
+    server_timing = app.config['SQL_SERVER_TIMING']
+    slow_log = _slow_query_logger(app)
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['query_started'].pop()
+        stats = current_query_stats()
+        if stats is not None:
+            stats.record(statement, duration)
+        if duration >= slow_query:
+            source = request.endpoint if has_request_context() else threading.current_thread().name
+            slow_log.info(f"{duration * 1000:.1f}ms {source} {_one_line(statement)}")
+
+    @event.listens_for(engine, 'handle_error')
+    def drop_timer(exception_context):
+        started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+        if started:
+            started.pop()
+
+    @app.before_request
+    def sample_queries():
+        if sample_rate and random.random() < sample_rate:
+            g.query_stats = QueryStats()
+
+    @app.after_request
+    def report_queries(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+        repeated = stats.repeated(repeat_threshold)
+        if repeated:
+            statement, runs = repeated[0]
+            app.logger.warning(
+                f"Possible N+1 in {request.method} {request.path} ({request.endpoint}): {stats.count} statements, "
+                f"{runs}x {_one_line(statement)}"
+            )
+        if server_timing:
+            queries = f"{stats.count} {'query' if stats.count == 1 else 'queries'}"
+            response.headers.add('Server-Timing', f'db;dur={stats.duration * 1000:.1f};desc="{queries}"')
+            if stats.count:
+                response.headers.add('Server-Timing', f'db-slowest;dur={stats.slowest * 1000:.1f}')
+        return response
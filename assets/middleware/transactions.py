@@ -0,0 +1,54 @@
+"""
+Read-only database transactions for safe (GET/HEAD/OPTIONS) requests.
+
+The session still checks out a connection only when the first query runs.
+For a safe request that connection comes from a read-only view of the same
+engine and pool, so psycopg2 opens the transaction with
+`BEGIN ... READ ONLY` at no extra round trip. Nothing commits it: the
+transaction is rolled back when the session is removed at teardown.
+
+A GET handler that has to write (the OAuth callback, pages that create
+default settings rows) opts out with @writes_allowed.
+"""
+import weakref
+from functools import wraps
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+_read_only_engines = weakref.WeakKeyDictionary()
+
+
+def writes_allowed(f):
+    """Decorator for safe-method views that need a read-write transaction"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        return f(*args, **kwargs)
+    decorated_function.writes_allowed = True
+    return decorated_function
+
+
+def is_read_only_request():
+    """True while handling a safe-method request whose view hasn't opted into writes"""
+    if not has_request_context() or request.method not in SAFE_METHODS:
+        return False
+    view = current_app.view_functions.get(request.endpoint)
+    return not getattr(view, 'writes_allowed', False)
+
+
+def _read_only_engine(engine):
+    read_only = _read_only_engines.get(engine)
+    if read_only is None:
+        read_only = _read_only_engines[engine] = engine.execution_options(postgresql_readonly=True)
+    return read_only
+
+
+class RequestSession(Session):
+    """Flask-SQLAlchemy session that binds safe requests to a read-only engine"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and engine.dialect.name == 'postgresql' and is_read_only_request():
+            return _read_only_engine(engine)
+        return engine
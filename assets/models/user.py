@@ -1,14 +1,15 @@
 from .. import db, login_manager
 from flask_login import UserMixin
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, func, ForeignKey, Integer, Boolean, JSON, Float
+from sqlalchemy import Column, String, DateTime, func, ForeignKey, Integer, BigInteger, Boolean, JSON, Float, Numeric
 from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Primary key is now String
-    return User.query.get(str(user_id))
+    # Served from the session's permission snapshot; the User row loads only when needed
+    from ..services.permissions import load_session_user
+    return load_session_user(user_id)
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -239,9 +240,83 @@ class ServerXpSettings(db.Model):
 # Add relationship to Guild Model (if needed, though likely querying events directly)
 # Guild.events = relationship('Event', backref='guild', lazy=True) 
 
+# --- XP Lookup Table ---
+class XpLevelTotal(db.Model):
+    __tablename__ = 'xp_level_totals'
+
+    # Materialized xp_utils.total_xp_for_level so cumulative XP can be summed in SQL.
+    # Rows are written by services.xp_levels.sync_level_totals, never by hand.
+    level = Column(Integer, primary_key=True)
+    total_xp = Column(Float, nullable=False) # XP needed to reach the START of this level
+
+    def __repr__(self):
+        return f"<XpLevelTotal level={self.level} total_xp={self.total_xp}>"
+
+# --- Per-Guild Summary ---
+class GuildStats(db.Model):
+    __tablename__ = 'guild_stats'
+
+    # Maintained by triggers on the bot's levels table (see the migrations), so the
+    # dashboard can read per-guild totals without scanning levels. No FK to guilds:
+    # the bot tracks guilds the dashboard may not have synced yet.
+    guild_id = Column(String, primary_key=True)
+    member_count = Column(Integer, nullable=False, default=0)
+    total_level = Column(BigInteger, nullable=False, default=0)
+    # Cumulative XP, exact so trigger deltas never drift. NULL (unknown) once a member
+    # reaches a level xp_level_totals doesn't cover, until `flask guild-stats reconcile`
+    total_xp = Column(Numeric, nullable=True, default=0)
+    # Members with XP inside GUILD_STATS_ACTIVE_WINDOW; refreshed periodically by
+    # services.guild_stats since it changes with the clock, not with writes
+    active_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<GuildStats guild={self.guild_id} members={self.member_count}>"
+
+class AchievementStats(db.Model):
+    __tablename__ = 'achievement_stats'
+
+    # Completed user_achievements rows per achievement, maintained by triggers on the
+    # bot's user_achievements table (see the migration) like GuildStats
+    guild_id = Column(String, primary_key=True)
+    achievement_id = Column(Integer, primary_key=True)
+    completed_count = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<AchievementStats achievement={self.achievement_id} completed={self.completed_count}>"
+
+class GuildDataVersion(db.Model):
+    __tablename__ = 'guild_data_versions'
+
+    # Bumped by dashboard writes and by triggers on the bot's levels and
+    # user_achievements tables; the ETags of the guild API derive from it
+    # (see services.guild_versions)
+    guild_id = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=1)
+
+    def __repr__(self):
+        return f"<GuildDataVersion guild={self.guild_id} version={self.version}>"
+
+class LevelUpLog(db.Model):
+    __tablename__ = 'level_up_log'
+    __table_args__ = (db.Index('ix_level_up_log_guild_created_at', 'guild_id', 'created_at'),)
+
+    # Written by a trigger on the bot's levels table whenever a member's level
+    # goes up, and pruned to the last day; read by services.activity_stream
+    id = Column(BigInteger, primary_key=True)
+    guild_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    level = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"<LevelUpLog guild={self.guild_id} user={self.user_id} level={self.level}>"
+
 # --- New Event Model ---
 class Event(db.Model):
     __tablename__ = 'discord_scheduled_events'
+    # Status filter plus keyset order of the events API (services.guilds.get_events_page)
+    __table_args__ = (db.Index('ix_discord_scheduled_events_guild_status_start',
+                               'guild_id', 'status', 'start_time', 'internal_id'),)
 
     internal_id = Column(Integer, primary_key=True) # Auto-incrementing PK
     event_id = Column(String, nullable=True, index=True) # Discord Event ID (can be null for non-Discord events?)
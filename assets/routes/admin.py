@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, abort
+import time
+from flask import Blueprint, render_template, flash, redirect, url_for, request, abort, current_app, send_file
 from flask_login import login_required
 from .. import db
 from ..models.user import Guild, ServerConfig, ServerXpSettings, GuildEventSettings
 from ..middleware.auth import owner_required, admin_required, guild_admin_required
+from ..middleware.transactions import writes_allowed
+from ..middleware import profiler
+from ..services import guilds as guild_service
 from .. import db
 from ..models.user import Guild, ServerConfig, ServerXpSettings, GuildEventSettings
 from ..middleware.auth import owner_required, admin_required, guild_admin_required
@@ -38,13 +42,65 @@ def settings():
     """Global bot settings for bot owners"""
     return render_template('admin/settings.html', title='Bot Settings')
 
+@admin.route('/admin/profiles')
+@login_required
+@owner_required
+def profiles():
+    """Slowest captured request profiles per endpoint, and the sampling rules"""
+    by_endpoint = {}
+    for profile in profiler.list_profiles(current_app):
+        by_endpoint.setdefault(profile['endpoint'], []).append(profile)
+    slowest = [
+        (endpoint, sorted(captured, key=lambda p: p['duration_ms'], reverse=True)[:5])
+        for endpoint, captured in by_endpoint.items()
+    ]
+    slowest.sort(key=lambda item: item[1][0]['duration_ms'], reverse=True)
+    return render_template(
+        'admin/profiles.html',
+        title='Request Profiles',
+        slowest=slowest,
+        rules=profiler.get_rules(current_app),
+        endpoints=sorted(endpoint for endpoint in current_app.view_functions if endpoint != 'static'),
+        now=time.time()
+    )
+
+@admin.route('/admin/profiles/rules', methods=['POST'])
+@login_required
+@owner_required
+def profile_rules():
+    """Start or stop sampling 1 in N requests to an endpoint"""
+    endpoint = request.form.get('endpoint')
+    every = request.form.get('every', 0, type=int)
+    minutes = request.form.get('minutes', 10, type=int)
+    max_minutes = current_app.config['PROFILER_RULE_MAX_MINUTES']
+    if endpoint not in current_app.view_functions or every < 0 or not 1 <= minutes <= max_minutes:
+        flash(f'Pick an endpoint, a sample rate of 1 or more and 1 to {max_minutes} minutes.', 'danger')
+    else:
+        profiler.set_rule(current_app, endpoint, every, minutes)
+        if every:
+            flash(f'Profiling 1 in {every} requests to {endpoint} for {minutes} minutes.', 'success')
+        else:
+            flash(f'Stopped profiling {endpoint}.', 'info')
+    return redirect(url_for('admin.profiles'))
+
+@admin.route('/admin/profiles/<profile_id>.collapsed')
+@login_required
+@owner_required
+def profile_stacks(profile_id):
+    """Download a profile's collapsed stacks"""
+    path = profiler.profile_path(current_app, profile_id)
+    if not path:
+        abort(404)
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f'{profile_id}.collapsed')
+
 # Server Admin Routes
 @admin.route('/dashboard/guilds/<guild_id>/settings')
 @login_required
+@writes_allowed
 @guild_admin_required
 def guild_settings(guild_id):
     """Settings for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -65,10 +121,11 @@ def guild_settings(guild_id):
 
 @admin.route('/dashboard/guilds/<guild_id>/xp')
 @login_required
+@writes_allowed
 @guild_admin_required
 def guild_xp_settings(guild_id):
     """XP settings for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -89,10 +146,11 @@ def guild_xp_settings(guild_id):
 
 @admin.route('/dashboard/guilds/<guild_id>/level_roles')
 @login_required
+@writes_allowed
 @guild_admin_required
 def guild_roles(guild_id):
     """Role rewards settings for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -120,10 +178,11 @@ def guild_roles(guild_id):
 
 @admin.route('/dashboard/guilds/<guild_id>/achievements/manage')
 @login_required
+@writes_allowed
 @guild_admin_required
 def manage_achievements(guild_id):
     """Achievement management for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -155,10 +214,11 @@ def manage_achievements(guild_id):
 
 @admin.route('/dashboard/guilds/<guild_id>/events/manage')
 @login_required
+@writes_allowed
 @guild_admin_required
 def manage_events(guild_id):
     """Event management for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -1,10 +1,16 @@
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, Response, jsonify, request, abort, stream_with_context
 from flask_login import login_required, current_user
 from .. import db
 from ..models.user import Guild, ServerConfig, ServerXpSettings, GuildMember, User, LevelRole, Event, GuildEventSettings, EventAttendance
 from ..middleware.auth import owner_required, admin_required, guild_admin_required
-from ..utils.xp_utils import calculate_cumulative_xp, total_xp_for_level
-from datetime import datetime, timedelta
+from ..middleware.compression import gzip_json_response
+from ..middleware.etags import guild_etag
+from ..middleware.transactions import writes_allowed
+from ..services import activity_stream, event_calendar
+from ..services import guilds as guild_service
+from ..services.guild_cache import invalidate_guild
+from ..services.guild_versions import bump_guild_version
+from datetime import datetime, timedelta, timezone
 import json
 import uuid
 from sqlalchemy import text
@@ -16,6 +22,7 @@ import os
 from werkzeug.utils import secure_filename
 
 api = Blueprint('api', __name__)
+api.after_request(gzip_json_response)
 
 # API response helpers
 def api_success(data=None, message="Success"):
@@ -46,47 +53,18 @@ def allowed_file(filename):
 # Guild Stats API
 @api.route('/api/guilds/<string:guild_id>/stats')
 @login_required
+@guild_etag
 def get_guild_stats(guild_id):
     """Get statistics for a specific guild using the levels table"""
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found or bot is not in this guild", 404)
 
     try:
-        member_count = db.session.execute(
-            text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).scalar() or 0
-        
-        one_day_ago_ts = (datetime.now() - timedelta(days=1)).timestamp()
-        active_users = db.session.execute(
-            text("""SELECT COUNT(DISTINCT user_id) FROM levels 
-                    WHERE guild_id = :guild_id AND last_xp_time >= :time_limit"""
-                 ),
-            {'guild_id': guild_id, 'time_limit': one_day_ago_ts}
-        ).scalar() or 0
-        
-        xp_levels_data = db.session.execute(
-            text("SELECT level, xp FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).fetchall()
-        
-        total_cumulative_xp = sum(calculate_cumulative_xp(row.level, row.xp) for row in xp_levels_data)
-        
-        total_levels_earned = db.session.execute(
-            text("SELECT SUM(level) FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).scalar() or 0
-        
-        return api_success({
-            "member_count": member_count,
-            "active_users": active_users,
-            "total_xp": int(total_cumulative_xp),
-            "total_levels": int(total_levels_earned)
-        })
+        return api_success(guild_service.get_guild_stats(guild_id))
     except Exception as e:
         print(f"Error fetching guild stats for {guild_id}: {e}")
         return api_error("Failed to fetch guild statistics.")
@@ -94,54 +72,32 @@ def get_guild_stats(guild_id):
 # Guild Info API
 @api.route('/api/guilds/<string:guild_id>/info')
 @login_required
+@guild_etag
 def get_guild_info(guild_id):
     """Get detailed information about a specific guild"""
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
-    owner_name = "Unknown"
-    if guild.owner_id:
-        owner = User.query.filter_by(discord_id=guild.owner_id).first()
-        if owner:
-            owner_name = owner.username
-    
-    created_at_iso = None
-    if guild.created_at:
-        created_at_iso = guild.created_at.isoformat()
-    
-    region = guild.preferred_locale or "Unknown"
-    channel_count = guild.channel_count if guild.channel_count is not None else "N/A"
-    
     try:
-        member_count = db.session.execute(
-            text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).scalar() or 0
+        return api_success(guild_service.get_guild_info(guild))
     except Exception as e:
-        print(f"Error fetching member count for guild info {guild_id}: {e}")
-        member_count = "Error"
-
-    return api_success({
-        "owner": owner_name,
-        "created_at": created_at_iso,
-        "region": region,
-        "channels": channel_count,
-        "member_count": member_count
-    })
+        current_app.logger.error(f"Error fetching guild info for {guild_id}: {e}")
+        return api_error("Failed to fetch guild info.")
 
 # Guild Activity API
 @api.route('/api/guilds/<string:guild_id>/activity')
 @login_required
+@guild_etag
 def get_guild_activity(guild_id):
     """Get recent activity (XP gains, achievements) for a specific guild"""
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
@@ -218,6 +174,28 @@ def get_guild_activity(guild_id):
     
     return api_success(activities)
 
+# Live Guild Activity (Server-Sent Events)
+@api.route('/api/guilds/<string:guild_id>/activity/stream')
+@login_required
+def stream_guild_activity(guild_id):
+    """Stream new XP, level-up and achievement activity for a guild as server-sent events"""
+    if not current_user.can_view_guild(guild_id):
+        return api_error("You do not have permission to view this guild", 403)
+    # A stream would pin a sync worker for as long as the page stays open
+    if not activity_stream.streams_available():
+        return api_error("Live activity is served by the stream workers", 503)
+
+    guild = guild_service.get_guild(guild_id)
+    if not guild:
+        return api_error("Guild not found", 404)
+
+    # The request's DB connection goes back to the pool when the view returns;
+    # the stream itself only waits on the guild watcher
+    return Response(activity_stream.event_stream(guild_id), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Keep nginx from buffering events
+    })
+
 def parse_time_ago_seconds(time_str):
     if "just now" in time_str: return 0
     parts = time_str.split()
@@ -248,9 +226,10 @@ def format_time_ago(seconds):
 @api.route('/api/guilds/<string:guild_id>/settings', methods=['GET'])
 @login_required
 @guild_admin_required
+@writes_allowed # Creates the default settings rows on first read
 def get_guild_settings(guild_id):
     """Get settings for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         return api_error("Guild not found", 404)
@@ -281,7 +260,7 @@ def get_guild_settings(guild_id):
 @guild_admin_required
 def update_guild_settings(guild_id):
     """Update settings for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         return api_error("Guild not found", 404)
@@ -343,7 +322,9 @@ def update_guild_settings(guild_id):
         updated = True
     
     if updated:
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
     
     return api_success(message="Settings updated successfully")
 
@@ -356,81 +337,16 @@ def get_guild_leaderboard(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
     try:
-        # Pagination parameters
+        # Pagination parameters; passing `cursor` (empty for the first page) selects keyset mode
         page = request.args.get('page', default=1, type=int)
         page_size = request.args.get('page_size', default=25, type=int)
-        if page < 1:
-            page = 1
-        if page_size < 1 or page_size > 100:
-            page_size = 25
-        offset = (page - 1) * page_size
-
-        # Get total user count for pagination
-        total_users = db.session.execute(
-            text("SELECT COUNT(*) FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).scalar() or 0
-        total_pages = (total_users + page_size - 1) // page_size
-
-        # Fetch paginated leaderboard data
-        query_text = f'''
-            SELECT 
-                u.discord_id, 
-                u.username, 
-                u.avatar, 
-                lvl.level, 
-                lvl.xp 
-            FROM levels lvl
-            JOIN users u ON lvl.user_id = u.discord_id
-            WHERE lvl.guild_id = :guild_id
-            ORDER BY lvl.level DESC, lvl.xp DESC
-            LIMIT :limit OFFSET :offset
-        '''
-        params = {'guild_id': guild_id, 'limit': page_size, 'offset': offset}
-        leaderboard_raw = db.session.execute(text(query_text), params).fetchall()
-
-        # Calculate cumulative XP and store in a list of dicts
-        leaderboard_processed = []
-        for user_data in leaderboard_raw:
-            cumulative_xp = calculate_cumulative_xp(user_data.level, user_data.xp)
-            leaderboard_processed.append({
-                "user_id": user_data.discord_id,
-                "username": user_data.username,
-                "avatar": user_data.avatar,
-                "level": user_data.level,
-                "xp": user_data.xp, # Keep current level XP if needed
-                "cumulative_xp": cumulative_xp
-            })
-        # No need to re-sort; SQL already sorts by level/xp. Just enumerate for rank.
-        formatted_leaderboard = [
-            {
-                "rank": offset + idx + 1,
-                "user_id": user['user_id'],
-                "username": user['username'],
-                "avatar": user['avatar'],
-                "level": user['level'],
-                "xp": int(user['cumulative_xp'])
-            }
-            for idx, user in enumerate(leaderboard_processed)
-        ]
-
-        # Return with pagination metadata
-        response = {
-            "leaderboard": formatted_leaderboard,
-            "pagination": {
-                "page": page,
-                "page_size": page_size,
-                "total_users": total_users,
-                "total_pages": total_pages
-            }
-        }
-        return api_success(response)
+        cursor = request.args.get('cursor')
+        return api_success(guild_service.get_leaderboard(guild_id, page, page_size, cursor))
+    except ValueError as e:
+        return api_error(str(e))
     except Exception as e:
         # Log the detailed error
         print(f"Error fetching leaderboard for guild {guild_id}: {e}")
-        # Also print the query and params for debugging
-        # print(f"Failed Query: {query_text}") # Be careful logging raw SQL
-        # print(f"Failed Params: {params}")
         return api_error(f"Failed to fetch leaderboard data: {str(e)}")
 
 # User Stats API
@@ -441,26 +357,8 @@ def get_user_stats():
     try:
         user_id = current_user.discord_id # String ID
         
-        # Fetch level, xp, and voice time from the 'levels' table for all user's guilds
-        query = text("""
-            SELECT level, xp, voice_time_seconds 
-            FROM levels 
-            WHERE user_id = :user_id
-        """)
-        results = db.session.execute(query, {'user_id': user_id}).fetchall()
-        
-        total_cumulative_xp = 0
-        total_voice_seconds = 0
-        total_guilds_with_levels = 0
-        total_level_sum = 0
-        
-        for record in results:
-            total_cumulative_xp += calculate_cumulative_xp(record.level, record.xp)
-            total_voice_seconds += record.voice_time_seconds or 0
-            total_guilds_with_levels += 1
-            total_level_sum += record.level
-            
-        avg_level = round(total_level_sum / total_guilds_with_levels, 1) if total_guilds_with_levels > 0 else 0
+        # Cumulative XP, voice time and level totals across all of the user's guilds, summed in SQL
+        xp_totals = guild_service.get_user_xp_totals(user_id)
 
         # Count total achievements (as before)
         try:
@@ -478,11 +376,11 @@ def get_user_stats():
         
         return api_success({
             "username": current_user.username,
-            "total_xp": int(total_cumulative_xp),
+            "total_xp": xp_totals["total_xp"],
             "total_guilds": total_guilds,
             "achievements": total_achievements,
-            "average_level": avg_level, 
-            "total_voice_seconds": total_voice_seconds
+            "average_level": xp_totals["average_level"], 
+            "total_voice_seconds": xp_totals["total_voice_seconds"]
         })
     except Exception as e:
         print(f"Error fetching user stats: {e}")
@@ -532,6 +430,16 @@ def get_admin_stats():
         print(f"Error fetching admin stats: {e}")
         return api_error(f"Failed to fetch admin stats: {str(e)}")
 
+@api.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+@owner_required
+def get_cache_stats():
+    """Hit/miss counters for the shared cache across all workers (bot owner only)"""
+    backend = current_app.cache.cache
+    if not hasattr(backend, 'stats'):
+        return api_error(f"Cache backend {type(backend).__name__} does not report statistics", 501)
+    return api_success(backend.stats())
+
 # Guild Achievements API
 @api.route('/api/guilds/<string:guild_id>/achievements', methods=['GET'])
 @login_required
@@ -540,109 +448,11 @@ def get_guild_achievements(guild_id):
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
-    # Get total member count for the guild from the levels table
-    try:
-        member_count = db.session.execute(
-            text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"),
-            {'guild_id': guild_id}
-        ).scalar() or 0
-    except Exception as e:
-        print(f"Error fetching member count for achievements page (guild {guild_id}): {e}")
-        member_count = 0 # Default to 0 on error
-    
-    # Get achievements from the database
-    achievements = db.session.execute(text('''
-        SELECT 
-            a.id,
-            a.name,
-            a.description,
-            a.requirement_type,
-            a.icon_path,
-            0 as progress,
-            ua.completed,
-            ua.last_tier_achieved_at,
-            (SELECT COUNT(*) FROM user_achievements ua2 
-             WHERE ua2.base_achievement_id = a.id 
-             AND ua2.guild_id = :guild_id
-             AND ua2.completed = TRUE) as members_completed
-        FROM achievements a
-        LEFT JOIN user_achievements ua ON a.id = ua.base_achievement_id 
-            AND ua.guild_id = :guild_id
-            AND ua.user_id = :user_id
-        WHERE a.guild_id = :guild_id
-        ORDER BY a.created_at DESC
-    '''), {
-        'guild_id': guild_id,
-        'user_id': current_user.discord_id
-    }).fetchall()
-
-    # Fetch all tiers for achievements in this guild
-    tiers_by_achievement = {}
-    tiers = db.session.execute(text('''
-        SELECT achievement_id, tier_level, title, requirement_value, reward_xp, reward_role_id, icon_path
-        FROM achievement_tiers
-        WHERE achievement_id IN (
-            SELECT id FROM achievements WHERE guild_id = :guild_id
-        )
-        ORDER BY achievement_id, tier_level
-    '''), {'guild_id': guild_id}).fetchall()
-    for tier in tiers:
-        tiers_by_achievement.setdefault(tier.achievement_id, []).append({
-            "tier_level": tier.tier_level,
-            "title": tier.title,
-            "requirement_value": tier.requirement_value,
-            "reward_xp": tier.reward_xp,
-            "reward_role_id": tier.reward_role_id,
-            "icon_path": tier.icon_path
-        })
-
-    # Format achievements for the frontend
-    formatted_achievements = []
-    for achievement in achievements:
-        formatted_achievements.append({
-            "id": achievement.id,
-            "name": achievement.name,
-            "description": achievement.description,
-            "category": achievement.requirement_type,
-            "icon": achievement.icon_path or "medal",
-            "progress": 0,
-            "tiers": tiers_by_achievement.get(achievement.id, []),
-            "completed": achievement.completed,
-            # Robust datetime handling for last_tier_achieved_at
-            "last_tier_achieved_at": None if not achievement.last_tier_achieved_at else _format_datetime(achievement.last_tier_achieved_at),
-            "members_completed": achievement.members_completed or 0,
-            "member_count": member_count # Use the count fetched from levels
-        })
-    
-    return api_success(formatted_achievements)
-
-
-def _format_datetime(dt):
-    """Ensure dt is a timezone-aware datetime and return ISO string (UTC if naive)."""
-    import datetime as _dt
-    if isinstance(dt, str):
-        try:
-            # Try parsing with timezone info
-            val = _dt.datetime.fromisoformat(dt)
-        except Exception:
-            try:
-                # Fallback for other formats
-                val = _dt.datetime.strptime(dt, "%Y-%m-%d %H:%M:%S")
-            except Exception:
-                return dt
-    else:
-        val = dt
-    # If still not a datetime, return as-is
-    if not isinstance(val, _dt.datetime):
-        return str(val)
-    # If naive, localize to UTC
-    if val.tzinfo is None or val.tzinfo.utcoffset(val) is None:
-        val = val.replace(tzinfo=_dt.timezone.utc)
-    return val.isoformat()
+    return api_success(guild_service.get_achievements(guild_id, current_user.discord_id))
 
 @api.route('/api/guilds/<string:guild_id>/achievements', methods=['POST'])
 @login_required
@@ -666,7 +476,7 @@ def create_guild_achievement(guild_id):
         current_app.logger.error("UPLOAD_FOLDER is not configured in Flask app.")
         return api_error("Server configuration error: Upload path not set.")
         
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
@@ -728,7 +538,9 @@ def create_guild_achievement(guild_id):
         })
         
         achievement_id = result.scalar()
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
         
         return api_success({
             "id": achievement_id,
@@ -757,140 +569,77 @@ def update_guild_achievement(guild_id, achievement_id):
 @api.route('/api/guilds/<string:guild_id>/events', methods=['GET'])
 @login_required
 def get_guild_events(guild_id):
-    """Get events for a specific guild, filtered by status."""
     """Get events for a specific guild, filtered by status."""
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
     status_filter = request.args.get('status', 'upcoming').lower()
-    now_timestamp = datetime.utcnow().timestamp()
     
     try:
-        query = Event.query.filter_by(guild_id=guild_id)
-        
-        if status_filter == 'upcoming':
-            # Scheduled or Active (end time is in future or null)
-            query = query.filter(
-                Event.status.in_(['SCHEDULED', 'ACTIVE']), 
-                (Event.end_time == None) | (Event.end_time > now_timestamp) 
-            ).order_by(Event.start_time.asc())
-        elif status_filter == 'past':
-            # Completed or Cancelled or Active but end time is past
-             query = query.filter(
-                 Event.status.in_(['COMPLETED', 'CANCELLED']) | 
-                 ((Event.status == 'ACTIVE') & (Event.end_time != None) & (Event.end_time <= now_timestamp))
-             ).order_by(Event.start_time.desc())
-        else:
-            return api_error("Invalid status filter. Use 'upcoming' or 'past'.")
-            
-        events = query.limit(20).all() # Limit results for now
-        
-        # Format events for frontend
-        from sqlalchemy import func
-        status_color_map = {
-            "SCHEDULED": "primary",
-            "ACTIVE": "success",
-            "COMPLETED": "secondary",
-            "CANCELLED": "danger",
-        }
-        formatted_events = []
-        # Batch fetch participant counts for all event_ids in this guild
-        event_ids = [event.event_id for event in events]
-        participant_counts = {row.event_id: row.count for row in db.session.query(EventAttendance.event_id, func.count().label('count')).filter(EventAttendance.event_id.in_(event_ids), EventAttendance.guild_id == guild_id).group_by(EventAttendance.event_id).all()}
-        for event in events:
-            start_dt = datetime.fromtimestamp(event.start_time)
-            end_dt = datetime.fromtimestamp(event.end_time) if event.end_time else None
-            participant_count = participant_counts.get(event.event_id, 0)
-            formatted_events.append({
-                "internal_id": event.internal_id,
-                "event_id": event.event_id,
-                "name": event.name,
-                "description": event.description,
-                "start_time_iso": start_dt.isoformat(),
-                "end_time_iso": end_dt.isoformat() if end_dt else None,
-                "start_time_formatted": start_dt.strftime("%b %d, %Y %I:%M %p UTC"),
-                "end_time_formatted": end_dt.strftime("%b %d, %Y %I:%M %p UTC") if end_dt else "-",
-                "event_type": event.event_type,
-                "type": event.event_type.lower() if event.event_type else "other",
-                "status": event.status,
-                "status_color": status_color_map.get(event.status, "secondary"),
-                "participants": participant_count,
-                "creator_id": event.creator_id,
-            })
-        
-        return api_success(formatted_events)
-        
+        # Events starting in [from, to), each ISO 8601 or unix seconds
+        start_from = parse_time_arg('from')
+        start_to = parse_time_arg('to')
+        # Passing `cursor` (empty for the first page) selects keyset pagination
+        cursor = request.args.get('cursor')
+        if cursor is None:
+            return api_success(guild_service.get_events(guild_id, status_filter,
+                                                        start_from=start_from, start_to=start_to))
+        page_size = request.args.get('page_size', default=20, type=int)
+        return api_success(guild_service.get_events_page(guild_id, status_filter, page_size, cursor,
+                                                         start_from, start_to))
+    except ValueError as e:
+        return api_error(str(e))
     except Exception as e:
         current_app.logger.error(f"Error fetching guild events for {guild_id}: {e}")
         return api_error("Failed to fetch events")
-    status_filter = request.args.get('status', 'upcoming').lower()
-    now_timestamp = datetime.utcnow().timestamp()
-    
+
+def parse_time_arg(name):
+    """Unix timestamp of an ISO 8601 or unix-seconds query parameter, or None when it's absent"""
+    value = request.args.get(name)
+    if not value:
+        return None
     try:
-        query = Event.query.filter_by(guild_id=guild_id)
-        
-        if status_filter == 'upcoming':
-            # Scheduled or Active (end time is in future or null)
-            query = query.filter(
-                Event.status.in_(['SCHEDULED', 'ACTIVE']), 
-                (Event.end_time == None) | (Event.end_time > now_timestamp) 
-            ).order_by(Event.start_time.asc())
-        elif status_filter == 'past':
-            # Completed or Cancelled or Active but end time is past
-             query = query.filter(
-                 Event.status.in_(['COMPLETED', 'CANCELLED']) | 
-                 ((Event.status == 'ACTIVE') & (Event.end_time != None) & (Event.end_time <= now_timestamp))
-             ).order_by(Event.start_time.desc())
-        else:
-            return api_error("Invalid status filter. Use 'upcoming' or 'past'.")
-            
-        events = query.limit(20).all() # Limit results for now
-        
-        # Format events for frontend
-        from sqlalchemy import func
-        status_color_map = {
-            "SCHEDULED": "primary",
-            "ACTIVE": "success",
-            "COMPLETED": "secondary",
-            "CANCELLED": "danger",
-        }
-        formatted_events = []
-        # Batch fetch participant counts for all event_ids in this guild
-        event_ids = [event.event_id for event in events]
-        participant_counts = {row.event_id: row.count for row in db.session.query(EventAttendance.event_id, func.count().label('count')).filter(EventAttendance.event_id.in_(event_ids), EventAttendance.guild_id == guild_id).group_by(EventAttendance.event_id).all()}
-        for event in events:
-            start_dt = datetime.fromtimestamp(event.start_time)
-            end_dt = datetime.fromtimestamp(event.end_time) if event.end_time else None
-            participant_count = participant_counts.get(event.event_id, 0)
-            formatted_events.append({
-                "internal_id": event.internal_id,
-                "event_id": event.event_id,
-                "name": event.name,
-                "description": event.description,
-                "start_time_iso": start_dt.isoformat(),
-                "end_time_iso": end_dt.isoformat() if end_dt else None,
-                "start_time_formatted": start_dt.strftime("%b %d, %Y %I:%M %p UTC"),
-                "end_time_formatted": end_dt.strftime("%b %d, %Y %I:%M %p UTC") if end_dt else "-",
-                "event_type": event.event_type,
-                "type": event.event_type.lower() if event.event_type else "other",
-                "status": event.status,
-                "status_color": status_color_map.get(event.status, "secondary"),
-                "participants": participant_count,
-                "creator_id": event.creator_id,
-            })
-        
-        return api_success(formatted_events)
-        
-    except Exception as e:
-        current_app.logger.error(f"Error fetching guild events for {guild_id}: {e}")
-        return api_error("Failed to fetch events")
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' time. Use ISO 8601 or unix seconds.")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@api.route('/api/guilds/<string:guild_id>/events.ics')
+def guild_events_ical(guild_id):
+    """iCalendar feed of the guild's events, authorized by the signed token in its URL"""
+    user_id = event_calendar.read_feed_token(request.args.get('token', ''), guild_id)
+    user = db.session.get(User, user_id) if user_id else None
+    if user is None or not user.can_view_guild(guild_id):
+        return api_error("Invalid or expired calendar link", 403)
+
+    guild = guild_service.get_guild(guild_id)
+    if not guild:
+        return api_error("Guild not found", 404)
+
+    since = event_calendar.feed_since()
+    etag = event_calendar.feed_etag(guild_id, since)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = Response(stream_with_context(event_calendar.iter_feed(guild_id, guild.name, since, request.host)),
+                            mimetype='text/calendar')
+        response.headers['Content-Disposition'] = f'inline; filename="{guild_id}-events.ics"'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @api.route('/api/guilds/<string:guild_id>/events', methods=['POST'])
 @login_required
 @guild_admin_required
 def create_guild_event(guild_id):
     """Create a new event for a guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
@@ -927,7 +676,9 @@ def create_guild_event(guild_id):
         })
         
         event_id = result.scalar()
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
         
         return api_success({
             "id": event_id,
@@ -976,7 +727,9 @@ def join_guild_event(guild_id, event_id):
             'guild_id': guild_id
         })
         
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
         return api_success(message="Successfully joined event")
     except Exception as e:
         db.session.rollback()
@@ -985,54 +738,29 @@ def join_guild_event(guild_id, event_id):
 # Activity Chart API
 @api.route('/api/guilds/<string:guild_id>/activity-chart')
 @login_required
+@guild_etag
 def get_guild_activity_chart(guild_id):
     """Get activity chart data (users gaining XP) for a specific guild"""
     if not current_user.can_view_guild(guild_id):
         return api_error("You do not have permission to view this guild", 403)
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
-    # Get activity data for the past 7 days
-    days = 7
-    labels = []
-    xp_data = [] # Renamed from 'data'
-    message_data = [] # Placeholder data for messages
+    # Range in days (capped) and the viewer's IANA timezone for day boundaries
+    days = request.args.get('days', default=7, type=int)
+    days = max(1, min(days, current_app.config['ACTIVITY_CHART_MAX_DAYS']))
+    tz_name = request.args.get('tz') or 'UTC'
     
     try:
-        for i in range(days - 1, -1, -1):  # Go from 6 days ago to today
-            target_date = datetime.now().date() - timedelta(days=i)
-            # Convert date to start/end epoch timestamps for the day
-            day_start = datetime.combine(target_date, datetime.min.time()).timestamp()
-            day_end = datetime.combine(target_date, datetime.max.time()).timestamp()
-            
-            # Count users who gained XP on this day
-            count = db.session.execute(
-                text('''
-                    SELECT COUNT(DISTINCT user_id) 
-                    FROM levels 
-                    WHERE guild_id = :guild_id 
-                    AND last_xp_time >= :day_start 
-                    AND last_xp_time < :day_end
-                '''),
-                {
-                    'guild_id': guild_id,
-                    'day_start': day_start,
-                    'day_end': day_end
-                }
-            ).scalar() or 0
-            
-            label = target_date.strftime('%a') # Short day name (Mon, Tue, etc.)
-            labels.append(label)
-            xp_data.append(count)
-            # Add placeholder message data (e.g., scaling with XP users)
-            message_data.append(count * 10 + 50 if count > 0 else 0) 
-            
+        return api_success(guild_service.get_activity_chart(guild_id, days, tz_name))
+    except ValueError as e:
+        return api_error(str(e))
     except Exception as e:
         print(f"Error fetching activity chart data for guild {guild_id}: {e}")
         # Return default data in case of error
-        default_labels = [(datetime.now().date() - timedelta(days=i)).strftime('%a') for i in range(days - 1, -1, -1)]
+        default_labels = [(datetime.now().date() - timedelta(days=i)).strftime('%a' if days <= 7 else '%b %d') for i in range(days - 1, -1, -1)]
         return api_success({
             "labels": default_labels,
             "datasets": [
@@ -1040,31 +768,6 @@ def get_guild_activity_chart(guild_id):
                 {"label": "Messages Sent", "data": [0]*days} # Placeholder
             ]
         })
-        
-    # Structure data for Chart.js
-    chart_data = {
-        "labels": labels,
-        "datasets": [
-            {
-                "label": "Active Users (XP Gain)",
-                "data": xp_data,
-                "borderColor": "rgba(255, 102, 102, 1)", # Red
-                "backgroundColor": "rgba(255, 102, 102, 0.2)",
-                "fill": True,
-                "tension": 0.4
-            },
-            {
-                "label": "Messages Sent (Est.)", # Indicate it's an estimate/placeholder
-                "data": message_data,
-                "borderColor": "rgba(0, 204, 204, 1)", # Cyan
-                "backgroundColor": "rgba(0, 204, 204, 0.2)",
-                "fill": True,
-                "tension": 0.4
-            }
-        ]
-    }
-    
-    return api_success(chart_data)
 
 # Helper function (ensure it exists or move if needed)
 def query_with_string_ids(query_text, params):
@@ -1079,7 +782,7 @@ def query_with_string_ids(query_text, params):
 @guild_admin_required
 def update_guild_event_settings(guild_id):
     """Update event-specific settings for a guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
@@ -1118,7 +821,9 @@ def update_guild_event_settings(guild_id):
 
     if updated:
         try:
+            bump_guild_version(guild_id)
             db.session.commit()
+            invalidate_guild(guild_id)
             return api_success(message="Event settings updated successfully")
         except Exception as e:
             db.session.rollback()
@@ -1176,7 +881,7 @@ def get_event_attendees(internal_event_id):
 @guild_admin_required
 def add_guild_level_role(guild_id):
     """Add a new level role for a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         return api_error("Guild not found", 404)
     
@@ -1211,7 +916,9 @@ def add_guild_level_role(guild_id):
             behavior=behavior
         )
         db.session.add(new_reward)
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
         # Return the created reward object (or just success message)
         return api_success(message="Role reward added successfully", data={"id": new_reward.id}) 
     except Exception as e:
@@ -1231,7 +938,9 @@ def delete_guild_role_reward(guild_id, reward_id):
     
     try:
         db.session.delete(reward)
+        bump_guild_version(guild_id)
         db.session.commit()
+        invalidate_guild(guild_id)
         return api_success(message="Level role deleted successfully")
     except Exception as e:
         db.session.rollback()
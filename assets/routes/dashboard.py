@@ -1,10 +1,10 @@
-from flask import Blueprint, render_template, abort, flash, redirect, url_for, request
+from flask import Blueprint, render_template, abort, flash, redirect, url_for, request, current_app
 from flask_login import login_required, current_user
 from .. import db
 from ..models.user import Guild, GuildMember
 from ..middleware.auth import guild_view_required
-import requests
-from sqlalchemy import text # Import text for raw SQL
+from ..services import guilds as guild_service
+from ..services.event_calendar import feed_token
 
 dashboard = Blueprint('dashboard', __name__)
 
@@ -21,22 +21,17 @@ def index():
         try:
             # Fetch limited number of guilds for display on main dashboard (e.g., 3 or 5)
             guilds_to_display = sorted(user_guilds, key=lambda g: g.name)[:3] # Limit to 3 for example
+            member_counts = guild_service.get_member_counts(g.guild_id for g in guilds_to_display)
             
-            for guild in guilds_to_display:
-                member_count_result = db.session.execute(
-                    text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"),
-                    {'guild_id': guild.guild_id}
-                ).scalar() or 0
-                
-                guilds_with_counts.append({
-                    'guild_object': guild,
-                    'member_count': member_count_result
-                })
+            guilds_with_counts = [
+                {'guild_object': guild, 'member_count': member_counts[guild.guild_id]}
+                for guild in guilds_to_display
+            ]
             # No need to sort again if already sliced and sorted
             
         except Exception as e:
             # Don't flash error on main dashboard, just log and maybe show N/A
-            print(f"Error in dashboard index fetching counts: {e}")
+            current_app.logger.error(f"Error in dashboard index fetching counts: {e}")
             # Fallback: Render list without counts if query fails
             guilds_with_counts = [{'guild_object': g, 'member_count': 'N/A'} for g in sorted(user_guilds, key=lambda x: x.name)[:3]]
     # --- End Fetch Guilds --- 
@@ -57,23 +52,18 @@ def guild_list():
     
     if user_guilds:
         try:
-            for guild in user_guilds:
-                # Query the 'levels' table to count members the bot knows about
-                member_count_result = db.session.execute(
-                    text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"),
-                    {'guild_id': guild.guild_id} # guild_id is already String
-                ).scalar() or 0
-                
-                guilds_with_counts.append({
-                    'guild_object': guild,
-                    'member_count': member_count_result
-                })
+            # Counts of members the bot knows about, for every guild in one lookup
+            member_counts = guild_service.get_member_counts(g.guild_id for g in user_guilds)
+            guilds_with_counts = [
+                {'guild_object': guild, 'member_count': member_counts[guild.guild_id]}
+                for guild in user_guilds
+            ]
             # Sort guilds alphabetically by name (optional)
             guilds_with_counts.sort(key=lambda x: x['guild_object'].name)
             
         except Exception as e:
             flash("Error fetching member counts for servers.", "danger")
-            print(f"Error in guild_list fetching counts: {e}")
+            current_app.logger.error(f"Error in guild_list fetching counts: {e}")
             # Fallback: Render list without counts if query fails
             guilds_with_counts = [{'guild_object': g, 'member_count': 'N/A'} for g in sorted(user_guilds, key=lambda x: x.name)]
 
@@ -87,7 +77,7 @@ def guild_list():
 @guild_view_required
 def guild_overview(guild_id):
     """Overview of a specific guild"""
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     
     if not guild:
         abort(404)
@@ -108,7 +98,7 @@ def guild_leaderboard(guild_id):
         flash('You do not have permission to view this guild.', 'error')
         return redirect(url_for('dashboard.guild_list'))
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         flash('Guild not found.', 'error')
         return redirect(url_for('dashboard.guild_list'))
@@ -116,17 +106,14 @@ def guild_leaderboard(guild_id):
     # Pagination parameters from query string
     page = request.args.get('page', default=1, type=int)
     page_size = request.args.get('page_size', default=25, type=int)
-    api_params = {'page': page, 'page_size': page_size}
 
-    # Get leaderboard data from API with pagination
-    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/leaderboard", 
-                            params=api_params,
-                            cookies=request.cookies)
-    if response.status_code == 200:
-        api_data = response.json()['data']
-        leaderboard_data = api_data.get('leaderboard', [])
-        pagination = api_data.get('pagination', {})
-    else:
+    try:
+        leaderboard_page = guild_service.get_leaderboard(guild_id, page, page_size)
+        leaderboard_data = leaderboard_page['leaderboard']
+        pagination = leaderboard_page['pagination']
+    except Exception as e:
+        current_app.logger.error(f"Error fetching leaderboard page for guild {guild_id}: {e}")
+        db.session.rollback()
         leaderboard_data = []
         pagination = {'page': page, 'page_size': page_size, 'total_pages': 1, 'total_users': 0}
     
@@ -143,17 +130,16 @@ def guild_achievements(guild_id):
         flash('You do not have permission to view this guild.', 'error')
         return redirect(url_for('dashboard.guild_list'))
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         flash('Guild not found.', 'error')
         return redirect(url_for('dashboard.guild_list'))
     
-    # Get achievements data from API
-    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/achievements",
-                           cookies=request.cookies)
-    if response.status_code == 200:
-        achievements_data = response.json()['data']
-    else:
+    try:
+        achievements_data = guild_service.get_achievements(guild_id, current_user.discord_id)
+    except Exception as e:
+        current_app.logger.error(f"Error fetching achievements page for guild {guild_id}: {e}")
+        db.session.rollback()
         achievements_data = []
     
     return render_template('dashboard/guild_achievements.html', 
@@ -168,19 +154,23 @@ def guild_events(guild_id):
         flash('You do not have permission to view this guild.', 'error')
         return redirect(url_for('dashboard.guild_list'))
     
-    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    guild = guild_service.get_guild(guild_id)
     if not guild:
         flash('Guild not found.', 'error')
         return redirect(url_for('dashboard.guild_list'))
     
-    # Get events data from API
-    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/events",
-                           cookies=request.cookies)
-    if response.status_code == 200:
-        events_data = response.json()['data']
-    else:
+    try:
+        events_data = guild_service.get_events(guild_id)
+    except Exception as e:
+        current_app.logger.error(f"Error fetching events page for guild {guild_id}: {e}")
+        db.session.rollback()
         events_data = []
     
+    # Subscription URL for calendar apps, signed for this member
+    calendar_url = url_for('api.guild_events_ical', guild_id=guild_id,
+                           token=feed_token(guild_id, current_user.discord_id), _external=True)
+
     return render_template('dashboard/guild_events.html', 
                          guild=guild,
-                         events=events_data) 
\ No newline at end of file
+                         events=events_data,
+                         calendar_url=calendar_url) 
\ No newline at end of file
@@ -1,5 +1,10 @@
-from flask import Blueprint, render_template
+import hmac
+from flask import Blueprint, Response, render_template, jsonify, current_app, request
 from flask_login import current_user
+from sqlalchemy import text
+from .. import db
+from ..middleware.metrics import render_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
 
 main = Blueprint('main', __name__)
 
@@ -21,4 +26,33 @@ def features():
 @main.route('/contact')
 def contact():
     """Contact page"""
-    return render_template('contact.html', title='Contact') 
\ No newline at end of file
+    return render_template('contact.html', title='Contact') 
+
+# Health checks for the load balancer / orchestrator
+@main.route('/healthz')
+def healthz():
+    """Liveness: the worker is serving requests. Touches nothing else."""
+    return jsonify(status="ok")
+
+@main.route('/readyz')
+def readyz():
+    """Readiness: the database answers a query on a pooled connection"""
+    try:
+        with db.engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+    except Exception as e:
+        current_app.logger.error(f'Readiness check failed: {str(e)}')
+        return jsonify(status="unavailable", database="unreachable"), 503
+    return jsonify(status="ok", database="ok")
+
+@main.route('/metrics')
+def metrics():
+    """Prometheus scrape target, covering every worker on the host"""
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        # Endpoint names, traffic and pool state aren't for everyone; only local runs may skip the token
+        if not (current_app.debug or current_app.testing):
+            return jsonify(status="forbidden", message="Set METRICS_TOKEN to enable /metrics"), 403
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify(status="unauthorized"), 401
+    return Response(render_metrics(current_app), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,195 @@
+"""
+Live guild activity for the overview page's event stream.
+
+A worker runs one watcher thread per guild that has subscribers, however
+many clients are streaming it. Every ACTIVITY_STREAM_POLL seconds the watcher
+reads the guild's data version (services/guild_versions.py), a primary key
+lookup, and only when it moved reads the XP gains, level-ups (level_up_log)
+and completed achievements newer than what it already sent. Each event goes
+onto every subscriber's queue; a subscriber more than ACTIVITY_STREAM_QUEUE
+events behind is dropped, which ends its stream and makes the browser
+reconnect. The watcher exits once its last subscriber leaves.
+
+The bot stamps rows before it commits, so each read looks back
+ACTIVITY_STREAM_OVERLAP seconds past the newest event sent and skips rows
+it has already seen.
+"""
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import text
+from .. import db
+from .guild_versions import get_guild_version
+
+# Rows read per source per poll; a busier guild only streams the newest
+MAX_ROWS = 50
+
+XP_SQL = text('''
+    SELECT lvl.user_id, u.username, lvl.level, lvl.last_xp_time
+    FROM levels lvl
+    JOIN users u ON lvl.user_id = u.discord_id
+    WHERE lvl.guild_id = :guild_id AND lvl.last_xp_time > :since
+    ORDER BY lvl.last_xp_time DESC
+    LIMIT :limit
+''')
+
+LEVEL_UP_SQL = text('''
+    SELECT l.id, u.username, l.level, l.created_at
+    FROM level_up_log l
+    JOIN users u ON l.user_id = u.discord_id
+    WHERE l.guild_id = :guild_id AND l.created_at > :since
+    ORDER BY l.created_at DESC
+    LIMIT :limit
+''')
+
+ACHIEVEMENT_SQL = text('''
+    SELECT ua.user_id, ua.base_achievement_id, u.username, a.name AS achievement_name, ua.last_tier_achieved_at
+    FROM user_achievements ua
+    JOIN users u ON ua.user_id = u.discord_id
+    JOIN achievements a ON ua.base_achievement_id = a.id
+    WHERE ua.guild_id = :guild_id AND ua.completed = TRUE AND ua.last_tier_achieved_at > :since
+    ORDER BY ua.last_tier_achieved_at DESC
+    LIMIT :limit
+''')
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+class Subscription:
+    """One client's queue of pending events. closed is set when the watcher drops it."""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+
+class GuildWatcher:
+    """Polls one guild for new activity and fans it out to its subscribers."""
+
+    def __init__(self, app, guild_id):
+        self.app = app
+        self.guild_id = guild_id
+        self.subscribers = set()
+        self.version = None
+        self.started_at = time.time()
+        self.newest = self.started_at  # Timestamp of the newest event sent
+        self.sent = {}  # (source, key) -> timestamp of what was last sent for it
+
+    def run(self):
+        interval = self.app.config['ACTIVITY_STREAM_POLL']
+        while True:
+            time.sleep(interval)
+            with _watchers_lock:
+                if not self.subscribers:
+                    del _watchers[self.guild_id]
+                    return
+            with self.app.app_context():
+                try:
+                    events = self.poll()
+                except Exception as e:
+                    self.app.logger.error(f"Activity stream poll failed for guild {self.guild_id}: {str(e)}")
+                    events = []
+            for event in events:
+                self.publish(event)
+
+    def poll(self):
+        """Return the activity that appeared since the last poll, oldest first."""
+        version = get_guild_version(self.guild_id)
+        if version == self.version:
+            return []
+        self.version = version
+
+        since = max(self.newest, self.started_at) - self.app.config['ACTIVITY_STREAM_OVERLAP']
+        params = {'guild_id': self.guild_id, 'limit': MAX_ROWS}
+        events = []
+        for row in db.session.execute(XP_SQL, dict(params, since=since)):
+            self._add(events, ('xp', row.user_id), row.last_xp_time, {
+                "type": "xp",
+                "description": f"{row.username} recently gained XP",
+                "details": f"Reached Level {row.level}",
+            })
+        for row in db.session.execute(LEVEL_UP_SQL, dict(params, since=datetime.fromtimestamp(since, timezone.utc))):
+            self._add(events, ('level_up', row.id), row.created_at.timestamp(), {
+                "type": "level_up",
+                "description": f"{row.username} leveled up",
+                "details": f"Now Level {row.level}",
+            })
+        # last_tier_achieved_at is a naive local timestamp, as the /activity feed reads it
+        for row in db.session.execute(ACHIEVEMENT_SQL, dict(params, since=datetime.fromtimestamp(since))):
+            self._add(events, ('achievement', row.user_id, row.base_achievement_id), row.last_tier_achieved_at.timestamp(), {
+                "type": "achievement",
+                "description": f"{row.username} earned achievement",
+                "details": row.achievement_name,
+            })
+
+        # Rows older than the look-back window can't come back unless they change again
+        self.sent = {key: at for key, at in self.sent.items() if at > since}
+        events.sort(key=lambda event: event["at"])
+        return events
+
+    def _add(self, events, key, at, event):
+        if at <= self.sent.get(key, self.started_at):
+            return
+        self.sent[key] = at
+        self.newest = max(self.newest, at)
+        event.update(time="just now", at=datetime.fromtimestamp(at, timezone.utc))
+        events.append(event)
+
+    def publish(self, event):
+        with _watchers_lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                unsubscribe(self.guild_id, subscription)
+
+
+def streams_available():
+    """True if this process may hold open streams: a stream worker, or the debug server."""
+    return current_app.config['ACTIVITY_STREAM_WORKER'] or current_app.debug
+
+
+def subscribe(guild_id):
+    """Subscribe to a guild's activity, starting its watcher if needed."""
+    subscription = Subscription(current_app.config['ACTIVITY_STREAM_QUEUE'])
+    with _watchers_lock:
+        watcher = _watchers.get(guild_id)
+        if watcher is None:
+            watcher = _watchers[guild_id] = GuildWatcher(current_app._get_current_object(), guild_id)
+            threading.Thread(target=watcher.run, name=f'activity-{guild_id}', daemon=True).start()
+        watcher.subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(guild_id, subscription):
+    subscription.closed = True
+    with _watchers_lock:
+        watcher = _watchers.get(guild_id)
+        if watcher is not None:
+            watcher.subscribers.discard(subscription)
+
+
+def event_stream(guild_id):
+    """Generator of text/event-stream chunks for one client; runs outside the request context."""
+    subscription = subscribe(guild_id)
+    app = current_app._get_current_object()
+    heartbeat = app.config['ACTIVITY_STREAM_HEARTBEAT']
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while not subscription.closed:
+                try:
+                    event = subscription.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: activity\ndata: {app.json.dumps(event)}\n\n"
+        finally:
+            unsubscribe(guild_id, subscription)
+    return generate()
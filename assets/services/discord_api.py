@@ -0,0 +1,225 @@
+"""
+Pooled HTTP client for the Discord REST API.
+
+Each worker process keeps one requests.Session, so logins reuse open
+connections to Discord instead of paying a TCP and TLS handshake per call.
+Every call has a connect and a read timeout. Rate limits are tracked from
+Discord's X-RateLimit-* headers per bucket and token: a call into a bucket
+known to be exhausted (or answered with 429) waits for the reset when it is
+at most DISCORD_API_MAX_RATE_LIMIT_WAIT seconds away and raises
+DiscordRateLimited otherwise, so a worker is never parked behind Discord.
+"""
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+from ..middleware.metrics import observe_discord_call
+
+USER_AGENT = 'DiscordBot (https://github.com/KJoshO0611/CLdashboard, 1.0)'
+
+
+class DiscordAPIError(Exception):
+    """A Discord API call failed: an error response, a timeout or a connection error"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class DiscordRateLimited(DiscordAPIError):
+    """Discord asked us to back off for longer than we are willing to wait"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message, status=429)
+        self.retry_after = retry_after
+
+
+def token_key(token):
+    """Short digest of a token, for cache and rate-limit keys that mustn't hold the token itself"""
+    return hashlib.sha256(token.encode()).hexdigest()[:32] if token else None
+
+
+class DiscordClient:
+    """Discord REST client with a per-process connection pool and rate-limit bookkeeping.
+
+    :param base_url: API root, e.g. https://discord.com/api/v10 (or a local stub).
+    :param timeout: (connect, read) timeout in seconds for every call.
+    :param max_rate_limit_wait: longest rate-limit reset, in seconds, worth sleeping through.
+    :param max_retries: times a call answered with 429 is retried.
+    :param pool_size: connections kept open to Discord per process.
+    """
+
+    def __init__(self, base_url, timeout=(3, 5), max_rate_limit_wait=2.0, max_retries=2, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_rate_limit_wait = max_rate_limit_wait
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._session = None
+        self._executor = None
+        self._route_buckets = {}  # (method, route) -> bucket id from X-RateLimit-Bucket
+        self._blocked_until = {}  # (bucket or 'global', token key) -> time.monotonic() of the reset
+
+    @classmethod
+    def from_app(cls, app):
+        return cls(
+            app.config['DISCORD_API_BASE_URL'],
+            timeout=tuple(app.config['DISCORD_API_TIMEOUT']),
+            max_rate_limit_wait=app.config['DISCORD_API_MAX_RATE_LIMIT_WAIT']
+        )
+
+    # --- Per-process resources ---
+
+    def _ensure_process(self):
+        """(Re)create the session and thread pool in a new process; forked copies would share sockets."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            self._session = session
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='discord-api')
+            self._route_buckets = {}
+            self._blocked_until = {}
+            self._pid = os.getpid()
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn in the client's thread pool. fn must not need the app or request context."""
+        self._ensure_process()
+        return self._executor.submit(fn, *args, **kwargs)
+
+    # --- Rate limits ---
+
+    def _wait_for_limits(self, method, route, key):
+        bucket = self._route_buckets.get((method, route), route)
+        now = time.monotonic()
+        reset_at = max(self._blocked_until.get((bucket, key), 0), self._blocked_until.get(('global', key), 0))
+        delay = reset_at - now
+        if delay <= 0:
+            return
+        if delay > self.max_rate_limit_wait:
+            raise DiscordRateLimited(f'Discord rate limit on {method} {route} resets in {delay:.2f}s', delay)
+        time.sleep(delay)
+
+    def _record_limits(self, method, route, key, response):
+        headers = response.headers
+        bucket = headers.get('X-RateLimit-Bucket')
+        now = time.monotonic()
+        with self._lock:
+            if bucket:
+                self._route_buckets[(method, route)] = bucket
+            else:
+                bucket = self._route_buckets.get((method, route), route)
+            if headers.get('X-RateLimit-Remaining') == '0':
+                reset_after = float(headers.get('X-RateLimit-Reset-After', 0) or 0)
+                self._blocked_until[(bucket, key)] = now + reset_after
+            if response.status_code == 429:
+                try:
+                    body = response.json()
+                except ValueError:
+                    body = {}
+                retry_after = float(body.get('retry_after') or headers.get('Retry-After') or 1)
+                is_global = body.get('global') or headers.get('X-RateLimit-Global') == 'true'
+                self._blocked_until[('global' if is_global else bucket, key)] = now + retry_after
+            if len(self._blocked_until) > 1000:
+                self._blocked_until = {k: v for k, v in self._blocked_until.items() if v > now}
+
+    # --- Requests ---
+
+    def request(self, method, route, token=None, **kwargs):
+        """Call route (e.g. '/users/@me') and return the decoded JSON body.
+
+        Raises DiscordRateLimited when the call can't be made within the wait
+        budget and DiscordAPIError for any other failure.
+        """
+        self._ensure_process()
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        key = token_key(token)
+        url = self.base_url + route
+
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_limits(method, route, key)
+            started = time.perf_counter()
+            try:
+                response = self._session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+            except requests.Timeout:
+                observe_discord_call(method, route, 'timeout', started)
+                raise DiscordAPIError(f'Discord {method} {route} timed out')
+            except requests.RequestException as e:
+                observe_discord_call(method, route, 'error', started)
+                raise DiscordAPIError(f'Discord {method} {route} failed: {e}')
+            observe_discord_call(method, route, response.status_code, started)
+            self._record_limits(method, route, key, response)
+            if response.status_code != 429:
+                break
+        else:
+            retry_after = float(response.headers.get('Retry-After') or 0)
+            raise DiscordRateLimited(f'Discord kept rate limiting {method} {route}', retry_after)
+
+        if not response.ok:
+            raise DiscordAPIError(f'Discord {method} {route} returned {response.status_code}: {response.text[:200]}',
+                                  status=response.status_code)
+        return response.json()
+
+    def exchange_code(self, code, client_id, client_secret, redirect_uri):
+        """Trade an OAuth2 authorization code for a token response"""
+        return self.request('POST', '/oauth2/token', data={
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': redirect_uri
+        })
+
+    def get_current_user(self, access_token):
+        return self.request('GET', '/users/@me', token=access_token)
+
+    def get_current_user_guilds(self, access_token):
+        return self.request('GET', '/users/@me/guilds', token=access_token)
+
+
+def get_client():
+    """The app's DiscordClient, created on first use"""
+    client = current_app.extensions.get('discord_api')
+    if client is None:
+        client = current_app.extensions['discord_api'] = DiscordClient.from_app(current_app)
+    return client
+
+
+def get_user_and_guilds(access_token):
+    """Fetch the token's user and guild list concurrently.
+
+    The guild list is cached per token for DISCORD_GUILDS_CACHE_TIMEOUT
+    seconds, so repeated logins within that window make one call. Returns
+    (user, guilds); guilds is None if only the guild fetch failed. Errors
+    fetching the user are raised.
+    """
+    client = get_client()
+    cache_key = f"discord:guilds:{token_key(access_token)}"
+    guilds = current_app.cache.get(cache_key)
+    pending = None if guilds is not None else client.submit(client.get_current_user_guilds, access_token)
+
+    user = client.get_current_user(access_token)
+    if pending is not None:
+        try:
+            guilds = pending.result()
+        except DiscordAPIError as e:
+            current_app.logger.warning(f"Could not fetch guilds from Discord: {str(e)}")
+            return user, None
+        current_app.cache.set(cache_key, guilds, timeout=current_app.config['DISCORD_GUILDS_CACHE_TIMEOUT'])
+    return user, guilds
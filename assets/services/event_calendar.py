@@ -0,0 +1,142 @@
+"""
+iCalendar feed of a guild's events, for calendar apps to subscribe to.
+
+Calendar apps can't log in, so the feed URL carries a signed token naming
+the guild and the member it was issued to; each fetch checks that member can
+still view the guild. Tokens expire EVENTS_ICAL_TOKEN_MAX_AGE seconds after
+they were issued, so a leaked link stops working without rotating
+SECRET_KEY; members re-subscribe from the events page. The feed covers events that started in the last
+EVENTS_ICAL_PAST_DAYS and everything after. Its ETag is a digest of those
+rows computed in the database: the bot writes events without bumping the
+guild's data version, and a digest only changes when the feed would.
+Rows are read through a server-side cursor and the calendar is streamed
+out as they arrive.
+"""
+import time
+from datetime import datetime, timezone
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import text
+
+from .. import db
+
+TOKEN_SALT = 'guild-events-ical'
+FETCH_ROWS = 200  # Rows per round trip of the server-side cursor
+
+# Discord's statuses in iCalendar terms
+ICAL_STATUS = {
+    'SCHEDULED': 'CONFIRMED',
+    'ACTIVE': 'CONFIRMED',
+    'COMPLETED': 'CONFIRMED',
+    'CANCELLED': 'CANCELLED',
+}
+
+FEED_COLUMNS = '''
+    internal_id, event_id, name, description, start_time, end_time, event_type, status, created_at
+'''
+FEED_WHERE = 'WHERE guild_id = :guild_id AND start_time >= :since'
+
+
+def _serializer():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def feed_token(guild_id, user_id):
+    """Token for user_id's subscription to guild_id's feed"""
+    return _serializer().dumps({'g': str(guild_id), 'u': str(user_id)})
+
+
+def read_feed_token(token, guild_id):
+    """The user id a token was issued to, or None if it isn't a valid, unexpired token for guild_id"""
+    try:
+        payload = _serializer().loads(token, max_age=current_app.config['EVENTS_ICAL_TOKEN_MAX_AGE'])
+    except BadSignature:  # SignatureExpired is a BadSignature
+        return None
+    if not isinstance(payload, dict) or payload.get('g') != str(guild_id):
+        return None
+    return payload.get('u')
+
+
+def feed_since():
+    """Unix time of the oldest event start the feed includes"""
+    return time.time() - current_app.config['EVENTS_ICAL_PAST_DAYS'] * 86400
+
+
+def feed_etag(guild_id, since):
+    """Digest of every column the feed renders, over the rows it would include"""
+    digest = db.session.execute(text(f'''
+        SELECT md5(coalesce(string_agg(
+            concat_ws('|', {FEED_COLUMNS}), E'\\n' ORDER BY internal_id
+        ), ''))
+        FROM discord_scheduled_events
+        {FEED_WHERE}
+    '''), {'guild_id': str(guild_id), 'since': since}).scalar()
+    return digest[:20]
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    """Split a content line into 75-octet pieces, continuation lines starting with a space"""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    pieces, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:  # Don't cut a UTF-8 sequence
+            end -= 1
+        pieces.append(encoded[start:end].decode())
+        start, limit = end, 74
+    return '\r\n '.join(pieces) + '\r\n'
+
+
+def _utc(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _vevent(row, host):
+    stamp = row.created_at.replace(tzinfo=timezone.utc).timestamp() if row.created_at else row.start_time
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:event-{row.internal_id}@{host}',
+        f'DTSTAMP:{_utc(stamp)}',
+        f'DTSTART:{_utc(row.start_time)}',
+    ]
+    if row.end_time:
+        lines.append(f'DTEND:{_utc(row.end_time)}')
+    lines.append(f'SUMMARY:{_escape(row.name)}')
+    if row.description:
+        lines.append(f'DESCRIPTION:{_escape(row.description)}')
+    if row.event_type:
+        lines.append(f'CATEGORIES:{_escape(row.event_type)}')
+    lines.append(f"STATUS:{ICAL_STATUS.get(row.status, 'TENTATIVE')}")
+    lines.append('END:VEVENT')
+    return ''.join(_fold(line) for line in lines)
+
+
+def iter_feed(guild_id, guild_name, since, host):
+    """Yield the calendar in chunks, one per event after the header"""
+    yield ''.join(_fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//CLDashboard//Guild Events//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{_escape(guild_name)} events',
+    ))
+    rows = db.session.execute(
+        text(f'''
+            SELECT {FEED_COLUMNS}
+            FROM discord_scheduled_events
+            {FEED_WHERE}
+            ORDER BY start_time, internal_id
+        ''').execution_options(stream_results=True, max_row_buffer=FETCH_ROWS),
+        {'guild_id': str(guild_id), 'since': since}
+    )
+    for row in rows:
+        yield _vevent(row, host)
+    yield 'END:VCALENDAR\r\n'
@@ -0,0 +1,50 @@
+"""
+Cache-aside helpers for per-guild API data.
+
+Every key for a guild embeds that guild's cache generation, so a write
+endpoint drops everything cached for the guild by replacing the generation
+instead of hunting down individual (sometimes per-viewer) keys. Keys also
+embed the guild's data version (services/guild_versions.py), which the bot's
+writes bump without touching the cache, so those miss the cache too. Stale
+entries are never read again and age out through their TTL or LRU eviction.
+"""
+import uuid
+from flask import current_app
+from .guild_versions import request_guild_version
+
+
+def _generation_key(guild_id):
+    return f"guild:{guild_id}:generation"
+
+
+def _generation(guild_id):
+    key = _generation_key(guild_id)
+    generation = current_app.cache.get(key)
+    if generation is None:
+        # A fresh random generation can't collide with entries written under an evicted one
+        current_app.cache.add(key, uuid.uuid4().hex[:12], timeout=0)
+        generation = current_app.cache.get(key)
+    return generation
+
+
+def guild_key(guild_id, *parts):
+    """Cache key scoped to the guild's current generation and data version."""
+    prefix = ['guild', str(guild_id), _generation(guild_id), str(request_guild_version(guild_id))]
+    return ':'.join(prefix + [str(part) for part in parts])
+
+
+def cached_for_guild(guild_id, name, loader, timeout=None):
+    """Return the cached value for (guild, name), calling loader() to fill it on a miss."""
+    if timeout is None:
+        timeout = current_app.config['GUILD_CACHE_TIMEOUTS'].get(name)
+    key = guild_key(guild_id, name)
+    value = current_app.cache.get(key)
+    if value is None:
+        value = loader()
+        current_app.cache.set(key, value, timeout=timeout)
+    return value
+
+
+def invalidate_guild(guild_id):
+    """Forget everything cached for a guild. Call after any write that changes guild data."""
+    current_app.cache.set(_generation_key(guild_id), uuid.uuid4().hex[:12], timeout=0)
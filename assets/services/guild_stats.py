@@ -0,0 +1,200 @@
+"""
+Upkeep of the guild_stats rollup.
+
+Triggers on levels keep member_count, total_level and total_xp exact on
+every write. active_count (members with XP inside GUILD_STATS_ACTIVE_WINDOW)
+changes as time passes with no write to trigger on, so it is recounted
+here every GUILD_STATS_ACTIVE_REFRESH seconds by a daemon thread in the
+worker serving stats. The recount reads only the rows inside the window,
+through ix_levels_guild_last_xp_time, and rewrites only counts that changed.
+
+`flask guild-stats reconcile` rebuilds the whole table from levels, and
+achievement_stats from user_achievements, and reports whatever drift it
+corrected.
+"""
+import os
+import random
+import threading
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import text
+from .. import db
+from .xp_levels import CUMULATIVE_XP_SQL, sync_level_totals
+
+# Exact per-row cumulative XP, the same expression the triggers sum
+ROW_XP_SQL = f"CAST({CUMULATIVE_XP_SQL} AS NUMERIC)"
+
+# pg_try_advisory_xact_lock key, so only one worker recounts at a time
+ACTIVE_REFRESH_LOCK = 72_611_001
+
+ACTIVE_REFRESH_SQL = text('''
+    UPDATE guild_stats gs SET active_count = recount.active_count
+    FROM (
+        SELECT g.guild_id, (
+            SELECT COUNT(*) FROM levels lvl
+            WHERE lvl.guild_id = g.guild_id AND lvl.last_xp_time >= :cutoff
+        ) AS active_count
+        FROM guild_stats g
+    ) recount
+    WHERE gs.guild_id = recount.guild_id AND gs.active_count <> recount.active_count
+''')
+
+RECOUNT_SQL = text(f'''
+    SELECT
+        lvl.guild_id,
+        COUNT(*) AS member_count,
+        COALESCE(SUM(lvl.level), 0) AS total_level,
+        COALESCE(SUM({ROW_XP_SQL}), 0) AS total_xp,
+        COUNT(*) FILTER (WHERE lvl.last_xp_time >= :cutoff) AS active_count
+    FROM levels lvl
+    LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+    GROUP BY lvl.guild_id
+''')
+
+COLUMNS = ('member_count', 'total_level', 'total_xp', 'active_count')
+
+ACHIEVEMENT_RECOUNT_SQL = text('''
+    SELECT guild_id, base_achievement_id AS achievement_id, COUNT(*) AS completed_count
+    FROM user_achievements
+    WHERE completed
+    GROUP BY guild_id, base_achievement_id
+''')
+
+_refresher_lock = threading.Lock()
+_refresher_pid = None
+
+
+def refresh_active_counts(throttle=True):
+    """Recount active_count for every guild. Returns the number of guilds whose count changed.
+
+    With throttle, returns None without querying when another worker on this
+    host refreshed within the last interval or another host is mid-refresh.
+    """
+    interval = current_app.config['GUILD_STATS_ACTIVE_REFRESH']
+    if throttle and not current_app.cache.add('guild_stats:active_refresh', 1, timeout=interval):
+        return None
+    cutoff = time.time() - current_app.config['GUILD_STATS_ACTIVE_WINDOW']
+    # Own connection: this also runs from the refresher thread and inside read-only requests
+    with db.engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"), {'key': ACTIVE_REFRESH_LOCK}).scalar():
+            return None
+        return conn.execute(ACTIVE_REFRESH_SQL, {'cutoff': cutoff}).rowcount
+
+
+def ensure_active_refresher():
+    """Start this worker's active_count refresher thread if it isn't running yet."""
+    global _refresher_pid
+    if not current_app.config['GUILD_STATS_ACTIVE_REFRESH'] or _refresher_pid == os.getpid():
+        return
+    with _refresher_lock:
+        if _refresher_pid != os.getpid():
+            _refresher_pid = os.getpid()
+            app = current_app._get_current_object()
+            threading.Thread(target=_refresh_forever, args=(app,), name='guild-stats-active', daemon=True).start()
+
+
+def _refresh_forever(app):
+    interval = app.config['GUILD_STATS_ACTIVE_REFRESH']
+    while True:
+        with app.app_context():
+            try:
+                refresh_active_counts()
+            except Exception as e:
+                app.logger.error(f"guild_stats active_count refresh failed: {str(e)}")
+        time.sleep(interval * random.uniform(0.9, 1.1))
+
+
+def reconcile(fix=True):
+    """Recount guild_stats from levels and return its drift as (guild_id, column, stored, actual) tuples.
+
+    With fix, the table is rewritten from the recount in the same transaction.
+    Writes to levels wait until it commits, so nothing changes between the
+    recount and the rewrite.
+    """
+    with db.engine.connect() as conn:
+        max_level = conn.execute(text("SELECT COALESCE(MAX(level), 0) FROM levels")).scalar()
+    sync_level_totals(max_level)  # A level without a lookup row would be summed as 0 XP
+
+    cutoff = time.time() - current_app.config['GUILD_STATS_ACTIVE_WINDOW']
+    with db.engine.begin() as conn:
+        conn.execute(text("LOCK TABLE levels IN SHARE MODE"))
+        actual = {row.guild_id: row for row in conn.execute(RECOUNT_SQL, {'cutoff': cutoff})}
+        stored = {row.guild_id: row for row in conn.execute(text(f"SELECT guild_id, {', '.join(COLUMNS)} FROM guild_stats"))}
+
+        drift = []
+        for guild_id in sorted(actual.keys() | stored.keys()):
+            for column in COLUMNS:
+                stored_value = getattr(stored[guild_id], column) if guild_id in stored else 0
+                actual_value = getattr(actual[guild_id], column) if guild_id in actual else 0
+                # active_count lags by up to a refresh interval by design, so it isn't drift
+                if stored_value != actual_value and column != 'active_count':
+                    drift.append((guild_id, column, stored_value, actual_value))
+
+        if fix:
+            conn.execute(text("DELETE FROM guild_stats"))
+            conn.execute(text(f'''
+                INSERT INTO guild_stats (guild_id, {', '.join(COLUMNS)})
+                SELECT guild_id, {', '.join(COLUMNS)} FROM ({RECOUNT_SQL.text}) recount
+            '''), {'cutoff': cutoff})
+    return drift
+
+
+def reconcile_achievements(fix=True):
+    """Recount achievement_stats from user_achievements; same contract as reconcile()."""
+    with db.engine.begin() as conn:
+        conn.execute(text("LOCK TABLE user_achievements IN SHARE MODE"))
+        actual = {(row.guild_id, row.achievement_id): row.completed_count for row in conn.execute(ACHIEVEMENT_RECOUNT_SQL)}
+        stored = {(row.guild_id, row.achievement_id): row.completed_count for row in conn.execute(
+            text("SELECT guild_id, achievement_id, completed_count FROM achievement_stats")
+        )}
+        drift = []
+        for guild_id, achievement_id in sorted(actual.keys() | stored.keys()):
+            stored_count = stored.get((guild_id, achievement_id), 0)
+            actual_count = actual.get((guild_id, achievement_id), 0)
+            if stored_count != actual_count:
+                drift.append((f"{guild_id}/{achievement_id}", 'completed_count', stored_count, actual_count))
+        if fix:
+            conn.execute(text("DELETE FROM achievement_stats"))
+            conn.execute(text(f"INSERT INTO achievement_stats (guild_id, achievement_id, completed_count) {ACHIEVEMENT_RECOUNT_SQL.text}"))
+    return drift
+
+
+guild_stats_cli = AppGroup('guild-stats', help='Maintain the guild_stats and achievement_stats rollups.')
+
+
+@guild_stats_cli.command('reconcile')
+@click.option('--check', is_flag=True, help='Only report drift, exiting with status 1 if there is any.')
+def reconcile_command(check):
+    """Rebuild guild_stats and achievement_stats from the bot's tables and report any drift."""
+    drifted = False
+    for table, source, rebuild in (('guild_stats', 'levels', reconcile),
+                                   ('achievement_stats', 'user_achievements', reconcile_achievements)):
+        drift = rebuild(fix=not check)
+        for key, column, stored, actual in drift[:50]:
+            click.echo(f"{table} {key} {column}: stored {stored}, actual {actual}")
+        if len(drift) > 50:
+            click.echo(f"... and {len(drift) - 50} more")
+        keys = len({key for key, *_ in drift})
+        if not drift:
+            click.echo(f"{table} matches {source}")
+        elif check:
+            click.echo(f"{table}: {len(drift)} value(s) drifted in {keys} row(s)")
+        else:
+            click.echo(f"Rebuilt {table}, correcting {len(drift)} value(s) in {keys} row(s)")
+        drifted = drifted or bool(drift)
+    if check and drifted:
+        click.echo("Run `flask guild-stats reconcile` to rebuild.")
+        raise SystemExit(1)
+
+
+@guild_stats_cli.command('refresh-active')
+def refresh_active_command():
+    """Recount active members now instead of waiting for the refresher."""
+    changed = refresh_active_counts(throttle=False)
+    if changed is None:
+        click.echo("Another process is refreshing active counts")
+    else:
+        click.echo(f"active_count changed for {changed} guild(s)")
@@ -0,0 +1,46 @@
+"""
+Per-guild data versions behind the guild API's ETags.
+
+guild_data_versions holds a counter per guild. Dashboard writes call
+bump_guild_version() before they commit, and triggers on the bot's levels
+and user_achievements tables bump it once per statement for every guild the
+statement touched (see the migration). A guild without a row is at version 0.
+"""
+from flask import g
+from sqlalchemy import text
+from .. import db
+from ..models.user import GuildDataVersion
+
+BUMP_SQL = text('''
+    INSERT INTO guild_data_versions AS v (guild_id, version) VALUES (:guild_id, 1)
+    ON CONFLICT (guild_id) DO UPDATE SET version = v.version + 1
+''')
+
+
+def get_guild_version(guild_id):
+    """Return the guild's current data version (one primary key lookup)."""
+    return db.session.query(GuildDataVersion.version).filter_by(guild_id=str(guild_id)).scalar() or 0
+
+
+def request_guild_version(guild_id):
+    """The guild's version as first read by the current request.
+
+    The ETag and the guild cache key both use it, so a response's tag and
+    body always stand for the same version even if the bot bumps it midway.
+    """
+    versions = g.setdefault('guild_data_versions', {})
+    guild_id = str(guild_id)
+    if guild_id not in versions:
+        versions[guild_id] = get_guild_version(guild_id)
+    return versions[guild_id]
+
+
+def bump_guild_version(guild_id):
+    """Advance the guild's version inside the current transaction.
+
+    Call it alongside invalidate_guild() from any write that changes data the
+    guild API returns, before the commit, so the new version can't be seen
+    before the data it stands for.
+    """
+    db.session.execute(BUMP_SQL, {'guild_id': str(guild_id)})
+    g.get('guild_data_versions', {}).pop(str(guild_id), None)
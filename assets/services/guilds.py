@@ -0,0 +1,542 @@
+"""
+Guild data shared by the JSON API and the server-rendered dashboard pages.
+
+These functions only fetch and shape data. Permission checks stay in the
+route handlers so that the API can answer with JSON errors while the pages
+flash a message and redirect.
+"""
+from datetime import datetime, timedelta, time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import base64
+import json
+from flask import current_app, g
+from sqlalchemy import text, func, tuple_
+from .. import db
+from ..models.user import Event, EventAttendance, Guild, GuildStats, User
+from ..utils.xp_utils import calculate_cumulative_xp
+from .guild_cache import cached_for_guild
+from .guild_stats import ensure_active_refresher
+from .xp_levels import CUMULATIVE_XP_SQL, MISSING_LEVELS_SQL, execute_xp_aggregate
+
+EVENT_STATUS_COLORS = {
+    "SCHEDULED": "primary",
+    "ACTIVE": "success",
+    "COMPLETED": "secondary",
+    "CANCELLED": "danger",
+}
+
+
+def get_guild(guild_id):
+    """Return the Guild row for guild_id (or None), queried at most once per request."""
+    memo = g.setdefault('guild_memo', {})
+    if guild_id not in memo:
+        memo[guild_id] = Guild.query.filter_by(guild_id=guild_id).first()
+    return memo[guild_id]
+
+
+def get_guild_stats(guild_id):
+    """Return member, activity, cumulative XP and level totals for a guild (cached)."""
+    ensure_active_refresher()
+    return cached_for_guild(guild_id, 'stats', lambda: _load_guild_stats(guild_id))
+
+
+def _load_guild_stats(guild_id):
+    """Read the guild's row of the guild_stats rollup (see services/guild_stats.py)."""
+    stats = db.session.get(GuildStats, guild_id)
+    if stats is None:
+        return {"member_count": 0, "active_users": 0, "total_xp": 0, "average_xp": 0, "total_levels": 0}
+
+    total_xp = stats.total_xp
+    if total_xp is None:
+        # A member is past the XP lookup table, so the triggers couldn't keep the sum
+        current_app.logger.warning(f"guild_stats.total_xp unknown for guild {guild_id}; run `flask guild-stats reconcile`")
+        total_xp = _sum_guild_xp(guild_id)
+    return {
+        "member_count": stats.member_count,
+        "active_users": stats.active_count,
+        "total_xp": int(total_xp),
+        "average_xp": int(total_xp / stats.member_count) if stats.member_count else 0,
+        "total_levels": int(stats.total_level)
+    }
+
+
+def _sum_guild_xp(guild_id):
+    """Cumulative XP of a guild summed from levels, extending the lookup table if needed."""
+    return execute_xp_aggregate(text(f'''
+        SELECT
+            COALESCE(SUM({CUMULATIVE_XP_SQL}), 0) AS total_xp,
+            {MISSING_LEVELS_SQL} AS missing_levels,
+            MAX(lvl.level) AS max_level
+        FROM levels lvl
+        LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        WHERE lvl.guild_id = :guild_id
+    '''), {'guild_id': guild_id}).total_xp
+
+
+def get_guild_info(guild):
+    """Return owner, creation date, locale, channel and member counts for a Guild.
+
+    The guild's own details are cached. The member count is one guild_stats
+    lookup, read each time so a failure only costs that field: it comes back
+    as "Error" next to the rest of the payload, and nothing is cached for it.
+    """
+    info = dict(cached_for_guild(guild.guild_id, 'info', lambda: _load_guild_info(guild)))
+    try:
+        info["member_count"] = get_member_counts([guild.guild_id])[guild.guild_id]
+    except Exception as e:
+        current_app.logger.error(f"Error fetching member count for guild info {guild.guild_id}: {e}")
+        info["member_count"] = "Error"
+    return info
+
+
+def _load_guild_info(guild):
+    owner_name = "Unknown"
+    if guild.owner_id:
+        owner = User.query.filter_by(discord_id=guild.owner_id).first()
+        if owner:
+            owner_name = owner.username
+
+    return {
+        "owner": owner_name,
+        "created_at": guild.created_at.isoformat() if guild.created_at else None,
+        "region": guild.preferred_locale or "Unknown",
+        "channels": guild.channel_count if guild.channel_count is not None else "N/A"
+    }
+
+
+def get_member_counts(guild_ids):
+    """Return {guild_id: member_count} for many guilds with one lookup in guild_stats.
+
+    Guilds the bot has no level rows for are reported as 0.
+    """
+    guild_ids = list(guild_ids)
+    counts = dict.fromkeys(guild_ids, 0)
+    if guild_ids:
+        counts.update(
+            db.session.query(GuildStats.guild_id, GuildStats.member_count)
+            .filter(GuildStats.guild_id.in_(guild_ids)).all()
+        )
+    return counts
+
+
+def get_user_xp_totals(user_id):
+    """Return cumulative XP, voice time and level totals across all of a user's guilds."""
+    row = execute_xp_aggregate(text(f'''
+        SELECT
+            COUNT(*) AS guild_count,
+            COALESCE(SUM({CUMULATIVE_XP_SQL}), 0) AS total_xp,
+            COALESCE(SUM(lvl.voice_time_seconds), 0) AS total_voice_seconds,
+            COALESCE(SUM(lvl.level), 0) AS total_levels,
+            {MISSING_LEVELS_SQL} AS missing_levels,
+            MAX(lvl.level) AS max_level
+        FROM levels lvl
+        LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        WHERE lvl.user_id = :user_id
+    '''), {'user_id': user_id})
+
+    return {
+        "total_xp": int(row.total_xp),
+        "total_voice_seconds": int(row.total_voice_seconds),
+        "average_level": round(row.total_levels / row.guild_count, 1) if row.guild_count > 0 else 0
+    }
+
+
+def get_activity_chart(guild_id, days=7, tz_name='UTC'):
+    """Return daily active-user counts for the last `days` days as Chart.js data.
+
+    Days are calendar days in the caller's IANA timezone and are bucketed by a
+    single GROUP BY; days with no activity are filled with zero here. Raises
+    ValueError for an unknown timezone.
+    """
+    try:
+        tz = ZoneInfo(tz_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {tz_name}")
+
+    today = datetime.now(tz).date()
+    dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    range_start = datetime.combine(dates[0], time.min, tzinfo=tz).timestamp()
+    range_end = datetime.combine(today + timedelta(days=1), time.min, tzinfo=tz).timestamp()
+
+    # Count users who gained XP on each local day
+    rows = db.session.execute(text('''
+        SELECT
+            (to_timestamp(last_xp_time) AT TIME ZONE :tz)::date AS day,
+            COUNT(DISTINCT user_id) AS active_users
+        FROM levels
+        WHERE guild_id = :guild_id
+        AND last_xp_time >= :range_start
+        AND last_xp_time < :range_end
+        GROUP BY day
+    '''), {
+        'guild_id': guild_id,
+        'tz': tz_name,
+        'range_start': range_start,
+        'range_end': range_end
+    }).fetchall()
+    counts = {row.day: row.active_users for row in rows}
+
+    xp_data = [counts.get(day, 0) for day in dates]
+    # Short day names for a week, dates for anything longer
+    label_format = '%a' if days <= 7 else '%b %d'
+
+    # Structure data for Chart.js
+    return {
+        "labels": [day.strftime(label_format) for day in dates],
+        "dates": [day.isoformat() for day in dates],
+        "timezone": tz_name,
+        "datasets": [
+            {
+                "label": "Active Users (XP Gain)",
+                "data": xp_data,
+                "borderColor": "rgba(255, 102, 102, 1)", # Red
+                "backgroundColor": "rgba(255, 102, 102, 0.2)",
+                "fill": True,
+                "tension": 0.4
+            },
+            {
+                "label": "Messages Sent (Est.)", # Indicate it's an estimate/placeholder
+                # Placeholder message data scaling with XP users
+                "data": [count * 10 + 50 if count > 0 else 0 for count in xp_data],
+                "borderColor": "rgba(0, 204, 204, 1)", # Cyan
+                "backgroundColor": "rgba(0, 204, 204, 0.2)",
+                "fill": True,
+                "tension": 0.4
+            }
+        ]
+    }
+
+
+def get_leaderboard(guild_id, page=1, page_size=25, cursor=None):
+    """Return one page of the guild leaderboard plus pagination metadata.
+
+    With cursor=None the page is picked by number (LIMIT/OFFSET). Passing a
+    cursor switches to keyset pagination on (level, xp, user_id): an empty
+    string starts at the top and the returned `next`/`prev` tokens move
+    from there. Raises ValueError for a malformed cursor.
+    """
+    if page < 1:
+        page = 1
+    if page_size < 1 or page_size > 100:
+        page_size = 25
+
+    total_users = get_leaderboard_total(guild_id)
+    pagination = {
+        "page_size": page_size,
+        "total_users": total_users,
+        "total_pages": (total_users + page_size - 1) // page_size
+    }
+
+    if cursor is None:
+        offset = (page - 1) * page_size
+        rows = db.session.execute(text(f'''
+            {LEADERBOARD_SELECT}
+            ORDER BY lvl.level DESC, lvl.xp DESC, lvl.user_id DESC
+            LIMIT :limit OFFSET :offset
+        '''), {'guild_id': guild_id, 'limit': page_size, 'offset': offset}).fetchall()
+        pagination["page"] = page
+        first_rank = offset + 1
+    else:
+        rows, first_rank, has_more, direction = _leaderboard_keyset_page(guild_id, page_size, cursor)
+        has_next = has_more if direction == 'next' else True
+        has_prev = has_more if direction == 'prev' else first_rank > 1
+        pagination["next"] = _encode_leaderboard_cursor(rows[-1], first_rank + len(rows) - 1, 'next') if rows and has_next else None
+        pagination["prev"] = _encode_leaderboard_cursor(rows[0], first_rank, 'prev') if rows and has_prev else None
+
+    # SQL already sorts by level/xp, so the rank is just the row position
+    leaderboard = [
+        {
+            "rank": first_rank + idx,
+            "user_id": row.discord_id,
+            "username": row.username,
+            "avatar": row.avatar,
+            "level": row.level,
+            "xp": int(calculate_cumulative_xp(row.level, row.xp))
+        }
+        for idx, row in enumerate(rows)
+    ]
+
+    return {
+        "leaderboard": leaderboard,
+        "pagination": pagination
+    }
+
+
+LEADERBOARD_SELECT = '''
+    SELECT
+        u.discord_id,
+        u.username,
+        u.avatar,
+        lvl.level,
+        lvl.xp
+    FROM levels lvl
+    JOIN users u ON lvl.user_id = u.discord_id
+    WHERE lvl.guild_id = :guild_id
+'''
+
+
+def get_leaderboard_total(guild_id):
+    """Number of ranked members, cached briefly so paging doesn't recount the guild."""
+    return cached_for_guild(
+        guild_id, 'leaderboard_total',
+        lambda: db.session.execute(
+            text("SELECT COUNT(*) FROM levels WHERE guild_id = :guild_id"),
+            {'guild_id': guild_id}
+        ).scalar() or 0,
+        timeout=current_app.config['LEADERBOARD_TOTAL_TTL']
+    )
+
+
+def _leaderboard_keyset_page(guild_id, page_size, cursor):
+    """Fetch the rows after (or before) a cursor. Returns rows, first rank, more-available flag and direction."""
+    params = {'guild_id': guild_id, 'limit': page_size + 1}
+    if not cursor:
+        direction, first_rank = 'next', 1
+        condition, order = "", "DESC"
+    else:
+        position = _decode_leaderboard_cursor(cursor)
+        direction = position['d']
+        params.update(level=position['l'], xp=position['x'], user_id=position['u'])
+        if direction == 'next':
+            condition, order = "AND (lvl.level, lvl.xp, lvl.user_id) < (:level, :xp, :user_id)", "DESC"
+            first_rank = position['r'] + 1
+        else:
+            # Walk backwards from the cursor, then flip the rows back into rank order
+            condition, order = "AND (lvl.level, lvl.xp, lvl.user_id) > (:level, :xp, :user_id)", "ASC"
+
+    rows = db.session.execute(text(f'''
+        {LEADERBOARD_SELECT}
+        {condition}
+        ORDER BY lvl.level {order}, lvl.xp {order}, lvl.user_id {order}
+        LIMIT :limit
+    '''), params).fetchall()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == 'prev':
+        rows.reverse()
+        first_rank = max(1, position['r'] - len(rows))
+    return rows, first_rank, has_more, direction
+
+
+def _encode_leaderboard_cursor(row, rank, direction):
+    payload = json.dumps({'l': row.level, 'x': row.xp, 'u': row.discord_id, 'r': rank, 'd': direction},
+                         separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_leaderboard_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if position['d'] not in ('next', 'prev'):
+            raise ValueError(position['d'])
+        return {
+            'l': int(position['l']),
+            'x': int(position['x']),
+            'u': str(position['u']),
+            'r': int(position['r']),
+            'd': position['d']
+        }
+    except Exception:
+        raise ValueError("Invalid leaderboard cursor")
+
+
+def get_achievements(guild_id, viewer_id):
+    """Return the guild's achievements with tiers and the viewer's completion status.
+
+    The guild-wide part (definitions, tiers, completion counts) is cached and
+    shared by every viewer; only the viewer's own rows are read per request.
+    """
+    achievements = cached_for_guild(guild_id, 'achievements', lambda: _load_guild_achievements(guild_id))
+
+    viewer_rows = {
+        row.base_achievement_id: row
+        for row in db.session.execute(text('''
+            SELECT base_achievement_id, completed, last_tier_achieved_at
+            FROM user_achievements
+            WHERE guild_id = :guild_id AND user_id = :user_id
+        '''), {'guild_id': guild_id, 'user_id': viewer_id})
+    }
+
+    result = []
+    for achievement in achievements:
+        viewer_row = viewer_rows.get(achievement["id"])
+        result.append(dict(
+            achievement,
+            completed=viewer_row.completed if viewer_row else None,
+            last_tier_achieved_at=viewer_row.last_tier_achieved_at if viewer_row else None  # ISO string in JSON responses
+        ))
+    return result
+
+
+def _load_guild_achievements(guild_id):
+    """Achievement definitions with tiers and member completion counts, without viewer data.
+
+    One query: completion counts come from the trigger-maintained
+    achievement_stats table and the member count from guild_stats.
+    """
+    achievements = db.session.execute(text('''
+        SELECT
+            a.id,
+            a.name,
+            a.description,
+            a.requirement_type,
+            a.icon_path,
+            COALESCE(s.completed_count, 0) AS members_completed,
+            COALESCE((SELECT member_count FROM guild_stats WHERE guild_id = :guild_id), 0) AS member_count,
+            tiers.tiers
+        FROM achievements a
+        LEFT JOIN achievement_stats s ON s.guild_id = a.guild_id AND s.achievement_id = a.id
+        CROSS JOIN LATERAL (
+            SELECT COALESCE(json_agg(json_build_object(
+                'tier_level', t.tier_level,
+                'title', t.title,
+                'requirement_value', t.requirement_value,
+                'reward_xp', t.reward_xp,
+                'reward_role_id', t.reward_role_id,
+                'icon_path', t.icon_path
+            ) ORDER BY t.tier_level), '[]') AS tiers
+            FROM achievement_tiers t
+            WHERE t.achievement_id = a.id
+        ) tiers
+        WHERE a.guild_id = :guild_id
+        ORDER BY a.created_at DESC
+    '''), {'guild_id': guild_id}).fetchall()
+
+    return [
+        {
+            "id": achievement.id,
+            "name": achievement.name,
+            "description": achievement.description,
+            "category": achievement.requirement_type,
+            "icon": achievement.icon_path or "medal",
+            "progress": 0,
+            "tiers": achievement.tiers,
+            "members_completed": achievement.members_completed,
+            "member_count": achievement.member_count
+        }
+        for achievement in achievements
+    ]
+
+
+def get_events(guild_id, status_filter='upcoming', limit=20, start_from=None, start_to=None):
+    """Return the guild's first `limit` upcoming or past events with participant counts.
+
+    start_from/start_to (unix timestamps) keep events starting in
+    [start_from, start_to). Raises ValueError for an unknown status filter.
+    """
+    query, _ = _events_query(guild_id, status_filter, start_from, start_to)
+    return _format_events(guild_id, query.limit(limit).all())
+
+
+def get_events_page(guild_id, status_filter='upcoming', page_size=20, cursor=None, start_from=None, start_to=None):
+    """Return one page of events plus the cursor of the next one.
+
+    Keyset pagination on (start_time, internal_id), in the status filter's
+    order: an empty or missing cursor starts at the first event and
+    `pagination.next` (None on the last page) moves on from there. Raises
+    ValueError for an unknown status filter or a malformed cursor.
+    """
+    if page_size < 1 or page_size > 100:
+        page_size = 20
+    query, ascending = _events_query(guild_id, status_filter, start_from, start_to)
+    if cursor:
+        position = _decode_events_cursor(cursor, status_filter)
+        after = tuple_(Event.start_time, Event.internal_id)
+        query = query.filter(after > (position['s'], position['i']) if ascending
+                             else after < (position['s'], position['i']))
+
+    events = query.limit(page_size + 1).all()
+    has_more = len(events) > page_size
+    events = events[:page_size]
+    return {
+        "events": _format_events(guild_id, events),
+        "pagination": {
+            "page_size": page_size,
+            "next": _encode_events_cursor(events[-1], status_filter) if has_more else None
+        }
+    }
+
+
+def _events_query(guild_id, status_filter, start_from, start_to):
+    """The filtered, ordered event query and whether it runs in ascending start order"""
+    now_timestamp = datetime.utcnow().timestamp()
+    query = Event.query.filter_by(guild_id=guild_id)
+
+    if status_filter == 'upcoming':
+        # Scheduled or Active (end time is in future or null)
+        query = query.filter(
+            Event.status.in_(['SCHEDULED', 'ACTIVE']),
+            (Event.end_time == None) | (Event.end_time > now_timestamp)
+        )
+        ascending = True
+    elif status_filter == 'past':
+        # Completed or Cancelled or Active but end time is past
+        query = query.filter(
+            Event.status.in_(['COMPLETED', 'CANCELLED']) |
+            ((Event.status == 'ACTIVE') & (Event.end_time != None) & (Event.end_time <= now_timestamp))
+        )
+        ascending = False
+    else:
+        raise ValueError("Invalid status filter. Use 'upcoming' or 'past'.")
+
+    if start_from is not None:
+        query = query.filter(Event.start_time >= start_from)
+    if start_to is not None:
+        query = query.filter(Event.start_time < start_to)
+    # internal_id breaks start_time ties so the keyset cursor never skips or repeats an event
+    if ascending:
+        query = query.order_by(Event.start_time.asc(), Event.internal_id.asc())
+    else:
+        query = query.order_by(Event.start_time.desc(), Event.internal_id.desc())
+    return query, ascending
+
+
+def _format_events(guild_id, events):
+    # Batch fetch participant counts for all event_ids in this guild
+    event_ids = [event.event_id for event in events]
+    participant_counts = {
+        row.event_id: row.count
+        for row in db.session.query(EventAttendance.event_id, func.count().label('count'))
+        .filter(EventAttendance.event_id.in_(event_ids), EventAttendance.guild_id == guild_id)
+        .group_by(EventAttendance.event_id).all()
+    } if event_ids else {}
+
+    formatted_events = []
+    for event in events:
+        start_dt = datetime.fromtimestamp(event.start_time)
+        end_dt = datetime.fromtimestamp(event.end_time) if event.end_time else None
+        formatted_events.append({
+            "internal_id": event.internal_id,
+            "event_id": event.event_id,
+            "name": event.name,
+            "description": event.description,
+            "start_time_iso": start_dt.isoformat(),
+            "end_time_iso": end_dt.isoformat() if end_dt else None,
+            "start_time_formatted": start_dt.strftime("%b %d, %Y %I:%M %p UTC"),
+            "end_time_formatted": end_dt.strftime("%b %d, %Y %I:%M %p UTC") if end_dt else "-",
+            "event_type": event.event_type,
+            "type": event.event_type.lower() if event.event_type else "other",
+            "status": event.status,
+            "status_color": EVENT_STATUS_COLORS.get(event.status, "secondary"),
+            "participants": participant_counts.get(event.event_id, 0),
+            "creator_id": event.creator_id,
+        })
+    return formatted_events
+
+
+def _encode_events_cursor(event, status_filter):
+    payload = json.dumps({'s': event.start_time, 'i': event.internal_id, 'f': status_filter}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode_events_cursor(cursor, status_filter):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if position['f'] != status_filter:
+            raise ValueError(position['f'])  # A cursor only continues the listing it came from
+        return {'s': float(position['s']), 'i': int(position['i'])}
+    except Exception:
+        raise ValueError("Invalid events cursor")
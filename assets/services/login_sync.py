@@ -0,0 +1,106 @@
+"""
+Login-time sync of a Discord user into users and user_guild.
+
+The whole sync is one transaction of two statements, whatever the number
+of guilds:
+
+1. an upsert of the user's profile, dashboard role and last_login that
+   returns the User row;
+2. a diff of user_guild against the guilds the user administers and the
+   bot is in, deleting and inserting in bulk and returning what changed.
+"""
+import json
+from flask import current_app
+from sqlalchemy import select, text
+from .. import db
+from ..models.user import User
+
+UPSERT_USER_SQL = text('''
+    INSERT INTO users (discord_id, username, discriminator, email, avatar, role, last_login)
+    VALUES (
+        :user_id, :username, :discriminator, :email, :avatar,
+        CASE
+            WHEN :is_owner THEN CAST(:owner_role AS JSONB)
+            WHEN EXISTS (SELECT 1 FROM guilds WHERE guild_id = ANY(:admin_guild_ids)) THEN CAST(:admin_role AS JSONB)
+            ELSE CAST(:user_role AS JSONB)
+        END,
+        NOW()
+    )
+    ON CONFLICT (discord_id) DO UPDATE SET
+        username = EXCLUDED.username,
+        discriminator = EXCLUDED.discriminator,
+        email = EXCLUDED.email,
+        avatar = EXCLUDED.avatar,
+        role = EXCLUDED.role,
+        last_login = EXCLUDED.last_login
+    RETURNING *
+''')
+
+# Each CTE sees the table as it was before the statement, so the delete and
+# insert can't interfere with each other
+SYNC_USER_GUILDS_SQL = text('''
+    WITH mutual AS (
+        SELECT guild_id FROM guilds WHERE guild_id = ANY(:admin_guild_ids)
+    ), removed AS (
+        DELETE FROM user_guild
+        WHERE user_id = :user_id AND guild_id NOT IN (SELECT guild_id FROM mutual)
+        RETURNING guild_id
+    ), added AS (
+        INSERT INTO user_guild (user_id, guild_id)
+        SELECT :user_id, guild_id FROM mutual
+        ON CONFLICT DO NOTHING
+        RETURNING guild_id
+    )
+    SELECT 'mutual' AS change, guild_id FROM mutual
+    UNION ALL SELECT 'added', guild_id FROM added
+    UNION ALL SELECT 'removed', guild_id FROM removed
+''')
+
+
+def sync_login(discord_data, admin_guild_ids, owner_id=None):
+    """Upsert the user and their dashboard guild access, then commit.
+
+    :param discord_data: id, username, discriminator, email and avatar from Discord.
+    :param admin_guild_ids: IDs of the Discord guilds the user administers.
+    :param owner_id: BOT_OWNER_ID; that user gets the owner role.
+    :return: (user, mutual_guild_ids), where mutual_guild_ids are the guilds the
+             user administers that the bot is also in.
+    """
+    user_id = str(discord_data['id'])
+    admin_guild_ids = sorted(str(guild_id) for guild_id in admin_guild_ids)
+    try:
+        user = db.session.execute(
+            select(User).from_statement(UPSERT_USER_SQL),
+            {
+                'user_id': user_id,
+                'username': discord_data['username'],
+                'discriminator': discord_data.get('discriminator'),
+                'email': discord_data.get('email'),
+                'avatar': discord_data.get('avatar'),
+                'is_owner': bool(owner_id) and user_id == str(owner_id),
+                'admin_guild_ids': admin_guild_ids,
+                'owner_role': json.dumps(['owner']),
+                'admin_role': json.dumps(['admin']),
+                'user_role': json.dumps(['user']),
+            },
+            execution_options={'populate_existing': True}
+        ).scalar_one()
+
+        changes = {'mutual': set(), 'added': set(), 'removed': set()}
+        for change, guild_id in db.session.execute(
+            SYNC_USER_GUILDS_SQL, {'user_id': user_id, 'admin_guild_ids': admin_guild_ids}
+        ):
+            changes[change].add(guild_id)
+        # Detached, the row keeps the values just returned instead of being expired and re-read by the commit
+        db.session.expunge(user)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if changes['removed']:
+        current_app.logger.info(f"Removed guilds {changes['removed']} for user {user_id}")
+    if changes['added']:
+        current_app.logger.info(f"Added guilds {changes['added']} for user {user_id}")
+    current_app.logger.info(f"Set dashboard role for user {user_id} to {user.role}")
+    return user, changes['mutual']
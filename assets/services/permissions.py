@@ -0,0 +1,120 @@
+"""
+Per-session snapshot of the signed-in user's identity and guild permissions.
+
+The snapshot (roles, display name, avatar and the guild IDs the user can view
+and manage) is written to the session at login and rebuilt from the database
+once it is older than PERMISSION_SNAPSHOT_TTL. In between, Flask-Login's
+user_loader returns a SessionUser built from it, so permission checks are set
+lookups and an authenticated request doesn't query users or user_guild at all.
+The full User row is loaded only if a handler touches an attribute the
+snapshot doesn't carry (e.g. current_user.guilds or last_login).
+"""
+import time
+from flask import current_app, session
+from flask_login import UserMixin
+from sqlalchemy import text
+from .. import db
+from ..models.user import User
+
+SESSION_KEY = 'permissions'
+
+
+def store_snapshot(user, viewable_guild_ids, roles=None):
+    """Write a fresh snapshot for user to the session and return it.
+
+    Pass roles when they were just changed with SQL the ORM object hasn't seen.
+    """
+    roles = list(roles if roles is not None else (user.role or []))
+    viewable = sorted(str(guild_id) for guild_id in viewable_guild_ids)
+    snapshot = {
+        'user_id': user.discord_id,
+        'username': user.username,
+        'avatar': user.avatar,
+        'roles': roles,
+        'viewable': viewable,
+        # Owners can manage any guild; see SessionUser.can_manage_guild
+        'manageable': viewable if 'admin' in roles or 'owner' in roles else [],
+        'refreshed_at': time.time()
+    }
+    session[SESSION_KEY] = snapshot
+    return snapshot
+
+
+def refresh_snapshot(user):
+    """Rebuild the snapshot from the database (one query for the user's guilds)."""
+    viewable = db.session.execute(
+        text("SELECT guild_id FROM user_guild WHERE user_id = :user_id"),
+        {'user_id': user.discord_id}
+    ).scalars()
+    return store_snapshot(user, viewable)
+
+
+def clear_snapshot():
+    session.pop(SESSION_KEY, None)
+
+
+def load_session_user(user_id):
+    """Flask-Login user_loader: a SessionUser from a fresh snapshot, refreshing it if stale."""
+    user_id = str(user_id)
+    snapshot = session.get(SESSION_KEY)
+    ttl = current_app.config['PERMISSION_SNAPSHOT_TTL']
+    if snapshot and snapshot.get('user_id') == user_id and time.time() - snapshot['refreshed_at'] < ttl:
+        return SessionUser(snapshot)
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        clear_snapshot()
+        return None
+    return SessionUser(refresh_snapshot(user), user)
+
+
+class SessionUser(UserMixin):
+    """current_user backed by the session's permission snapshot"""
+
+    def __init__(self, snapshot, user=None):
+        self._user = user
+        self.discord_id = snapshot['user_id']
+        self.username = snapshot['username']
+        self.avatar = snapshot['avatar']
+        self.role = list(snapshot['roles'])
+        self.viewable_guild_ids = frozenset(snapshot['viewable'])
+        self.manageable_guild_ids = frozenset(snapshot['manageable'])
+
+    def get_id(self):
+        return self.discord_id
+
+    @property
+    def user(self):
+        """The User row, loaded on first use"""
+        if self._user is None:
+            self._user = db.session.get(User, self.discord_id)
+        return self._user
+
+    def __getattr__(self, name):
+        # Only reached for attributes the snapshot doesn't carry
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f"SessionUser('{self.username}', '{self.discord_id}')"
+
+    @property
+    def is_owner(self):
+        return 'owner' in self.role
+
+    @property
+    def is_admin(self):
+        return 'admin' in self.role
+
+    @property
+    def is_moderator(self):
+        return 'moderator' in self.role or self.is_admin
+
+    def can_view_guild(self, guild_id):
+        """Check if user can view a specific guild"""
+        return str(guild_id) in self.viewable_guild_ids
+
+    def can_manage_guild(self, guild_id):
+        """Check if user can manage a specific guild based on their dashboard role"""
+        return self.is_owner or str(guild_id) in self.manageable_guild_ids
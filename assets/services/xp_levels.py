@@ -0,0 +1,96 @@
+"""
+Keeps the xp_level_totals lookup table in step with utils.xp_utils.
+
+The table materializes total_xp_for_level so cumulative XP can be summed with
+a join in SQL instead of pulling every (level, xp) row into Python. Values are
+always generated from the Python formula, so changing the formula only needs
+`flask xp sync-table` (or the next request that meets an unknown level).
+
+Levels 0..DEFAULT_MAX_LEVEL are written up front. The guild_stats triggers
+can't extend the table, so a member who reaches a level past it leaves that
+guild's total_xp NULL (unknown) until `flask xp sync-table` extends the table
+to the highest level in `levels` and `flask guild-stats reconcile` rebuilds
+the totals; `flask xp check-table` reports both.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import text
+from .. import db
+from ..utils.xp_utils import total_xp_for_level
+
+# Levels written up front even if no member has reached them yet
+DEFAULT_MAX_LEVEL = 1000
+
+# Cumulative XP of one `levels` row (alias lvl) joined to xp_level_totals (alias xlt).
+# Mirrors xp_utils.calculate_cumulative_xp.
+CUMULATIVE_XP_SQL = "CASE WHEN lvl.level <= 0 THEN GREATEST(lvl.xp, 0) ELSE xlt.total_xp + lvl.xp END"
+
+# Rows whose level has no lookup entry yet; callers sync and retry when non-zero
+MISSING_LEVELS_SQL = "COUNT(*) FILTER (WHERE lvl.level > 0 AND xlt.level IS NULL)"
+
+
+def level_totals(max_level=DEFAULT_MAX_LEVEL):
+    """Return (levels, totals) lists for levels 0..max_level from the Python formula."""
+    levels = list(range(0, max_level + 1))
+    return levels, [float(total_xp_for_level(level)) for level in levels]
+
+
+def sync_level_totals(max_level=DEFAULT_MAX_LEVEL):
+    """Write totals for levels 0..max_level, rewriting rows that no longer match the formula.
+
+    Runs on its own connection and commits immediately, so it is safe to call
+    from inside a request. Returns the number of rows inserted or changed.
+    """
+    levels, totals = level_totals(max(max_level or 0, DEFAULT_MAX_LEVEL))
+    with db.engine.begin() as conn:
+        result = conn.execute(text('''
+            INSERT INTO xp_level_totals (level, total_xp)
+            SELECT * FROM unnest(CAST(:levels AS INTEGER[]), CAST(:totals AS DOUBLE PRECISION[]))
+            ON CONFLICT (level) DO UPDATE SET total_xp = EXCLUDED.total_xp
+            WHERE xp_level_totals.total_xp IS DISTINCT FROM EXCLUDED.total_xp
+        '''), {'levels': levels, 'totals': totals})
+        return result.rowcount
+
+
+def execute_xp_aggregate(query, params):
+    """Run an aggregate built on CUMULATIVE_XP_SQL, filling the lookup table first if needed.
+
+    The query must select `missing_levels` (MISSING_LEVELS_SQL) and `max_level`.
+    """
+    row = db.session.execute(query, params).one()
+    if row.missing_levels:
+        sync_level_totals(row.max_level)
+        row = db.session.execute(query, params).one()
+    return row
+
+
+xp_cli = AppGroup('xp', help='Maintain the XP lookup table.')
+
+
+@xp_cli.command('sync-table')
+@click.option('--max-level', default=DEFAULT_MAX_LEVEL, show_default=True)
+def sync_table_command(max_level):
+    """Rewrite xp_level_totals from xp_utils (run after changing the formula)."""
+    max_level = max(max_level, db.session.execute(text("SELECT COALESCE(MAX(level), 0) FROM levels")).scalar())
+    changed = sync_level_totals(max_level)
+    click.echo(f"xp_level_totals: {changed} row(s) written up to level {max(max_level, DEFAULT_MAX_LEVEL)}")
+    unknown = db.session.execute(text("SELECT COUNT(*) FROM guild_stats WHERE total_xp IS NULL")).scalar()
+    if changed or unknown:
+        click.echo("Run `flask guild-stats reconcile` to rebuild guild XP totals.")
+
+
+@xp_cli.command('check-table')
+def check_table_command():
+    """Report rows of xp_level_totals that disagree with xp_utils or levels it doesn't cover."""
+    stored = dict(db.session.execute(text("SELECT level, total_xp FROM xp_level_totals")).all())
+    max_level = db.session.execute(text("SELECT COALESCE(MAX(level), 0) FROM levels")).scalar()
+    levels, totals = level_totals(max(max(stored, default=DEFAULT_MAX_LEVEL), max_level))
+    drift = [level for level, total in zip(levels, totals) if stored.get(level) != total]
+    unknown = db.session.execute(text("SELECT COUNT(*) FROM guild_stats WHERE total_xp IS NULL")).scalar()
+    if drift:
+        click.echo(f"{len(drift)} level(s) out of sync or missing, first: {drift[:10]}. Run `flask xp sync-table`.")
+    if unknown:
+        click.echo(f"{unknown} guild(s) have an unknown total_xp. Run `flask guild-stats reconcile` after syncing.")
+    if drift or unknown:
+        raise SystemExit(1)
+    click.echo(f"xp_level_totals matches xp_utils for levels 0..{levels[-1]}")
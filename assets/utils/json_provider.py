@@ -0,0 +1,76 @@
+"""
+JSON provider for the app: orjson when it's installed, the stdlib otherwise.
+
+Either way datetimes come out as ISO 8601, with naive values (what our
+TIMESTAMP columns return) taken as UTC, and dates as ISO dates, instead of
+Flask's default HTTP date strings. orjson writes UTF-8 rather than \\u
+escapes and keys keep the order the payload was built in.
+"""
+import dataclasses
+import datetime
+import decimal
+import uuid
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder produces the same JSON, just slower
+    orjson = None
+
+
+def _default(o):
+    if isinstance(o, datetime.datetime):
+        if o.tzinfo is None or o.tzinfo.utcoffset(o) is None:
+            o = o.replace(tzinfo=datetime.timezone.utc)
+        return o.isoformat()
+    if isinstance(o, (datetime.date, datetime.time)):
+        return o.isoformat()
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, '__html__'):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class APIJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with ISO datetimes and an orjson fast path."""
+
+    default = staticmethod(_default)
+    sort_keys = False
+
+    def _orjson_option(self, kwargs):
+        """orjson flags equivalent to json.dumps kwargs, or None if orjson can't honour them."""
+        if orjson is None or not kwargs.keys() <= {'indent', 'separators', 'sort_keys', 'ensure_ascii'}:
+            return None
+        indent = kwargs.get('indent')
+        if indent not in (None, 2) or (indent is None and kwargs.get('separators', (',', ':')) != (',', ':')):
+            return None
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def _encode(self, obj, **kwargs):
+        option = self._orjson_option(kwargs)
+        if option is not None:
+            try:
+                return orjson.dumps(obj, default=_default, option=option)
+            except orjson.JSONEncodeError:
+                pass  # e.g. integers past 64 bits, which the stdlib encoder handles
+        return super().dumps(obj, **kwargs).encode()
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj, **kwargs).decode()
+
+    def response(self, *args, **kwargs):
+        # Same as DefaultJSONProvider.response, minus a str round trip of the body
+        obj = self._prepare_response_obj(args, kwargs)
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            body = self._encode(obj, indent=2)
+        else:
+            body = self._encode(obj, separators=(',', ':'))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
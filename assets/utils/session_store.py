@@ -0,0 +1,299 @@
+"""
+Server-side sessions in a SQLite table shared by every worker on the host.
+
+Replaces Flask-Session's filesystem backend, which rewrote one file per
+session on every request and only cleaned up once it passed
+SESSION_FILE_THRESHOLD files, at which point it evicted the oldest *live*
+sessions. Here each session is one row keyed by its id, with an indexed
+expiry:
+
+* reading a session is a primary-key lookup on a memory-mapped file;
+* a session is only rewritten when its contents change or its expiry has
+  drifted by more than SESSION_REFRESH_INTERVAL, not on every request;
+* a daemon thread in each worker deletes expired rows in small batches
+  every SESSION_SWEEP_INTERVAL seconds (`flask sessions sweep` does the
+  same on demand).
+
+Sessions still stored by the old filesystem backend are moved over the
+first time their cookie is seen, so switching backends logs nobody out.
+"""
+import os
+import random
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+
+import click
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask_session.sessions import ServerSideSession, SessionInterface
+from itsdangerous import BadSignature, want_bytes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    sid TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires);
+"""
+
+
+class SQLiteSession(ServerSideSession):
+    # Expiry of the stored row, used to skip rewriting sessions that haven't changed
+    stored_expires = None
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Flask session interface backed by a SQLite table.
+
+    :param path: the SQLite file. Put it on local disk, or on tmpfs if losing
+                 sessions on reboot is acceptable.
+    :param use_signer: whether to sign the session id cookie.
+    :param permanent: whether sessions are permanent by default.
+    :param refresh_interval: seconds an unchanged session may go without having
+                             its expiry (and cookie) pushed forward.
+    :param sweep_interval: seconds between background sweeps of expired rows;
+                           0 disables the sweeper thread.
+    :param legacy_file_dir: a Flask-Session filesystem directory to import
+                            sessions from on first use, or None.
+    """
+
+    session_class = SQLiteSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path, use_signer=False, permanent=True, refresh_interval=3600,
+                 sweep_interval=600, legacy_file_dir=None, legacy_key_prefix='session:', logger=None):
+        self.path = path
+        self.use_signer = use_signer
+        self.permanent = permanent
+        self.refresh_interval = refresh_interval
+        self.sweep_interval = sweep_interval
+        self.legacy_key_prefix = legacy_key_prefix
+        self.logger = logger
+        self.has_same_site_capability = hasattr(self, "get_cookie_samesite")
+        self._local = threading.local()
+        self._sweeper_lock = threading.Lock()
+        self._sweeper_pid = None
+        self.legacy_file_dir = legacy_file_dir
+        self.legacy_cache = None
+        if legacy_file_dir and os.path.isdir(legacy_file_dir):
+            from cachelib.file import FileSystemCache
+            self.legacy_cache = FileSystemCache(legacy_file_dir, threshold=0)
+        self._connect().executescript(SCHEMA)
+
+    @classmethod
+    def from_app(cls, app):
+        path = app.config.get('SESSION_DB_PATH') or os.path.join(app.instance_path, 'sessions.sqlite3')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return cls(
+            path,
+            use_signer=app.config.get('SESSION_USE_SIGNER', False),
+            permanent=app.config.get('SESSION_PERMANENT', True),
+            refresh_interval=app.config['SESSION_REFRESH_INTERVAL'],
+            sweep_interval=app.config['SESSION_SWEEP_INTERVAL'],
+            legacy_file_dir=app.config.get('SESSION_FILE_DIR'),
+            logger=app.logger
+        )
+
+    # --- Storage ---
+
+    def _connect(self):
+        """Per-thread connection, reopened after a fork so workers never share a handle."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # Durable across crashes of the app, fsync only at checkpoints
+            conn.execute('PRAGMA mmap_size=67108864')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, sid):
+        """Return (data, expires) for a live session, or None."""
+        row = self._connect().execute(
+            "SELECT data, expires FROM sessions WHERE sid = ? AND expires > ?", (sid, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return self.serializer.loads(row[0]), row[1]
+        except ValueError:
+            return None
+
+    def store(self, sid, data, expires):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)",
+            (sid, self.serializer.dumps(data), expires)
+        )
+
+    def delete(self, sid):
+        self._connect().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def sweep(self, batch_size=1000):
+        """Delete expired sessions in batches so writers are never blocked for long. Returns the count."""
+        conn = self._connect()
+        removed = 0
+        while True:
+            cursor = conn.execute(
+                "DELETE FROM sessions WHERE sid IN (SELECT sid FROM sessions WHERE expires <= ? LIMIT ?)",
+                (time.time(), batch_size)
+            )
+            removed += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return removed
+
+    def stats(self):
+        conn = self._connect()
+        total, expired = conn.execute(
+            "SELECT COUNT(*), COUNT(*) FILTER (WHERE expires <= ?) FROM sessions", (time.time(),)
+        ).fetchone()
+        page_count, page_size = conn.execute("PRAGMA page_count").fetchone()[0], conn.execute("PRAGMA page_size").fetchone()[0]
+        return {'sessions': total, 'expired': expired, 'size_bytes': page_count * page_size, 'path': self.path}
+
+    # --- Background expiry ---
+
+    def _ensure_sweeper(self):
+        if not self.sweep_interval or self._sweeper_pid == os.getpid():
+            return
+        with self._sweeper_lock:
+            if self._sweeper_pid != os.getpid():
+                self._sweeper_pid = os.getpid()
+                threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True).start()
+
+    def _sweep_forever(self):
+        while True:
+            # Jitter so the workers forked together don't all sweep at once
+            time.sleep(self.sweep_interval * random.uniform(0.5, 1.5))
+            try:
+                removed = self.sweep()
+                if removed and self.logger:
+                    self.logger.info(f'Session sweep removed {removed} expired session(s)')
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f'Session sweep failed: {str(e)}')
+
+    # --- Flask session interface ---
+
+    def _load_legacy(self, sid):
+        """Move a session written by the old filesystem backend into the table."""
+        if self.legacy_cache is None:
+            return None
+        key = self.legacy_key_prefix + sid
+        data = self.legacy_cache.get(key)
+        if data is not None:
+            self.legacy_cache.delete(key)
+        return data
+
+    def open_session(self, app, request):
+        self._ensure_sweeper()
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if not sid:
+            return self.session_class(sid=self._generate_sid(), permanent=self.permanent)
+        if self.use_signer:
+            signer = self._get_signer(app)
+            if signer is None:
+                return None
+            try:
+                sid = signer.unsign(sid).decode()
+            except BadSignature:
+                return self.session_class(sid=self._generate_sid(), permanent=self.permanent)
+
+        stored = self.load(sid)
+        if stored is not None:
+            session = self.session_class(stored[0], sid=sid)
+            session.stored_expires = stored[1]
+            return session
+
+        legacy = self._load_legacy(sid)
+        if legacy is not None:
+            session = self.session_class(legacy, sid=sid)
+            session.modified = True  # Written to the table on save
+            return session
+        return self.session_class(sid=sid, permanent=self.permanent)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.delete(session.sid)
+                response.delete_cookie(app.config["SESSION_COOKIE_NAME"], domain=domain, path=path)
+            return
+
+        # Non-permanent sessions end with the browser, but the row still needs a lifetime
+        cookie_expires = self.get_expiration_time(app, session)
+        expires = (cookie_expires or datetime.now(timezone.utc) + app.permanent_session_lifetime).timestamp()
+        if (not session.modified and session.stored_expires is not None
+                and expires - session.stored_expires < self.refresh_interval):
+            return
+
+        self.store(session.sid, dict(session), expires)
+        session.stored_expires = expires
+
+        session_id = session.sid
+        if self.use_signer:
+            session_id = self._get_signer(app).sign(want_bytes(session.sid)).decode()
+        conditional_cookie_kwargs = {}
+        if self.has_same_site_capability:
+            conditional_cookie_kwargs["samesite"] = self.get_cookie_samesite(app)
+        response.set_cookie(app.config["SESSION_COOKIE_NAME"], session_id,
+                            expires=cookie_expires, httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path, secure=self.get_cookie_secure(app),
+                            **conditional_cookie_kwargs)
+
+
+sessions_cli = AppGroup('sessions', help='Maintain the server-side session store.')
+
+
+def _interface():
+    from flask import current_app
+    interface = current_app.session_interface
+    if not isinstance(interface, SQLiteSessionInterface):
+        raise click.ClickException(f"SESSION_TYPE is not 'sqlite' (using {type(interface).__name__})")
+    return interface
+
+
+@sessions_cli.command('sweep')
+def sweep_command():
+    """Delete expired sessions now."""
+    click.echo(f"Removed {_interface().sweep()} expired session(s)")
+
+
+@sessions_cli.command('stats')
+def stats_command():
+    """Show session counts and store size."""
+    for name, value in _interface().stats().items():
+        click.echo(f"{name}: {value}")
+
+
+@sessions_cli.command('purge-files')
+@click.option('--all', 'purge_all', is_flag=True, help='Also delete files that have not expired yet.')
+def purge_files_command(purge_all):
+    """Delete leftover Flask-Session files from SESSION_FILE_DIR.
+
+    Live files are imported on their owner's next request, so by default only
+    expired ones are removed. Once PERMANENT_SESSION_LIFETIME has passed
+    since the switch, nothing live is left and the directory can go.
+    """
+    legacy_file_dir = _interface().legacy_file_dir
+    if not legacy_file_dir or not os.path.isdir(legacy_file_dir):
+        click.echo("No session file directory to purge")
+        return
+    removed = 0
+    now = time.time()
+    for name in os.listdir(legacy_file_dir):
+        filename = os.path.join(legacy_file_dir, name)
+        try:
+            # cachelib prefixes each file with its expiry; 0 marks its own bookkeeping files
+            with open(filename, 'rb') as f:
+                (expires,) = struct.unpack('I', f.read(4))
+            if expires and (purge_all or expires < now):
+                os.remove(filename)
+                removed += 1
+        except (OSError, struct.error):
+            continue
+    click.echo(f"Removed {removed} session file(s) from {legacy_file_dir}")
@@ -0,0 +1,270 @@
+"""
+Flask-Caching backend shared by every worker process on a host.
+
+Entries live in a SQLite database on tmpfs (/dev/shm by default) that each
+worker opens memory-mapped, so all gunicorn workers read and write one cache
+and it survives worker recycling (max_requests) without an external service.
+
+Values are pickled, so whoever can write the file can run code in the app.
+The file sits in a directory of its own (/dev/shm/<app>-<uid> by default)
+created with mode 0700, is kept at 0600, and is refused unless both belong
+to the user the app runs as.
+Entries carry a TTL, and the least recently used ones are evicted once the
+cache grows past CACHE_THRESHOLD entries.
+
+Hit and miss counts are kept per process and folded into the shared file
+every few seconds, so `stats()` reports totals across all workers.
+"""
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+from flask_caching.backends.base import BaseCache
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL NOT NULL,      -- 0 means never
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_accessed ON cache_entries (accessed);
+CREATE INDEX IF NOT EXISTS ix_cache_entries_expires ON cache_entries (expires) WHERE expires > 0;
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_stats (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0);
+"""
+
+
+def _check_owner(path, st):
+    if st.st_uid != os.getuid():
+        raise PermissionError(f"Refusing to use {path}: owned by uid {st.st_uid}, not {os.getuid()}")
+
+
+def _private_dir(path):
+    """Create path with mode 0700, or check an existing one is ours and closed to other users"""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"Refusing to use {path}: not a directory")
+    _check_owner(path, st)
+    if st.st_mode & 0o022:
+        raise PermissionError(f"Refusing to use {path}: writable by other users")
+    return path
+
+
+def _private_file(path):
+    """Create the cache file with mode 0600, or check an existing one is ours and tighten it"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            raise PermissionError(f"Refusing to use {path}: not a regular file")
+        _check_owner(path, st)
+        os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+class SharedMemoryCache(BaseCache):
+    """LRU + TTL cache in a memory-mapped SQLite file shared between processes.
+
+    :param path: the SQLite file; put it on tmpfs so it never touches disk.
+    :param threshold: the number of entries kept before LRU eviction starts.
+    :param default_timeout: the timeout used when none is given to set();
+                            0 means the entry never expires.
+    :param touch_interval: seconds between LRU timestamp updates for an entry,
+                           so hot keys don't turn every read into a write.
+    :param stats_interval: seconds between flushes of the hit/miss counters.
+    """
+
+    def __init__(self, path, threshold=5000, default_timeout=300, touch_interval=5,
+                 stats_interval=5, mmap_size=64 * 1024 * 1024):
+        BaseCache.__init__(self, default_timeout=default_timeout)
+        self.path = path
+        self.threshold = threshold
+        self.touch_interval = touch_interval
+        self.stats_interval = stats_interval
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._pending = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._last_flush = time.monotonic()
+        self._sets_since_prune = 0
+        _private_file(path)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        cache_dir = config.get('CACHE_DIR')
+        if not cache_dir:
+            cache_dir = os.path.join(SHM_DIR, f"{app.name}-{os.getuid()}") if SHM_DIR else app.instance_path
+        kwargs.update(
+            path=os.path.join(_private_dir(cache_dir), f"{app.name}-cache.sqlite3"),
+            threshold=config['CACHE_THRESHOLD'],
+        )
+        return cls(*args, **kwargs)
+
+    # --- Connections ---
+
+    def _connect(self):
+        """Per-thread connection, reopened after a fork so workers never share a handle."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # tmpfs, and losing a cache on crash is fine
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _expiry(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return time.time() + timeout if timeout > 0 else 0
+
+    # --- Stats ---
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._pending[name] += amount
+            due = time.monotonic() - self._last_flush >= self.stats_interval
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Add this process's counters to the shared totals."""
+        with self._stats_lock:
+            pending, self._pending = self._pending, {name: 0 for name in self._pending}
+            self._last_flush = time.monotonic()
+        if any(pending.values()):
+            self._connect().executemany(
+                "UPDATE cache_stats SET value = value + ? WHERE name = ?",
+                [(value, name) for name, value in pending.items() if value]
+            )
+
+    def stats(self):
+        """Return hit/miss/eviction totals across all workers plus current size."""
+        self.flush_stats()
+        conn = self._connect()
+        totals = dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+        entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM cache_entries").fetchone()
+        lookups = totals['hits'] + totals['misses']
+        return dict(
+            totals,
+            hit_ratio=round(totals['hits'] / lookups, 4) if lookups else None,
+            entries=entries,
+            size_bytes=size,
+            threshold=self.threshold,
+            path=self.path
+        )
+
+    # --- Eviction ---
+
+    def _prune(self, conn):
+        now = time.time()
+        conn.execute("DELETE FROM cache_entries WHERE expires > 0 AND expires <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        if self.threshold and count > self.threshold:
+            # Evict down to 90% of the threshold in one pass so we don't prune on every write
+            excess = count - int(self.threshold * 0.9)
+            conn.execute("""
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY accessed LIMIT ?
+                )
+            """, (excess,))
+            self._count('evictions', excess)
+
+    def _maybe_prune(self, conn):
+        self._sets_since_prune += 1
+        if self._sets_since_prune >= max(1, self.threshold // 20):
+            self._sets_since_prune = 0
+            self._prune(conn)
+
+    # --- Cache API ---
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, expires, accessed FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] and row[1] <= now):
+            self._count('misses')
+            return None
+        if now - row[2] >= self.touch_interval:
+            conn.execute("UPDATE cache_entries SET accessed = ? WHERE key = ?", (now, key))
+        self._count('hits')
+        try:
+            return pickle.loads(row[0])
+        except (pickle.PickleError, EOFError, AttributeError, ImportError):
+            return None
+
+    def set(self, key, value, timeout=None):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+            (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), self._expiry(timeout), time.time())
+        )
+        self._maybe_prune(conn)
+        return True
+
+    def add(self, key, value, timeout=None):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache_entries WHERE key = ? AND expires > 0 AND expires <= ?", (key, now))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), self._expiry(timeout), now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        cursor = self._connect().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        return cursor.rowcount == 1
+
+    def delete_many(self, *keys):
+        conn = self._connect()
+        return [key for key in keys if conn.execute("DELETE FROM cache_entries WHERE key = ?", (key,)).rowcount]
+
+    def has(self, key):
+        row = self._connect().execute("SELECT expires FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and (not row[0] or row[0] > time.time())
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache_entries")
+        return True
+
+    def inc(self, key, delta=1):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value, expires FROM cache_entries WHERE key = ?", (key,)).fetchone()
+            live = row is not None and (not row[1] or row[1] > time.time())
+            value = int((pickle.loads(row[0]) if live else 0) or 0) + delta
+            # Keep the existing expiry; a missing or expired key starts over without one
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)), row[1] if live else 0, time.time())
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
@@ -0,0 +1,113 @@
+"""
+Queries and latency of the achievements payload.
+
+Seeds a guild with --achievements achievements (three tiers each) and
+--members members, a tenth of whom hold a user_achievements row for every
+achievement (200 achievements x 500 holders = 100k rows by default). The
+"legacy" column replays the loader the endpoint used to run: a member
+count over levels, a correlated completion count per achievement and a
+separate tiers query, plus the viewer's rows. "cold" is the current loader
+with the guild's cache dropped before every call and "warm" is the usual
+case of a cached guild part.
+
+Exits non-zero if the current payload takes more than two queries.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.achievements
+"""
+import argparse
+import json
+import sys
+import time
+
+from sqlalchemy import event, text
+
+from assets import db
+from assets.services import guilds as guild_service
+from assets.services.guild_cache import invalidate_guild
+from .common import make_app, seed_guild, summarize
+
+MAX_QUERIES = 2
+
+
+def legacy_achievements(guild_id, viewer_id):
+    """The queries get_achievements ran before achievement_stats, for comparison."""
+    member_count = db.session.execute(
+        text("SELECT COUNT(DISTINCT user_id) FROM levels WHERE guild_id = :guild_id"), {'guild_id': guild_id}
+    ).scalar() or 0
+    achievements = db.session.execute(text('''
+        SELECT a.id, a.name, a.description, a.requirement_type, a.icon_path,
+            (SELECT COUNT(*) FROM user_achievements ua2
+             WHERE ua2.base_achievement_id = a.id AND ua2.guild_id = :guild_id AND ua2.completed = TRUE) as members_completed
+        FROM achievements a
+        WHERE a.guild_id = :guild_id
+        ORDER BY a.created_at DESC
+    '''), {'guild_id': guild_id}).fetchall()
+    tiers = db.session.execute(text('''
+        SELECT achievement_id, tier_level, title, requirement_value, reward_xp, reward_role_id, icon_path
+        FROM achievement_tiers
+        WHERE achievement_id IN (SELECT id FROM achievements WHERE guild_id = :guild_id)
+        ORDER BY achievement_id, tier_level
+    '''), {'guild_id': guild_id}).fetchall()
+    viewer_rows = db.session.execute(text('''
+        SELECT base_achievement_id, completed, last_tier_achieved_at
+        FROM user_achievements
+        WHERE guild_id = :guild_id AND user_id = :user_id
+    '''), {'guild_id': guild_id, 'user_id': viewer_id}).fetchall()
+    return member_count, achievements, tiers, viewer_rows
+
+
+def measure(fn, repeat, counts, before=None):
+    samples, queries = [], []
+    for _ in range(repeat):
+        if before:
+            before()
+        counts['queries'] = 0
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        queries.append(counts['queries'])
+        db.session.rollback()
+    return dict(summarize(samples), queries=max(queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--achievements', type=int, default=200)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--guild-id', default='bench-achievements')
+    args = parser.parse_args()
+
+    app = make_app()
+    viewer_id = seed_guild(app, args.guild_id, args.members, achievements=args.achievements)
+    guild_id = args.guild_id
+
+    with app.test_request_context():
+        rows = db.session.execute(
+            text("SELECT COUNT(*) FROM user_achievements WHERE guild_id = :guild_id"), {'guild_id': guild_id}
+        ).scalar()
+        counts = {'queries': 0}
+
+        def on_execute(*args):
+            counts['queries'] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', on_execute)
+        current = lambda: guild_service.get_achievements(guild_id, viewer_id)
+        current()  # Warm the pool and query plans
+        results = {
+            'achievements': args.achievements,
+            'user_achievements': rows,
+            'legacy': measure(lambda: legacy_achievements(guild_id, viewer_id), args.repeat, counts),
+            'cold': measure(current, args.repeat, counts, before=lambda: invalidate_guild(guild_id)),
+            'warm': measure(current, args.repeat, counts),
+        }
+    print(json.dumps(results, indent=2))
+
+    if max(results['cold']['queries'], results['warm']['queries']) > MAX_QUERIES:
+        print(f"Achievements payload took more than {MAX_QUERIES} queries", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Latency, query count and peak memory of the guild API at several guild sizes.
+
+For each size in --sizes (rows in `levels`) a synthetic guild is seeded
+with achievements, tiers, events and attendance, then every endpoint in
+ENDPOINTS is requested through the test client:
+
+- "cold": the guild's cache generation is replaced before each request,
+  so every request loads its data from the database
+- "warm": repeated requests served from the guild cache where the
+  endpoint has one
+
+Each run reports p50/p95 latency and queries per request, plus the peak
+Python allocation (tracemalloc) of one cold request. --output writes the
+results as JSON and --compare prints the p50 change against an earlier
+output file, so runs before and after a change can be diffed.
+
+Seeding the 1M guild takes a few minutes; --keep reuses a guild that is
+already seeded at the requested size.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.api_endpoints --output before.json
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.api_endpoints --compare before.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from sqlalchemy import event, text
+
+from assets import db
+from assets.services.guild_cache import invalidate_guild
+from .common import ROOT, VIEWER_ID, make_app, login, seed_guild, summarize, time_request
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+
+ENDPOINTS = {
+    'leaderboard': '/api/guilds/{guild_id}/leaderboard?page=1&page_size=25',
+    'stats': '/api/guilds/{guild_id}/stats',
+    'info': '/api/guilds/{guild_id}/info',
+    'activity': '/api/guilds/{guild_id}/activity',
+    'activity_chart': '/api/guilds/{guild_id}/activity-chart',
+    'achievements': '/api/guilds/{guild_id}/achievements',
+    'events': '/api/guilds/{guild_id}/events',
+    'attendees': '/api/events/{event_id}/attendees',
+}
+
+
+def seeded_members(app, guild_id):
+    with app.app_context():
+        return db.session.execute(text("SELECT COUNT(*) FROM levels WHERE guild_id = :guild_id"),
+                                  {'guild_id': guild_id}).scalar()
+
+
+def first_event_id(app, guild_id):
+    with app.app_context():
+        return db.session.execute(text('''
+            SELECT internal_id FROM discord_scheduled_events WHERE guild_id = :guild_id ORDER BY internal_id LIMIT 1
+        '''), {'guild_id': guild_id}).scalar()
+
+
+def count_queries(app):
+    counts = {'queries': 0}
+
+    def on_execute(*args, **kwargs):
+        counts['queries'] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', on_execute)
+    return counts
+
+
+def measure(app, client, counts, guild_id, url, repeat):
+    def cold():
+        with app.app_context():
+            invalidate_guild(guild_id)
+
+    # Warm up templates, the connection pool and query plans
+    time_request(client, url, 2)
+
+    cold_samples, cold_queries = [], 0
+    for _ in range(repeat):
+        cold()
+        counts['queries'] = 0
+        cold_samples += time_request(client, url, 1)
+        cold_queries += counts['queries']
+
+    counts['queries'] = 0
+    warm_samples = time_request(client, url, repeat)
+    warm_queries = counts['queries']
+
+    cold()
+    tracemalloc.start()
+    try:
+        time_request(client, url, 1)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'cold': dict(summarize(cold_samples), queries=round(cold_queries / repeat, 2)),
+        'warm': dict(summarize(warm_samples), queries=round(warm_queries / repeat, 2)),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline):
+    """Print the cold and warm p50 of each endpoint next to the baseline run's."""
+    for size, endpoints in results['sizes'].items():
+        for name, result in endpoints.items():
+            before = baseline.get('sizes', {}).get(size, {}).get(name)
+            if not before:
+                continue
+            line = [f"{size:>9} {name:15}"]
+            for mode in ('cold', 'warm'):
+                old, new = before[mode]['p50_ms'], result[mode]['p50_ms']
+                change = f"{(new - old) / old * 100:+.0f}%" if old else 'n/a'
+                line.append(f"{mode} {old:8.2f} -> {new:8.2f} ms ({change})")
+            print('  '.join(line), file=sys.stderr)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES))
+    parser.add_argument('--achievements', type=int, default=50)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--attendees', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keep', action='store_true', help='reuse guilds already seeded at the requested size')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='print p50 changes against this earlier --output file')
+    args = parser.parse_args()
+
+    app = make_app()
+    counts = count_queries(app)
+    results = {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'settings': {name: getattr(args, name) for name in ('achievements', 'events', 'attendees', 'repeat')},
+        'sizes': {},
+    }
+
+    for size in (int(size) for size in args.sizes.split(',')):
+        guild_id = f'bench-api-{size}'
+        if args.keep and seeded_members(app, guild_id) == size:
+            viewer_id = VIEWER_ID
+        else:
+            started = time.perf_counter()
+            viewer_id = seed_guild(app, guild_id, size, achievements=args.achievements,
+                                   events=args.events, attendees=args.attendees)
+            print(f"seeded {guild_id} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        client = app.test_client()
+        login(client, viewer_id)
+        event_id = first_event_id(app, guild_id)
+        results['sizes'][str(size)] = {
+            name: measure(app, client, counts, guild_id, url.format(guild_id=guild_id, event_id=event_id), args.repeat)
+            for name, url in ENDPOINTS.items()
+        }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
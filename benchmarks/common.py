@@ -0,0 +1,147 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run the real application against the database in DATABASE_URL,
+so point it at a local or staging copy, never at production. Synthetic
+guilds are written under their own guild IDs and replaced on every run.
+"""
+import io
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import text
+from assets import create_app, db
+from assets.config import Config
+from seed_local_db import BOT_SCHEMA  # The bot's tables, for benchmarks on an empty database
+
+
+# Logged-in user seed_guild gives access to every synthetic guild
+VIEWER_ID = '900000000000000001'
+
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_ENGINE_OPTIONS = dict(Config.SQLALCHEMY_ENGINE_OPTIONS)
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = dict(
+        Config.SQLALCHEMY_ENGINE_OPTIONS['connect_args'],
+        sslmode=os.environ.get('DB_SSLMODE', 'prefer')
+    )
+
+
+def make_app(config_class=BenchmarkConfig):
+    app = create_app(config_class)
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app
+
+
+def login(client, user_id):
+    """Log the test client in as user_id without going through Discord."""
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join('\\N' if v is None else str(v) for v in row))
+        buf.write('\n')
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
+def seed_guild(app, guild_id, members, achievements=20, events=50, attendees=20, viewer_id=VIEWER_ID, seed=1):
+    """Create (or replace) a synthetic guild with `members` rows in levels.
+
+    The viewer gets dashboard access to the guild and the owner role so the
+    benchmarks can open every page.
+    """
+    rnd = random.Random(seed)
+    now = time.time()
+    with app.app_context():
+        db.session.execute(text(BOT_SCHEMA))
+        for table in ('user_achievements', 'levels', 'event_attendance', 'discord_scheduled_events', 'user_guild'):
+            db.session.execute(text(f"DELETE FROM {table} WHERE guild_id = :guild_id"), {'guild_id': guild_id})
+        db.session.execute(text("DELETE FROM achievements WHERE guild_id = :guild_id"), {'guild_id': guild_id})
+        db.session.execute(text('''
+            INSERT INTO guilds (guild_id, name) VALUES (:guild_id, :name)
+            ON CONFLICT (guild_id) DO NOTHING
+        '''), {'guild_id': guild_id, 'name': f'Benchmark {members}'})
+        db.session.execute(text('''
+            INSERT INTO users (discord_id, username, role) VALUES (:user_id, 'bench-viewer', '["owner"]')
+            ON CONFLICT (discord_id) DO UPDATE SET role = EXCLUDED.role
+        '''), {'user_id': viewer_id})
+        db.session.execute(text("INSERT INTO user_guild (user_id, guild_id) VALUES (:user_id, :guild_id)"),
+                           {'user_id': viewer_id, 'guild_id': guild_id})
+        db.session.commit()
+
+        conn = db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            user_ids = [f"{guild_id}-{i}" for i in range(members)]
+            cursor.execute("SELECT discord_id FROM users WHERE discord_id LIKE %s", (f"{guild_id}-%",))
+            existing = {row[0] for row in cursor.fetchall()}
+            _copy_rows(cursor, 'users', ('discord_id', 'username', 'role'),
+                       ((uid, f"member{uid}", '["user"]') for uid in user_ids if uid not in existing))
+            _copy_rows(cursor, 'levels', ('guild_id', 'user_id', 'level', 'xp', 'last_xp_time', 'voice_time_seconds'),
+                       ((guild_id, uid, rnd.randint(0, 60), rnd.randint(0, 2000),
+                         now - rnd.random() * 30 * 86400, rnd.randint(0, 100000)) for uid in user_ids))
+
+            achievement_ids = []
+            for a in range(achievements):
+                cursor.execute('''
+                    INSERT INTO achievements (guild_id, name, description, requirement_type, requirement_value)
+                    VALUES (%s, %s, %s, 'messages', 100) RETURNING id
+                ''', (guild_id, f"Achievement {a}", f"Benchmark achievement {a}"))
+                achievement_ids.append(cursor.fetchone()[0])
+            _copy_rows(cursor, 'achievement_tiers', ('achievement_id', 'tier_level', 'title', 'requirement_value', 'reward_xp'),
+                       ((aid, tier, f"Tier {tier}", tier * 100, tier * 50) for aid in achievement_ids for tier in range(1, 4)))
+            _copy_rows(cursor, 'user_achievements', ('user_id', 'guild_id', 'base_achievement_id', 'completed', 'last_tier_achieved_at'),
+                       ((uid, guild_id, aid, rnd.random() < 0.5, '2024-01-01 00:00:00')
+                        for aid in achievement_ids for uid in rnd.sample(user_ids, min(len(user_ids), members // 10 or 1))))
+
+            _copy_rows(cursor, 'discord_scheduled_events', ('event_id', 'guild_id', 'name', 'start_time', 'end_time', 'status', 'event_type'),
+                       ((f"{guild_id}-ev{e}", guild_id, f"Event {e}", now + (e - events // 2) * 3600,
+                         now + (e - events // 2) * 3600 + 1800, 'SCHEDULED' if e >= events // 2 else 'COMPLETED', 'VOICE')
+                        for e in range(events)))
+            _copy_rows(cursor, 'event_attendance', ('event_id', 'user_id', 'guild_id', 'status', 'joined_at'),
+                       ((f"{guild_id}-ev{e}", uid, guild_id, 'going', '2024-01-01 00:00:00')
+                        for e in range(events) for uid in rnd.sample(user_ids, min(len(user_ids), attendees))))
+            conn.commit()
+        finally:
+            conn.close()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+    return viewer_id
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 2),
+        'p95_ms': round(percentile(samples, 95) * 1000, 2),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+    }
+
+
+def time_request(client, url, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        samples.append(time.perf_counter() - start)
+        if response.status_code not in (200, 304):
+            raise RuntimeError(f"{url} returned {response.status_code}")
+    return samples
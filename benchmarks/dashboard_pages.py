@@ -0,0 +1,217 @@
+"""
+Latency, throughput and worker occupancy of the leaderboard, achievements
+and events pages, before and after they stopped calling the API over HTTP.
+
+Starts gunicorn_config.py with --workers sync workers, serving the app plus
+the pages as they were before (under /loopback/): each one fetched its data
+with requests.get() to the JSON API on the same server, forwarding the
+user's cookies, and held its worker until that second request came back.
+--concurrency clients cycle through the three pages for --duration seconds,
+first the loopback versions, then the current in-process ones.
+
+For each run it reports page latency, pages/sec and failed pages, and from a
+per-request log written by the workers: the worker-seconds spent per page
+view (the page plus any API request it caused), how many of those API
+requests failed, and how many workers gunicorn killed for hanging. Once the
+clients outnumber the workers, every worker can be holding a page that waits
+on an API request no free worker will take, and the loopback pages stall
+until gunicorn's timeout kills them.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.dashboard_pages --members 5000
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import requests
+from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+
+from .common import make_app, seed_guild
+from .worker_profiles import drive, session_cookie, start_server, stop_server
+
+PAGES = ['/guilds/{guild_id}/leaderboard', '/guilds/{guild_id}/achievements', '/guilds/{guild_id}/events']
+
+# Directory the server's workers append "path<TAB>status<TAB>seconds" lines to, one file per process
+BUSY_LOG_DIR = 'DASHBOARD_PAGES_BUSY_DIR'
+
+
+# --- The pages as they were before services/guilds.py, served by the benchmark server ---
+
+loopback = Blueprint('loopback_pages', __name__, url_prefix='/loopback')
+
+
+def _guild_or_redirect(guild_id):
+    from assets.models.user import Guild
+    if not current_user.can_view_guild(guild_id):
+        flash('You do not have permission to view this guild.', 'error')
+        return None, redirect(url_for('dashboard.guild_list'))
+    guild = Guild.query.filter_by(guild_id=guild_id).first()
+    if not guild:
+        flash('Guild not found.', 'error')
+        return None, redirect(url_for('dashboard.guild_list'))
+    return guild, None
+
+
+@loopback.route('/guilds/<guild_id>/leaderboard')
+@login_required
+def guild_leaderboard(guild_id):
+    guild, error = _guild_or_redirect(guild_id)
+    if error:
+        return error
+    page = request.args.get('page', default=1, type=int)
+    page_size = request.args.get('page_size', default=25, type=int)
+    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/leaderboard",
+                            params={'page': page, 'page_size': page_size},
+                            cookies=request.cookies)
+    if response.status_code == 200:
+        api_data = response.json()['data']
+        leaderboard_data = api_data.get('leaderboard', [])
+        pagination = api_data.get('pagination', {})
+    else:
+        leaderboard_data = []
+        pagination = {'page': page, 'page_size': page_size, 'total_pages': 1, 'total_users': 0}
+    return render_template('dashboard/guild_leaderboard.html', guild=guild,
+                           leaderboard=leaderboard_data, pagination=pagination)
+
+
+@loopback.route('/guilds/<guild_id>/achievements')
+@login_required
+def guild_achievements(guild_id):
+    guild, error = _guild_or_redirect(guild_id)
+    if error:
+        return error
+    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/achievements", cookies=request.cookies)
+    achievements_data = response.json()['data'] if response.status_code == 200 else []
+    return render_template('dashboard/guild_achievements.html', guild=guild, achievements=achievements_data)
+
+
+@loopback.route('/guilds/<guild_id>/events')
+@login_required
+def guild_events(guild_id):
+    from assets.services.event_calendar import feed_token
+    guild, error = _guild_or_redirect(guild_id)
+    if error:
+        return error
+    response = requests.get(f"{request.host_url}api/guilds/{guild_id}/events", cookies=request.cookies)
+    events_data = response.json()['data'] if response.status_code == 200 else []
+    # Not part of the old page, but the template now expects it
+    calendar_url = url_for('api.guild_events_ical', guild_id=guild_id,
+                           token=feed_token(guild_id, current_user.discord_id), _external=True)
+    return render_template('dashboard/guild_events.html', guild=guild, events=events_data, calendar_url=calendar_url)
+
+
+class BusyLog:
+    """WSGI middleware appending each request's path, status and wall time to this process's file."""
+
+    def __init__(self, wsgi_app, directory):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = []
+
+        def recording_start_response(code, headers, *args):
+            status.append(code.split()[0])
+            return start_response(code, headers, *args)
+
+        try:
+            body = self.wsgi_app(environ, recording_start_response)
+            return list(body)
+        finally:
+            with open(os.path.join(self.directory, f'{os.getpid()}.tsv'), 'a') as f:
+                f.write(f"{environ.get('PATH_INFO')}\t{status[0] if status else '500'}\t{time.perf_counter() - started}\n")
+
+
+def make_server_app():
+    """gunicorn entry point: the benchmark app with the loopback pages and the busy log."""
+    app = make_app()
+    app.register_blueprint(loopback)
+    app.wsgi_app = BusyLog(app.wsgi_app, os.environ[BUSY_LOG_DIR])
+    return app
+
+
+# --- Driver ---
+
+def read_busy_log(directory):
+    entries = []
+    for path in glob.glob(os.path.join(directory, '*.tsv')):
+        with open(path) as f:
+            for line in f:
+                request_path, status, seconds = line.rstrip('\n').split('\t')
+                entries.append((request_path, int(status), float(seconds)))
+    return entries
+
+
+def worker_timeouts(log_path):
+    with open(log_path) as f:
+        return sum(1 for line in f if 'WORKER TIMEOUT' in line)
+
+
+def clear_busy_log(directory):
+    for path in glob.glob(os.path.join(directory, '*.tsv')):
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', default='1,4,8', help='comma-separated client counts, one run each')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    parser.add_argument('--port', type=int, default=8021)
+    parser.add_argument('--guild-id', default='bench-pages')
+    args = parser.parse_args()
+
+    app = make_app()
+    viewer_id = seed_guild(app, args.guild_id, args.members)
+    cookie = session_cookie(app, viewer_id)
+    pages = [page.format(guild_id=args.guild_id) for page in PAGES]
+    modes = {'loopback': ['/loopback' + page for page in pages], 'in_process': pages}
+
+    busy_dir = tempfile.mkdtemp(prefix='dashboard_pages-')
+    os.environ[BUSY_LOG_DIR] = busy_dir
+    log_path = os.path.join(tempfile.gettempdir(), 'dashboard_pages-gunicorn.log')
+    process = start_server('sync', args.port, os.environ.get('DISCORD_API_BASE_URL', ''), args.workers, log_path,
+                           app_spec='benchmarks.dashboard_pages:make_server_app()')
+
+    results = {}
+    try:
+        for concurrency in [int(n) for n in args.concurrency.split(',')]:
+            run = results[f'{concurrency}_clients'] = {}
+            for mode, paths in modes.items():
+                drive(args.port, paths, cookie, concurrency, args.warmup)
+                clear_busy_log(busy_dir)
+                timeouts = worker_timeouts(log_path)
+                result = drive(args.port, paths, cookie, concurrency, args.duration)
+                # drive() returns once every page has been answered, and each request is logged before its response
+                entries = read_busy_log(busy_dir)
+                api_calls = [status for path, status, _ in entries if path.startswith('/api/')]
+                # Pages whose worker gunicorn killed are in `requests` but not in the log
+                views = result['requests']
+                result.update(
+                    workers=args.workers,
+                    worker_seconds_per_view=round(sum(s for _, _, s in entries) / views, 4) if views else None,
+                    api_requests_per_view=round(len(api_calls) / views, 2) if views else None,
+                    api_failed=sum(1 for status in api_calls if status >= 400),
+                    worker_timeouts=worker_timeouts(log_path) - timeouts,
+                )
+                run[mode] = result
+                print(f"{concurrency:3} clients {mode:10} {result['rps']:8} pages/s  p50 {result['p50_ms']:9} ms  "
+                      f"p99 {result['p99_ms']:9} ms  {result['worker_seconds_per_view']} worker-s/view  "
+                      f"{result['failed']} failed  {result['api_failed']} API failed  "
+                      f"{result['worker_timeouts']} worker timeouts", file=sys.stderr)
+    finally:
+        stop_server(process)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
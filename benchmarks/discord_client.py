@@ -0,0 +1,226 @@
+"""
+Behaviour of the pooled Discord API client against a local stub server.
+
+Points DISCORD_API_BASE_URL at an in-process http.server stand-in that
+answers every call after --latency seconds and can be told to rate limit
+or stall, then checks services/discord_api.py:
+
+- a login fetches the user and the guild list concurrently
+- logins reuse the pooled connections (two open after two logins)
+- a token's guild list is cached across logins
+- a 429 with a short retry_after is waited out and retried
+- a long 429 raises DiscordRateLimited, and later calls with that token
+  are refused locally until the reset while other tokens go through
+- a global 429 blocks every route for that token
+- an exhausted bucket (X-RateLimit-Remaining: 0) is waited out
+- a stalled response fails after the read timeout
+
+The script prints each check and exits non-zero if any failed, so it can
+run as a check. It doesn't touch the database.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.discord_client
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .common import make_app
+
+GUILDS = [{'id': '1', 'name': 'Stub guild', 'permissions': '8'}]
+
+
+class StubDiscord:
+    """Discord API stand-in recording calls and connections; queue() scripts the next answers to a path."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.stall = 0
+        self.connections = 0
+        self.calls = []
+        self.scripted = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.calls.append((self.path, self.headers.get('Authorization'), time.monotonic()))
+                    pending = stub.scripted.get(self.path)
+                    status, body, headers = pending.pop(0) if pending else (200, None, {})
+                time.sleep(stub.latency + stub.stall)
+                if body is None:
+                    if self.path == '/users/@me':
+                        body = {'id': '1', 'username': 'stub', 'avatar': None}
+                    elif self.path == '/users/@me/guilds':
+                        body = GUILDS
+                    else:
+                        status, body = 404, {'message': 'Unknown route'}
+                payload = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except OSError:
+                    pass  # The client gave up on a stalled call
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def queue(self, path, status, body, headers=None):
+        with self._lock:
+            self.scripted.setdefault(path, []).append((status, body, headers or {}))
+
+    def calls_since(self, index):
+        return [path for path, _, _ in self.calls[index:]]
+
+
+def rate_limited(retry_after, is_global=False):
+    body = {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': is_global}
+    headers = {'Retry-After': str(retry_after), 'X-RateLimit-Bucket': 'guilds-bucket'}
+    if is_global:
+        headers['X-RateLimit-Global'] = 'true'
+    return 429, body, headers
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args), None, time.perf_counter() - start
+    except Exception as e:
+        return None, e, time.perf_counter() - start
+
+
+def run_checks(stub, latency):
+    from assets.services.discord_api import DiscordAPIError, DiscordRateLimited, get_client, get_user_and_guilds
+
+    client = get_client()
+    checks = []
+
+    def check(name, ok, detail):
+        checks.append({'check': name, 'ok': bool(ok), 'detail': detail})
+
+    def token():
+        return uuid.uuid4().hex  # Guild lists are cached per token across runs, so never reuse one
+
+    # Concurrent user and guild fetch, on connections kept for the next login
+    start = len(stub.calls)
+    result, error, elapsed = timed(get_user_and_guilds, token())
+    first, second = stub.calls[start:start + 2] if len(stub.calls) >= start + 2 else (None, None)
+    gap = abs(first[2] - second[2]) if first and second else None
+    check('login fetches user and guilds concurrently',
+          error is None and result[1] == GUILDS and gap is not None and gap < latency / 2 and elapsed < latency * 1.8,
+          f'{elapsed * 1000:.0f}ms for two {latency * 1000:.0f}ms calls, starts {gap * 1000 if gap is not None else -1:.0f}ms apart')
+
+    _, error, _ = timed(get_user_and_guilds, token())
+    check('logins reuse pooled connections', error is None and stub.connections == 2,
+          f'{stub.connections} connections opened over two logins')
+
+    cached = token()
+    get_user_and_guilds(cached)
+    start = len(stub.calls)
+    result, error, _ = timed(get_user_and_guilds, cached)
+    check('guild list cached per token', error is None and result[1] == GUILDS and stub.calls_since(start) == ['/users/@me'],
+          f'second login called {stub.calls_since(start)}')
+
+    # Rate limits
+    retry_after = min(0.3, client.max_rate_limit_wait / 2)
+    stub.queue('/users/@me/guilds', *rate_limited(retry_after))
+    start = len(stub.calls)
+    result, error, elapsed = timed(client.get_current_user_guilds, token())
+    check('short 429 waited out and retried',
+          error is None and result == GUILDS and len(stub.calls_since(start)) == 2 and elapsed >= retry_after,
+          f'{len(stub.calls_since(start))} calls in {elapsed * 1000:.0f}ms for retry_after={retry_after}s')
+
+    limited = token()
+    long_wait = client.max_rate_limit_wait + 3
+    stub.queue('/users/@me/guilds', *rate_limited(long_wait))
+    result, error, elapsed = timed(client.get_current_user_guilds, limited)
+    check('long 429 raises DiscordRateLimited', isinstance(error, DiscordRateLimited) and elapsed < latency * 3,
+          f'{type(error).__name__} after {elapsed * 1000:.0f}ms for retry_after={long_wait}s')
+
+    start = len(stub.calls)
+    _, error, _ = timed(client.get_current_user_guilds, limited)
+    check('limited bucket refused locally until the reset',
+          isinstance(error, DiscordRateLimited) and not stub.calls_since(start) and error.retry_after > client.max_rate_limit_wait,
+          f'{type(error).__name__}, {len(stub.calls_since(start))} calls made')
+
+    result, error, _ = timed(client.get_current_user_guilds, token())
+    check('other tokens unaffected by a bucket limit', error is None and result == GUILDS, repr(error))
+
+    global_limited = token()
+    stub.queue('/users/@me/guilds', *rate_limited(long_wait, is_global=True))
+    timed(client.get_current_user_guilds, global_limited)
+    start = len(stub.calls)
+    _, error, _ = timed(client.get_current_user, global_limited)
+    check('global 429 blocks other routes for the token', isinstance(error, DiscordRateLimited) and not stub.calls_since(start),
+          f'{type(error).__name__}, {len(stub.calls_since(start))} calls made')
+
+    exhausted = token()
+    reset_after = min(0.3, client.max_rate_limit_wait / 2)
+    stub.queue('/users/@me/guilds', 200, GUILDS, {
+        'X-RateLimit-Bucket': 'guilds-bucket', 'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset-After': str(reset_after)
+    })
+    client.get_current_user_guilds(exhausted)
+    result, error, elapsed = timed(client.get_current_user_guilds, exhausted)
+    check('exhausted bucket waited out', error is None and elapsed >= reset_after,
+          f'next call took {elapsed * 1000:.0f}ms for reset_after={reset_after}s')
+
+    # Timeouts
+    read_timeout = client.timeout[1]
+    stub.stall = read_timeout + 1
+    try:
+        _, error, elapsed = timed(client.get_current_user, token())
+    finally:
+        stub.stall = 0
+    check('stalled call fails after the read timeout',
+          isinstance(error, DiscordAPIError) and not isinstance(error, DiscordRateLimited) and elapsed < read_timeout + 0.5,
+          f'{type(error).__name__} after {elapsed * 1000:.0f}ms, read timeout {read_timeout}s')
+    return checks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the stub takes to answer each call')
+    parser.add_argument('--read-timeout', type=float, default=1.0, help='client read timeout for the stall check')
+    args = parser.parse_args()
+
+    stub = StubDiscord(args.latency)
+    os.environ['DISCORD_API_BASE_URL'] = stub.base_url
+    app = make_app()
+    app.config['DISCORD_API_BASE_URL'] = stub.base_url
+    app.config['DISCORD_API_TIMEOUT'] = (app.config['DISCORD_API_TIMEOUT'][0], args.read_timeout)
+
+    with app.test_request_context():
+        checks = run_checks(stub, args.latency)
+    print(json.dumps(checks, indent=2))
+
+    failed = [check['check'] for check in checks if not check['ok']]
+    if failed:
+        print(f"Discord client checks failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
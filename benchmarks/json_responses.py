@@ -0,0 +1,103 @@
+"""
+Serialization time and bytes on the wire for the largest API payloads.
+
+Builds a 100-row leaderboard page and the achievements payload of a guild
+with --achievements achievements (three tiers each), then times turning each
+into a response body with:
+
+- "flask": Flask's DefaultJSONProvider, after the string formatting of
+  datetimes the achievements payload used to need
+- "stdlib": assets.utils.json_provider with orjson disabled
+- "orjson": assets.utils.json_provider as deployed
+
+and reports the gzip size and compression time at a few levels.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.json_responses
+"""
+import argparse
+import datetime
+import gzip
+import json
+import time
+
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import text
+
+from assets import db
+from assets.services import guilds as guild_service
+from assets.utils import json_provider
+from .common import make_app, seed_guild, summarize
+
+GZIP_LEVELS = (1, 6, 9)
+
+
+def legacy_format(achievements):
+    """The ISO strings get_achievements used to build before serializing."""
+    return [
+        dict(a, last_tier_achieved_at=a['last_tier_achieved_at'].replace(tzinfo=datetime.timezone.utc).isoformat()
+             if a['last_tier_achieved_at'] else None)
+        for a in achievements
+    ]
+
+
+def time_body(build, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = build()
+        samples.append(time.perf_counter() - start)
+    return body, summarize(samples)
+
+
+def measure(app, payload, legacy_payload, repeat):
+    flask_provider = DefaultJSONProvider(app)
+    orjson_module = json_provider.orjson
+    wrap = lambda data: {"success": True, "message": "Success", "data": data}
+
+    results = {}
+    body, results['flask'] = time_body(lambda: flask_provider.response(wrap(legacy_payload)).get_data(), repeat)
+    json_provider.orjson = None
+    try:
+        _, results['stdlib'] = time_body(lambda: app.json.response(wrap(payload)).get_data(), repeat)
+    finally:
+        json_provider.orjson = orjson_module
+    body, results['orjson'] = time_body(lambda: app.json.response(wrap(payload)).get_data(), repeat)
+
+    results['bytes'] = len(body)
+    for level in GZIP_LEVELS:
+        compressed, timing = time_body(lambda: gzip.compress(body, compresslevel=level, mtime=0), repeat)
+        results[f'gzip{level}'] = dict(timing, bytes=len(compressed))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--achievements', type=int, default=200)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--guild-id', default='bench-json')
+    args = parser.parse_args()
+
+    app = make_app()
+    seed_guild(app, args.guild_id, args.members, achievements=args.achievements)
+    if json_provider.orjson is None:
+        print("orjson is not installed; the orjson column measures the stdlib fallback")
+
+    with app.test_request_context():
+        # The member holding the most achievements, so the payload carries timestamps
+        viewer_id = db.session.execute(text('''
+            SELECT user_id FROM user_achievements WHERE guild_id = :guild_id
+            GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1
+        '''), {'guild_id': args.guild_id}).scalar()
+        leaderboard = guild_service.get_leaderboard(args.guild_id, 1, 100, None)
+        achievements = guild_service.get_achievements(args.guild_id, viewer_id)
+        results = {
+            'leaderboard_page_100': measure(app, leaderboard, leaderboard, args.repeat),
+            f'achievements_{args.achievements}': measure(app, achievements, legacy_format(achievements), args.repeat),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
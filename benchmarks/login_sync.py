@@ -0,0 +1,113 @@
+"""
+Statements, commits and latency of the database sync done at login.
+
+A user who administers --guilds guilds (all with the bot in them) logs in
+three times: first login, an unchanged re-login, and a re-login after a
+quarter of their guilds were swapped for others. The "legacy" column
+replays the sync the OAuth callback used to run (get_or_create, a full read
+of guilds, one INSERT per added guild, a role UPDATE and a separate
+last_login commit); "current" is services/login_sync.py.
+
+The statement budget itself is asserted by tests/test_login_sync.py;
+this script is for timing.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.login_sync --guilds 200
+"""
+import argparse
+import json
+import time
+
+from sqlalchemy import delete, event, text
+
+from assets import db
+from assets.models.user import User, user_guild
+from assets.services.login_sync import sync_login
+from .common import make_app
+
+USER_ID = '900000000000000002'
+
+
+def legacy_sync(discord_data, admin_guild_ids, owner_id=None):
+    """The sync discord_callback ran before services/login_sync.py, for comparison."""
+    user = User.get_or_create(discord_data)
+    bot_present_guild_ids = {row[0] for row in db.session.execute(text("SELECT guild_id FROM guilds"))}
+    mutual_guild_ids = set(admin_guild_ids) & bot_present_guild_ids
+    current = {row[0] for row in db.session.execute(
+        text("SELECT guild_id FROM user_guild WHERE user_id = :user_id"), {'user_id': user.discord_id}
+    )}
+    to_add, to_remove = mutual_guild_ids - current, current - mutual_guild_ids
+    if to_remove:
+        db.session.execute(delete(user_guild).where(user_guild.c.user_id == user.discord_id)
+                           .where(user_guild.c.guild_id.in_(list(to_remove))))
+    for guild_id in to_add:
+        db.session.execute(text('INSERT INTO user_guild (user_id, guild_id) VALUES (:user_id, :guild_id) ON CONFLICT DO NOTHING'),
+                           {'user_id': user.discord_id, 'guild_id': guild_id})
+    role = ['owner'] if owner_id and user.discord_id == owner_id else ['admin'] if mutual_guild_ids else ['user']
+    db.session.execute(text("UPDATE users SET role = :role WHERE discord_id = :user_id"),
+                       {'role': json.dumps(role), 'user_id': user.discord_id})
+    db.session.commit()
+    user.update_last_login()
+    return user, mutual_guild_ids
+
+
+def reset(guild_ids):
+    db.session.execute(text("DELETE FROM user_guild WHERE user_id = :user_id"), {'user_id': USER_ID})
+    db.session.execute(text("DELETE FROM users WHERE discord_id = :user_id"), {'user_id': USER_ID})
+    db.session.execute(text('''
+        INSERT INTO guilds (guild_id, name) SELECT id, 'Login benchmark ' || id FROM unnest(CAST(:ids AS TEXT[])) AS id
+        ON CONFLICT (guild_id) DO NOTHING
+    '''), {'ids': guild_ids})
+    db.session.commit()
+
+
+def count_statements(engine):
+    counts = {'statements': 0, 'commits': 0}
+
+    def on_execute(*args):
+        counts['statements'] += 1
+
+    def on_commit(*args):
+        counts['commits'] += 1
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    event.listen(engine, 'commit', on_commit)
+    return counts
+
+
+def run(sync, guilds, counts):
+    """Run the three logins with sync and return per-login counts and timings."""
+    all_ids = [f"bench-login-{i}" for i in range(guilds + guilds // 4)]
+    first = all_ids[:guilds]
+    swapped = all_ids[guilds // 4:]
+    discord_data = {'id': USER_ID, 'username': 'bench-login', 'discriminator': '0', 'email': '', 'avatar': None}
+    reset(all_ids)
+    db.session.remove()
+
+    results = {}
+    for label, admin_guild_ids in (('first_login', first), ('unchanged', first), ('quarter_swapped', swapped)):
+        counts.update(statements=0, commits=0)
+        start = time.perf_counter()
+        user, mutual = sync(discord_data, admin_guild_ids)
+        elapsed = time.perf_counter() - start
+        if mutual != set(admin_guild_ids):
+            raise RuntimeError(f"{label}: synced {len(mutual)} guilds, expected {len(admin_guild_ids)}")
+        results[label] = dict(counts, ms=round(elapsed * 1000, 2))
+        db.session.remove()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=200)
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        counts = count_statements(db.engine)
+        results = {'legacy': run(legacy_sync, args.guilds, counts), 'current': run(sync_login, args.guilds, counts)}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
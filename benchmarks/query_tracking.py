@@ -0,0 +1,98 @@
+"""
+Cost of the SQL instrumentation in middleware/query_tracking.py.
+
+Runs --statements trivial statements per request through the test client
+with the engine listeners removed ("off"), installed but the request not
+sampled ("unsampled", what most production requests pay) and with every
+request sampled ("sampled"), and reports the latency and the overhead per
+statement against "off". The sampled run repeats one statement, so it also
+checks that the N+1 warning fires.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.query_tracking
+"""
+import argparse
+import json
+import logging
+import sys
+
+from flask.logging import default_handler
+from sqlalchemy import text
+
+from assets import db
+from assets.middleware import query_tracking
+from .common import BenchmarkConfig, make_app, summarize, time_request
+
+
+class Warnings(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def build_app(sample_rate, statements, tracking=True):
+    config = type('QueryTrackingConfig', (BenchmarkConfig,), {
+        'SQL_TRACKING_SAMPLE_RATE': sample_rate,
+        'SQL_SERVER_TIMING': True,
+    })
+    # create_app imports init_query_tracking when it runs, so swapping it out
+    # here builds an app without the listeners
+    install = query_tracking.init_query_tracking
+    if not tracking:
+        query_tracking.init_query_tracking = lambda app: None
+    try:
+        app = make_app(config)
+    finally:
+        query_tracking.init_query_tracking = install
+
+    @app.route('/bench/statements')
+    def run_statements():
+        for i in range(statements):
+            db.session.execute(text("SELECT :i"), {'i': i}).scalar()
+        return 'ok'
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--statements', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    apps = {
+        'off': build_app(0, args.statements, tracking=False),
+        'unsampled': build_app(0, args.statements),
+        'sampled': build_app(1.0, args.statements),
+    }
+    warnings = Warnings()
+    apps['sampled'].logger.removeHandler(default_handler)
+    apps['sampled'].logger.addHandler(warnings)
+
+    # Alternate between the apps so drift in the database's speed hits all three
+    clients = {name: app.test_client() for name, app in apps.items()}
+    samples = {name: [] for name in apps}
+    for client in clients.values():
+        time_request(client, '/bench/statements', 10)
+    for _ in range(args.rounds):
+        for name, client in clients.items():
+            samples[name] += time_request(client, '/bench/statements', args.repeat // args.rounds)
+
+    results = {name: summarize(runs) for name, runs in samples.items()}
+    results['sampled']['server_timing'] = clients['sampled'].get('/bench/statements').headers.getlist('Server-Timing')
+    for name in ('unsampled', 'sampled'):
+        results[name]['overhead_us_per_statement'] = round(
+            (results[name]['mean_ms'] - results['off']['mean_ms']) * 1000 / args.statements, 2)
+    results['n_plus_one_warnings'] = len(warnings.records)
+    print(json.dumps(results, indent=2))
+    if not warnings.records:
+        print("Sampled requests repeated one statement but no N+1 warning was logged", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Per-request database overhead of the request lifecycle.
+
+The "legacy" column re-installs the hooks create_app used to register: a
+`SELECT 1` before every non-static request and a `db.session.commit()` after
+it. The "current" column is the app as it ships, where safe requests open a
+read-only transaction on first use and roll it back at teardown.
+
+Round trips count statements, BEGIN/COMMIT/ROLLBACK and the pre-ping issued
+on each pool checkout, which is what a remote database charges latency for.
+Both apps keep sessions in signed cookies for the run so the filesystem
+session store's per-request write doesn't drown out the difference.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.request_lifecycle
+"""
+import argparse
+import json
+
+from flask import request
+from flask.sessions import SecureCookieSessionInterface
+from sqlalchemy import event, text
+
+from assets import db
+from .common import make_app, login, seed_guild, summarize, time_request
+
+# (url, logged in)
+URLS = [
+    ('/healthz', False),
+    ('/', False),
+    ('/', True),
+    ('/dashboard', True),
+    ('/api/guilds/{guild_id}/stats', True),
+    ('/api/guilds/{guild_id}/leaderboard?page=1&page_size=25', True),
+]
+
+
+def install_legacy_hooks(app):
+    """The before/after request hooks removed from create_app, for comparison."""
+    @app.before_request
+    def legacy_ping():
+        if not request.path.startswith('/static/'):
+            db.session.execute(text('SELECT 1')).scalar()
+
+    @app.after_request
+    def legacy_commit(response):
+        if not request.path.startswith('/static/'):
+            db.session.commit()
+        return response
+
+
+def count_round_trips(app):
+    counts = dict.fromkeys(('statements', 'begins', 'commits', 'rollbacks', 'checkouts'), 0)
+
+    def bump(name):
+        def listener(*args, **kwargs):
+            counts[name] += 1
+        return listener
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', bump('statements'))
+    event.listen(engine, 'begin', bump('begins'))
+    event.listen(engine, 'commit', bump('commits'))
+    event.listen(engine, 'rollback', bump('rollbacks'))
+    event.listen(engine.pool, 'checkout', bump('checkouts'))
+    return counts
+
+
+def measure(app, urls, viewer_id, repeat):
+    app.session_interface = SecureCookieSessionInterface()
+    counts = count_round_trips(app)
+    anonymous = app.test_client()
+    logged_in = app.test_client()
+    login(logged_in, viewer_id)
+    results = {}
+    for label, url, needs_login in urls:
+        client = logged_in if needs_login else anonymous
+        time_request(client, url, 3)  # Warm up the pool, caches and templates
+        for name in counts:
+            counts[name] = 0
+        samples = time_request(client, url, repeat)
+        per_request = {name: round(value / repeat, 2) for name, value in counts.items()}
+        per_request['round_trips'] = round(sum(counts.values()) / repeat, 2)
+        results[label] = dict(summarize(samples), **per_request)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--guild-id', default='bench-lifecycle')
+    args = parser.parse_args()
+
+    current = make_app()
+    viewer_id = seed_guild(current, args.guild_id, args.members)
+    urls = [
+        (f"{url} ({'logged in' if needs_login else 'anonymous'})", url.format(guild_id=args.guild_id), needs_login)
+        for url, needs_login in URLS
+    ]
+
+    legacy = make_app()
+    install_legacy_hooks(legacy)
+
+    results = {
+        'legacy': measure(legacy, urls, viewer_id, args.repeat),
+        'current': measure(current, urls, viewer_id, args.repeat),
+    }
+    results['saving_per_request'] = {
+        label: {
+            'round_trips': round(results['legacy'][label]['round_trips'] - results['current'][label]['round_trips'], 2),
+            'mean_ms': round(results['legacy'][label]['mean_ms'] - results['current'][label]['mean_ms'], 2),
+        }
+        for label, _, _ in urls
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
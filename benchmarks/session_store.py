@@ -0,0 +1,163 @@
+"""
+Session read/write latency with many active sessions.
+
+Fills a throwaway store with --sessions live sessions (plus --expired-ratio
+expired ones) and times the session interface the way a request drives it:
+opening a session from its cookie, saving it unchanged, saving it after a
+change and starting a new one. The "sqlite" column is the store the app ships
+with; the "filesystem" column is the Flask-Session backend it replaced,
+filled with the same sessions. Its threshold is lifted for the run: with the
+old default of 500 it would have evicted all but the newest few hundred
+sessions long before reaching --sessions.
+
+No database is needed; every store is written under a temporary directory.
+
+Usage:
+    python -m benchmarks.session_store --sessions 100000
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from flask import request
+from flask_session.sessions import FileSystemSessionInterface
+
+from assets.utils.session_store import SQLiteSessionInterface
+from .common import make_app, summarize
+
+
+def session_payload(rnd):
+    """Roughly what a signed-in user's session holds: Flask-Login keys, the OAuth token and the permission snapshot."""
+    guild_ids = sorted(str(rnd.randint(10 ** 17, 10 ** 18)) for _ in range(rnd.randint(1, 30)))
+    return {
+        '_user_id': str(rnd.randint(10 ** 17, 10 ** 18)),
+        '_fresh': True,
+        '_id': uuid.UUID(int=rnd.getrandbits(128)).hex * 4,
+        '_permanent': True,
+        'DISCORD_OAUTH2_TOKEN': {
+            'access_token': uuid.UUID(int=rnd.getrandbits(128)).hex,
+            'refresh_token': uuid.UUID(int=rnd.getrandbits(128)).hex,
+            'token_type': 'Bearer',
+            'expires_in': 604800,
+            'scope': ['identify', 'guilds'],
+            'expires_at': time.time() + 604800,
+        },
+        'permissions': {
+            'user_id': str(rnd.randint(10 ** 17, 10 ** 18)),
+            'username': f'user{rnd.randint(0, 10 ** 6)}',
+            'avatar': uuid.UUID(int=rnd.getrandbits(128)).hex,
+            'roles': ['user'],
+            'viewable': guild_ids,
+            'manageable': [],
+            'refreshed_at': time.time(),
+        },
+    }
+
+
+def fill_sqlite(interface, sids, expired, rnd):
+    now = time.time()
+    rows = [(sid, interface.serializer.dumps(session_payload(rnd)), now + 7 * 86400) for sid in sids]
+    rows += [(sid, interface.serializer.dumps(session_payload(rnd)), now - 60) for sid in expired]
+    conn = interface._connect()
+    conn.execute('BEGIN')
+    conn.executemany("INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)", rows)
+    conn.execute('COMMIT')
+
+
+def fill_filesystem(interface, sids, rnd):
+    for sid in sids:
+        interface.cache.set(interface.key_prefix + sid, session_payload(rnd), 7 * 86400)
+
+
+def measure(app, sids, repeat, rnd):
+    """Time each session operation through the app's session interface."""
+    interface = app.session_interface
+    signer = interface._get_signer(app)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    timings = {'open': [], 'save_unchanged': [], 'save_modified': [], 'new_session': []}
+
+    for _ in range(repeat):
+        cookie = signer.sign(rnd.choice(sids).encode()).decode()
+        with app.test_request_context(headers={'Cookie': f'{cookie_name}={cookie}'}):
+            start = time.perf_counter()
+            session = interface.open_session(app, request)
+            timings['open'].append(time.perf_counter() - start)
+            if not session.get('_user_id'):
+                raise RuntimeError('Session did not load')
+
+            response = app.response_class()
+            start = time.perf_counter()
+            interface.save_session(app, session, response)
+            timings['save_unchanged'].append(time.perf_counter() - start)
+
+            session['permissions']['refreshed_at'] = time.time()
+            session.modified = True
+            start = time.perf_counter()
+            interface.save_session(app, session, response)
+            timings['save_modified'].append(time.perf_counter() - start)
+
+        with app.test_request_context():
+            start = time.perf_counter()
+            session = interface.open_session(app, request)
+            session.update(session_payload(rnd))
+            interface.save_session(app, session, app.response_class())
+            timings['new_session'].append(time.perf_counter() - start)
+
+    return {name: summarize(samples) for name, samples in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--expired-ratio', type=float, default=0.1,
+                        help='Expired sessions to add, as a fraction of --sessions, for the sweep timing')
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--skip-filesystem', action='store_true', help='Only measure the SQLite store')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    sids = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(args.sessions)]
+    expired = [str(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(int(args.sessions * args.expired_ratio))]
+    app = make_app()
+    workdir = tempfile.mkdtemp(prefix='session-bench-')
+    results = {'sessions': args.sessions, 'expired': len(expired)}
+    try:
+        interface = SQLiteSessionInterface(
+            os.path.join(workdir, 'sessions.sqlite3'),
+            use_signer=True,
+            refresh_interval=app.config['SESSION_REFRESH_INTERVAL'],
+            sweep_interval=0
+        )
+        start = time.perf_counter()
+        fill_sqlite(interface, sids, expired, rnd)
+        fill_seconds = time.perf_counter() - start
+        app.session_interface = interface
+        results['sqlite'] = measure(app, sids, args.repeat, rnd)
+        results['sqlite']['fill_s'] = round(fill_seconds, 2)
+        start = time.perf_counter()
+        removed = interface.sweep()
+        results['sqlite']['sweep'] = {'removed': removed, 'ms': round((time.perf_counter() - start) * 1000, 2)}
+        results['sqlite']['size_mb'] = round(interface.stats()['size_bytes'] / 2 ** 20, 1)
+
+        if not args.skip_filesystem:
+            interface = FileSystemSessionInterface(os.path.join(workdir, 'flask_session'), 0, 0o600,
+                                                   'session:', use_signer=True)
+            start = time.perf_counter()
+            fill_filesystem(interface, sids, rnd)
+            fill_seconds = time.perf_counter() - start
+            app.session_interface = interface
+            results['filesystem'] = measure(app, sids, args.repeat, rnd)
+            results['filesystem']['fill_s'] = round(fill_seconds, 2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
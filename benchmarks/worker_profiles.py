@@ -0,0 +1,263 @@
+"""
+Throughput, p99 latency and memory of the gunicorn worker profiles.
+
+Starts gunicorn_config.py once per profile (GUNICORN_WORKER_CLASS=sync,
+gthread, gevent) on a local port and drives it with --concurrency clients
+for --duration seconds per scenario:
+
+- "pages": the logged-in dashboard pages and the guild API the overview
+  polls, for a seeded guild of --members members
+- "login": the Discord OAuth callback against a stub Discord API that
+  answers every call after --discord-latency seconds
+- "mixed": the pages, with every tenth request a login
+
+and reports requests/sec, p50/p99 latency, failed requests and the
+resident memory of the master plus its workers after each scenario.
+
+The load generator runs on the same host as the server and competes with
+it for CPU, so compare profiles with each other, not with production.
+
+Usage:
+    DATABASE_URL=postgresql://localhost/lvlbot_bench python -m benchmarks.worker_profiles
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import text
+
+from assets import db
+from .common import ROOT, make_app, login, percentile, seed_guild, summarize
+
+PROFILES = ('sync', 'gthread', 'gevent')
+
+PAGES = [
+    '/dashboard',
+    '/dashboard/guilds/{guild_id}',
+    '/guilds/{guild_id}/leaderboard',
+    '/api/guilds/{guild_id}/stats',
+    '/api/guilds/{guild_id}/leaderboard?page=1&page_size=25',
+]
+LOGIN = '/auth/discord/callback?code={code}'
+
+# Users created by the login scenario; removed before each run
+LOGIN_USER_PREFIX = 'bench-login-'
+
+
+def stub_discord(guild_id, latency):
+    """Start a Discord API stand-in that answers after `latency` seconds; returns (server, base_url)."""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _reply(self, body):
+            time.sleep(latency)
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            form = dict(pair.split('=', 1) for pair in self.rfile.read(length).decode().split('&') if '=' in pair)
+            self._reply({'access_token': form.get('code', 'token'), 'token_type': 'Bearer'})
+
+        def do_GET(self):
+            token = self.headers.get('Authorization', '').split()[-1]
+            if self.path == '/users/@me':
+                self._reply({'id': f'{LOGIN_USER_PREFIX}{token}', 'username': f'login{token}', 'avatar': None})
+            elif self.path == '/users/@me/guilds':
+                self._reply([{'id': guild_id, 'name': 'Benchmark', 'permissions': '8'}])
+            else:
+                self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def session_cookie(app, viewer_id):
+    """A session cookie logged in as viewer_id, saved to the store the server reads."""
+    client = app.test_client()
+    login(client, viewer_id)
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    return f'{cookie.key}={cookie.value}'
+
+
+def process_rss_mb(master_pid):
+    """Resident memory of the gunicorn master and its workers, in MB."""
+    pids = [master_pid]
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            continue
+    return round(total / 1024, 1), len(pids) - 1
+
+
+def start_server(profile, port, discord_url, workers, log_path, app_spec='benchmarks.common:make_app()'):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=profile, DISCORD_API_BASE_URL=discord_url)
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    log = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', '--bind', f'127.0.0.1:{port}',
+         app_spec],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn ({profile}) exited; see {log_path}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/healthz')
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"gunicorn ({profile}) did not come up; see {log_path}")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def drive(port, paths, cookie, concurrency, duration):
+    """Request `paths` in turn from `concurrency` keep-alive clients for `duration` seconds."""
+    codes = itertools.count()
+    deadline = time.monotonic() + duration
+    results = []
+
+    def client(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        samples, failures = [], 0
+        for i in itertools.count(offset):
+            if time.monotonic() >= deadline:
+                break
+            path = paths[i % len(paths)]
+            headers = {}
+            if path.startswith('/auth/'):
+                path = path.format(code=next(codes))
+            else:
+                headers['Cookie'] = cookie
+            start = time.perf_counter()
+            # A worker recycled by max_requests closes its idle keep-alive
+            # connections; like a browser, retry once on a fresh one
+            for attempt in range(2):
+                try:
+                    conn.request('GET', path, headers=headers)
+                    response = conn.getresponse()
+                    response.read()
+                    if response.status >= 400:
+                        failures += 1
+                    break
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    if attempt:
+                        failures += 1
+            samples.append(time.perf_counter() - start)
+        conn.close()
+        results.append((samples, failures))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = [s for chunk, _ in results for s in chunk]
+    return dict(
+        summarize(samples),
+        requests=len(samples),
+        rps=round(len(samples) / elapsed, 1),
+        p99_ms=round(percentile(samples, 99) * 1000, 2),
+        failed=sum(failures for _, failures in results),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--profiles', default=','.join(PROFILES))
+    parser.add_argument('--workers', type=int, help='GUNICORN_WORKERS for every profile (default: per profile)')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--discord-latency', type=float, default=0.15)
+    parser.add_argument('--port', type=int, default=8020)
+    parser.add_argument('--guild-id', default='bench-workers')
+    args = parser.parse_args()
+
+    app = make_app()
+    viewer_id = seed_guild(app, args.guild_id, args.members)
+    with app.app_context():
+        db.session.execute(text("DELETE FROM user_guild WHERE user_id LIKE :prefix"), {'prefix': f'{LOGIN_USER_PREFIX}%'})
+        db.session.execute(text("DELETE FROM users WHERE discord_id LIKE :prefix"), {'prefix': f'{LOGIN_USER_PREFIX}%'})
+        db.session.commit()
+    cookie = session_cookie(app, viewer_id)
+    discord, discord_url = stub_discord(args.guild_id, args.discord_latency)
+
+    pages = [path.format(guild_id=args.guild_id) for path in PAGES]
+    scenarios = {
+        'pages': pages,
+        'login': [LOGIN],
+        'mixed': (pages * 2)[:9] + [LOGIN],
+    }
+
+    results = {}
+    try:
+        for profile in args.profiles.split(','):
+            log_path = os.path.join(tempfile.gettempdir(), f'worker_profiles-{profile}.log')
+            process = start_server(profile, args.port, discord_url, args.workers, log_path)
+            try:
+                results[profile] = {}
+                for name, paths in scenarios.items():
+                    drive(args.port, paths, cookie, args.concurrency, args.warmup)
+                    result = drive(args.port, paths, cookie, args.concurrency, args.duration)
+                    result['rss_mb'], result['workers'] = process_rss_mb(process.pid)
+                    results[profile][name] = result
+                    print(f"{profile:8} {name:6} {result['rps']:8} req/s  p99 {result['p99_ms']:8} ms  "
+                          f"{result['rss_mb']} MB  {result['failed']} failed", file=sys.stderr)
+            finally:
+                stop_server(process)
+    finally:
+        discord.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,34 @@
 import multiprocessing
+import os
+import shutil
 
-# Worker processes
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = 'sync'
+# Worker processes. GUNICORN_WORKER_CLASS picks the profile:
+#   sync    - one request at a time per process (default)
+#   gthread - GUNICORN_THREADS requests per process, so a request waiting on
+#             Discord or a slow query only holds one thread
+#   gevent  - one greenlet per request, for mostly-waiting traffic
+# benchmarks/worker_profiles.py compares them on the same routes.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'sync')
 worker_connections = 1000
 timeout = 30
 keepalive = 5
 
+if worker_class == 'gthread':
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+    db_pool_size = threads  # One connection per thread, so none of them waits on the pool
+elif worker_class == 'gevent':
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+    db_pool_size = 10  # Greenlets queue for a connection instead of each opening one
+else:
+    workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    db_pool_size = 3
+
+# Read by Config when the workers import the app. DB_CONNECTION_BUDGET, if set,
+# caps the connections all workers hold together; each pool gets its share.
+os.environ.setdefault('DB_POOL_SIZE', str(db_pool_size))
+os.environ['DB_WORKERS'] = str(workers)
+
 # Logging
 accesslog = '-'
 errorlog = '-'
@@ -29,4 +51,31 @@ max_requests = 1000
 max_requests_jitter = 50
 
 # Graceful timeout
-graceful_timeout = 30 
\ No newline at end of file
+graceful_timeout = 30
+
+# Prometheus: workers write their samples to files here and /metrics adds
+# them up (assets/middleware/metrics.py). Read when the workers import the app.
+metrics_dir = os.path.join(worker_tmp_dir, 'cldashboard-metrics')
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir
+
+
+def post_fork(server, worker):
+    if worker_class == 'gevent':
+        # Let psycopg2 yield to other greenlets while it waits on the database
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def on_starting(server):
+    # Counters left by a previous run would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    budget = int(os.environ.get('DB_CONNECTION_BUDGET', 0))
+    if budget and budget < workers:
+        server.log.warning(f"DB_CONNECTION_BUDGET={budget} is below the {workers} workers; each still opens one connection")
+
+
+def child_exit(server, worker):
+    # Drop the exited worker from the in-progress and pool gauges; its counters stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,74 @@
+"""
+Gunicorn profile for the live activity streams.
+
+Each open /api/guilds/<id>/activity/stream response holds a connection for
+as long as the overview page stays open, which would pin one of the sync
+workers from gunicorn_config.py. Run this profile next to the main server
+and route only the stream path to it:
+
+    gunicorn -c gunicorn_stream_config.py app:app
+
+gevent workers park each idle stream on a greenlet, so a worker holds
+thousands of them; the guild watchers behind them share the worker's small
+DB pool.
+"""
+import os
+import shutil
+
+# Worker processes
+workers = int(os.environ.get('STREAM_WORKERS', 2))
+worker_class = 'gevent'
+worker_connections = 5000  # Open streams per worker
+timeout = 30
+keepalive = 75
+
+# Streams are only served by processes started with this profile
+raw_env = ['ACTIVITY_STREAM_WORKER=1']
+
+# The stream workers' pools share STREAM_DB_CONNECTION_BUDGET, kept apart from the
+# main server's DB_CONNECTION_BUDGET (0: no cap). Read by Config when the workers import the app.
+os.environ['DB_WORKERS'] = str(workers)
+os.environ['DB_CONNECTION_BUDGET'] = os.environ.get('STREAM_DB_CONNECTION_BUDGET', '0')
+
+# Logging
+accesslog = '-'
+errorlog = '-'
+loglevel = 'info'
+
+# Process naming
+proc_name = 'cldashboard-stream'
+
+# Server socket
+bind = os.environ.get('STREAM_BIND', '0.0.0.0:8001')
+backlog = 2048
+
+# Worker process settings
+worker_tmp_dir = '/dev/shm'
+# Recycling a worker drops every stream it holds; clients reconnect, but not all at once
+max_requests = 0
+
+# Graceful timeout: streams never finish on their own, so don't wait long for them
+graceful_timeout = 10
+
+# Prometheus: workers write their samples to files here and /metrics adds
+# them up (assets/middleware/metrics.py). Read when the workers import the app.
+metrics_dir = os.path.join(worker_tmp_dir, 'cldashboard-stream-metrics')
+os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir
+
+
+def post_fork(server, worker):
+    # Let psycopg2 yield to other greenlets while it waits on the database
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+
+def on_starting(server):
+    # Counters left by a previous run would be added to this one's
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+
+def child_exit(server, worker):
+    # Drop the exited worker from the in-progress and pool gauges; its counters stay in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
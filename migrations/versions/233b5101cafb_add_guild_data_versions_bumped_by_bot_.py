@@ -0,0 +1,85 @@
+"""add guild_data_versions bumped by bot writes
+
+Revision ID: 233b5101cafb
+Revises: e6fcee193a32
+Create Date: 2026-10-18 15:58:49.504338
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '233b5101cafb'
+down_revision = 'e6fcee193a32'
+branch_labels = None
+depends_on = None
+
+
+# One bump per guild a statement touched, however many rows it wrote, taking
+# the row locks in guild_id order so two multi-guild statements can't
+# deadlock. The dashboard's own writes bump from services/guild_versions.py.
+BUMP_FUNCTION = """
+CREATE OR REPLACE FUNCTION guild_data_versions_bump() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_data_versions AS v (guild_id, version)
+        SELECT DISTINCT guild_id, 1 FROM new_rows ORDER BY guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET version = v.version + 1;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO guild_data_versions AS v (guild_id, version)
+        SELECT DISTINCT guild_id, 1 FROM old_rows ORDER BY guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET version = v.version + 1;
+    ELSE
+        INSERT INTO guild_data_versions AS v (guild_id, version)
+        SELECT guild_id, 1 FROM new_rows UNION SELECT guild_id, 1 FROM old_rows ORDER BY guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET version = v.version + 1;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION guild_data_versions_bump_all() RETURNS trigger AS $$
+BEGIN
+    UPDATE guild_data_versions SET version = version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TABLES = ('levels', 'user_achievements')
+
+TRIGGERS = {
+    'insert': "AFTER INSERT ON {table} REFERENCING NEW TABLE AS new_rows",
+    'update': "AFTER UPDATE ON {table} REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    'delete': "AFTER DELETE ON {table} REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def upgrade():
+    op.create_table(
+        'guild_data_versions',
+        sa.Column('guild_id', sa.String(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('guild_id')
+    )
+    op.execute(BUMP_FUNCTION)
+    for table in TABLES:
+        for event, definition in TRIGGERS.items():
+            op.execute(
+                f"CREATE TRIGGER guild_data_versions_{event} {definition.format(table=table)} "
+                "FOR EACH STATEMENT EXECUTE FUNCTION guild_data_versions_bump()"
+            )
+        op.execute(
+            f"CREATE TRIGGER guild_data_versions_truncate AFTER TRUNCATE ON {table} "
+            "FOR EACH STATEMENT EXECUTE FUNCTION guild_data_versions_bump_all()"
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        for event in list(TRIGGERS) + ['truncate']:
+            op.execute(f"DROP TRIGGER IF EXISTS guild_data_versions_{event} ON {table}")
+    op.execute("DROP FUNCTION IF EXISTS guild_data_versions_bump()")
+    op.execute("DROP FUNCTION IF EXISTS guild_data_versions_bump_all()")
+    op.drop_table('guild_data_versions')
@@ -0,0 +1,31 @@
+"""add guild/status/start index on discord_scheduled_events
+
+Revision ID: 42319bfcb7aa
+Revises: bfa3c1c512dc
+Create Date: 2026-10-18 17:05:12.318544
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '42319bfcb7aa'
+down_revision = 'bfa3c1c512dc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the events API's status filter and (start_time, internal_id) keyset order in one
+    # index; the bot writes this table, so build it without locking writes
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_discord_scheduled_events_guild_status_start "
+            "ON discord_scheduled_events (guild_id, status, start_time, internal_id)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_discord_scheduled_events_guild_status_start")
@@ -0,0 +1,30 @@
+"""add leaderboard keyset index on levels
+
+Revision ID: 522e5320eea9
+Revises: bd06e20fff45
+Create Date: 2026-10-18 15:12:34.469402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '522e5320eea9'
+down_revision = 'bd06e20fff45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # `levels` is owned by the bot and can be large, so build the index without locking writes
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_levels_guild_rank "
+            "ON levels (guild_id, level DESC, xp DESC, user_id DESC)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_levels_guild_rank")
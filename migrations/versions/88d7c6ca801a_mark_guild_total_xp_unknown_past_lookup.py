@@ -0,0 +1,158 @@
+"""mark guild_stats.total_xp unknown for levels past xp_level_totals
+
+Revision ID: 88d7c6ca801a
+Revises: 42319bfcb7aa
+Create Date: 2026-10-18 18:42:07.514209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '88d7c6ca801a'
+down_revision = '42319bfcb7aa'
+branch_labels = None
+depends_on = None
+
+
+# As in 8fca698fb59c, but without a COALESCE: a row whose level has no
+# xp_level_totals row (past DEFAULT_MAX_LEVEL until `flask xp sync-table`
+# extends it) has unknown XP, NULL here.
+ROW_XP = "CAST(CASE WHEN lvl.level <= 0 THEN GREATEST(lvl.xp, 0) ELSE xlt.total_xp + lvl.xp END AS NUMERIC)"
+
+
+# SUM skips NULLs, which would drop that member's XP from the total for good.
+# A guild with any such row gets a NULL total_xp instead, and NULL stays NULL
+# through every later delta, so the rollup says "unknown" rather than a wrong
+# number until `flask guild-stats reconcile` rebuilds it.
+def total_xp(expression):
+    return f"CASE WHEN COUNT(*) FILTER (WHERE {expression} IS NULL) > 0 THEN NULL ELSE COALESCE(SUM({expression}), 0) END"
+
+
+GUILD_STATS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION guild_stats_levels_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT lvl.guild_id, COUNT(*), SUM(lvl.level), {total_xp(ROW_XP)}
+        FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        GROUP BY lvl.guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE guild_stats gs SET
+            member_count = gs.member_count - d.members,
+            total_level = gs.total_level - d.total_level,
+            total_xp = gs.total_xp - d.total_xp
+        FROM (
+            SELECT lvl.guild_id, COUNT(*) AS members, SUM(lvl.level) AS total_level,
+                   {total_xp(ROW_XP)} AS total_xp
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            GROUP BY lvl.guild_id
+        ) d
+        WHERE gs.guild_id = d.guild_id;
+    ELSE
+        -- Net change per guild; updates that leave level and xp alone (voice
+        -- time, last_xp_time) don't touch guild_stats at all
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT guild_id, SUM(members), SUM(total_level), {total_xp('total_xp')} FROM (
+            SELECT lvl.guild_id, 1 AS members, lvl.level AS total_level, {ROW_XP} AS total_xp
+            FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            UNION ALL
+            SELECT lvl.guild_id, -1, -lvl.level, -{ROW_XP}
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        ) delta
+        GROUP BY guild_id
+        HAVING SUM(members) <> 0 OR SUM(total_level) <> 0 OR SUM(total_xp) <> 0
+            OR COUNT(*) FILTER (WHERE total_xp IS NULL) > 0
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# The function as 8fca698fb59c created it
+PREVIOUS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION guild_stats_levels_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT lvl.guild_id, COUNT(*), SUM(lvl.level), COALESCE(SUM({ROW_XP}), 0)
+        FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        GROUP BY lvl.guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE guild_stats gs SET
+            member_count = gs.member_count - d.members,
+            total_level = gs.total_level - d.total_level,
+            total_xp = gs.total_xp - d.total_xp
+        FROM (
+            SELECT lvl.guild_id, COUNT(*) AS members, SUM(lvl.level) AS total_level,
+                   COALESCE(SUM({ROW_XP}), 0) AS total_xp
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            GROUP BY lvl.guild_id
+        ) d
+        WHERE gs.guild_id = d.guild_id;
+    ELSE
+        -- Net change per guild; updates that leave level and xp alone (voice
+        -- time, last_xp_time) don't touch guild_stats at all
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT guild_id, SUM(members), SUM(total_level), SUM(total_xp) FROM (
+            SELECT lvl.guild_id, 1 AS members, lvl.level AS total_level, COALESCE({ROW_XP}, 0) AS total_xp
+            FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            UNION ALL
+            SELECT lvl.guild_id, -1, -lvl.level, -COALESCE({ROW_XP}, 0)
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        ) delta
+        GROUP BY guild_id
+        HAVING SUM(members) <> 0 OR SUM(total_level) <> 0 OR SUM(total_xp) <> 0
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    op.execute("LOCK TABLE levels IN SHARE ROW EXCLUSIVE MODE")
+    op.alter_column('guild_stats', 'total_xp', existing_type=sa.Numeric(), nullable=True)
+    op.execute(GUILD_STATS_FUNCTION)
+    # Guilds that already lost XP to a missing lookup row
+    op.execute("""
+        UPDATE guild_stats SET total_xp = NULL
+        WHERE guild_id IN (
+            SELECT lvl.guild_id FROM levels lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            WHERE lvl.level > 0 AND xlt.level IS NULL
+        )
+    """)
+
+
+def downgrade():
+    op.execute("LOCK TABLE levels IN SHARE ROW EXCLUSIVE MODE")
+    op.execute(PREVIOUS_FUNCTION)
+    # Back to the old behaviour for unknown totals: rows without a lookup entry count as 0 XP
+    op.execute(f"""
+        UPDATE guild_stats gs SET total_xp = t.total_xp
+        FROM (
+            SELECT lvl.guild_id, COALESCE(SUM({ROW_XP}), 0) AS total_xp
+            FROM levels lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            GROUP BY lvl.guild_id
+        ) t
+        WHERE gs.guild_id = t.guild_id AND gs.total_xp IS NULL
+    """)
+    op.execute("UPDATE guild_stats SET total_xp = 0 WHERE total_xp IS NULL")
+    op.alter_column('guild_stats', 'total_xp', existing_type=sa.Numeric(), nullable=False)
@@ -0,0 +1,142 @@
+"""add level, xp and active totals to guild_stats
+
+Revision ID: 8fca698fb59c
+Revises: e5b34d2f9aee
+Create Date: 2026-10-18 15:51:39.910105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8fca698fb59c'
+down_revision = 'e5b34d2f9aee'
+branch_labels = None
+depends_on = None
+
+
+# Cumulative XP of one levels row (alias lvl) joined to xp_level_totals (alias
+# xlt), as of this revision of services/xp_levels.CUMULATIVE_XP_SQL. Cast per
+# row to NUMERIC so adding and later subtracting the same row is exact and the
+# running total never drifts the way a float sum would.
+ROW_XP = "CAST(CASE WHEN lvl.level <= 0 THEN GREATEST(lvl.xp, 0) ELSE xlt.total_xp + lvl.xp END AS NUMERIC)"
+
+# Same triggers as e5b34d2f9aee, now carrying level and XP sums alongside the
+# member count. active_count depends on the clock rather than on writes, so
+# services/guild_stats.py refreshes it instead.
+GUILD_STATS_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION guild_stats_levels_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT lvl.guild_id, COUNT(*), SUM(lvl.level), COALESCE(SUM({ROW_XP}), 0)
+        FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        GROUP BY lvl.guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE guild_stats gs SET
+            member_count = gs.member_count - d.members,
+            total_level = gs.total_level - d.total_level,
+            total_xp = gs.total_xp - d.total_xp
+        FROM (
+            SELECT lvl.guild_id, COUNT(*) AS members, SUM(lvl.level) AS total_level,
+                   COALESCE(SUM({ROW_XP}), 0) AS total_xp
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            GROUP BY lvl.guild_id
+        ) d
+        WHERE gs.guild_id = d.guild_id;
+    ELSE
+        -- Net change per guild; updates that leave level and xp alone (voice
+        -- time, last_xp_time) don't touch guild_stats at all
+        INSERT INTO guild_stats AS gs (guild_id, member_count, total_level, total_xp)
+        SELECT guild_id, SUM(members), SUM(total_level), SUM(total_xp) FROM (
+            SELECT lvl.guild_id, 1 AS members, lvl.level AS total_level, COALESCE({ROW_XP}, 0) AS total_xp
+            FROM new_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            UNION ALL
+            SELECT lvl.guild_id, -1, -lvl.level, -COALESCE({ROW_XP}, 0)
+            FROM old_rows lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+        ) delta
+        GROUP BY guild_id
+        HAVING SUM(members) <> 0 OR SUM(total_level) <> 0 OR SUM(total_xp) <> 0
+        ON CONFLICT (guild_id) DO UPDATE SET
+            member_count = gs.member_count + EXCLUDED.member_count,
+            total_level = gs.total_level + EXCLUDED.total_level,
+            total_xp = gs.total_xp + EXCLUDED.total_xp;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION guild_stats_levels_truncated() RETURNS trigger AS $$
+BEGIN
+    UPDATE guild_stats SET member_count = 0, total_level = 0, total_xp = 0, active_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# The functions as e5b34d2f9aee created them
+PREVIOUS_FUNCTION = """
+CREATE OR REPLACE FUNCTION guild_stats_levels_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_stats AS gs (guild_id, member_count)
+        SELECT guild_id, COUNT(*) FROM new_rows GROUP BY guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET member_count = gs.member_count + EXCLUDED.member_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE guild_stats gs SET member_count = gs.member_count - d.removed
+        FROM (SELECT guild_id, COUNT(*) AS removed FROM old_rows GROUP BY guild_id) d
+        WHERE gs.guild_id = d.guild_id;
+    ELSE
+        INSERT INTO guild_stats AS gs (guild_id, member_count)
+        SELECT guild_id, SUM(delta) FROM (
+            SELECT guild_id, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT guild_id, -1 FROM old_rows
+        ) moved
+        GROUP BY guild_id
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (guild_id) DO UPDATE SET member_count = gs.member_count + EXCLUDED.member_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION guild_stats_levels_truncated() RETURNS trigger AS $$
+BEGIN
+    UPDATE guild_stats SET member_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    # Replacing a function doesn't lock levels the way CREATE TRIGGER did, so
+    # hold writers off explicitly until the backfill below commits
+    op.execute("LOCK TABLE levels IN SHARE ROW EXCLUSIVE MODE")
+    op.add_column('guild_stats', sa.Column('total_level', sa.BigInteger(), server_default='0', nullable=False))
+    op.add_column('guild_stats', sa.Column('total_xp', sa.Numeric(), server_default='0', nullable=False))
+    op.add_column('guild_stats', sa.Column('active_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(GUILD_STATS_FUNCTION)
+    op.execute(f"""
+        UPDATE guild_stats gs SET total_level = t.total_level, total_xp = t.total_xp, active_count = t.active_count
+        FROM (
+            SELECT lvl.guild_id, SUM(lvl.level) AS total_level, COALESCE(SUM({ROW_XP}), 0) AS total_xp,
+                   COUNT(*) FILTER (WHERE lvl.last_xp_time >= EXTRACT(EPOCH FROM NOW()) - 86400) AS active_count
+            FROM levels lvl LEFT JOIN xp_level_totals xlt ON xlt.level = lvl.level
+            GROUP BY lvl.guild_id
+        ) t
+        WHERE gs.guild_id = t.guild_id
+    """)
+
+
+def downgrade():
+    op.execute(PREVIOUS_FUNCTION)
+    op.drop_column('guild_stats', 'active_count')
+    op.drop_column('guild_stats', 'total_xp')
+    op.drop_column('guild_stats', 'total_level')
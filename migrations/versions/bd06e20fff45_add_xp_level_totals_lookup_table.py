@@ -0,0 +1,49 @@
+"""add xp_level_totals lookup table
+
+Revision ID: bd06e20fff45
+Revises: 
+Create Date: 2026-10-18 15:11:41.703703
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd06e20fff45'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+MAX_LEVEL = 1000
+
+
+def frozen_level_totals():
+    """XP needed to reach the start of levels 0..MAX_LEVEL, as utils.xp_utils computed it at this revision.
+
+    Frozen here so replaying the migration never depends on application code;
+    `flask xp sync-table` rewrites the rows after later formula changes.
+    """
+    totals, total = [0.0], 0
+    for level in range(1, MAX_LEVEL + 1):
+        if level > 1:
+            total += 100 * ((level - 1) ** 1.8)  # XP to complete the previous level
+        totals.append(float(total))
+    return list(range(MAX_LEVEL + 1)), totals
+
+
+def upgrade():
+    xp_level_totals = op.create_table(
+        'xp_level_totals',
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.Column('total_xp', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('level')
+    )
+    levels, totals = frozen_level_totals()
+    op.bulk_insert(xp_level_totals, [
+        {'level': level, 'total_xp': total} for level, total in zip(levels, totals)
+    ])
+
+
+def downgrade():
+    op.drop_table('xp_level_totals')
@@ -0,0 +1,71 @@
+"""add level_up_log and completed achievements index
+
+Revision ID: bfa3c1c512dc
+Revises: 233b5101cafb
+Create Date: 2026-10-18 16:08:12.415937
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bfa3c1c512dc'
+down_revision = '233b5101cafb'
+branch_labels = None
+depends_on = None
+
+
+# levels only holds each member's current level, so the live activity stream
+# can't tell a level-up from an XP gain after the fact. Log increases as they
+# happen and keep a day of them; the stream only ever looks seconds back.
+LEVEL_UP_FUNCTION = """
+CREATE OR REPLACE FUNCTION level_up_log_changed() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO level_up_log (guild_id, user_id, level)
+    SELECT n.guild_id, n.user_id, n.level
+    FROM new_rows n JOIN old_rows o ON o.guild_id = n.guild_id AND o.user_id = n.user_id
+    WHERE n.level > o.level;
+    IF FOUND THEN
+        DELETE FROM level_up_log
+        WHERE guild_id IN (SELECT guild_id FROM new_rows) AND created_at < NOW() - INTERVAL '1 day';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    op.create_table(
+        'level_up_log',
+        sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False),
+        sa.Column('guild_id', sa.String(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('level', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_level_up_log_guild_created_at', 'level_up_log', ['guild_id', 'created_at'])
+    op.execute(LEVEL_UP_FUNCTION)
+    op.execute(
+        "CREATE TRIGGER level_up_log_update AFTER UPDATE ON levels "
+        "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+        "FOR EACH STATEMENT EXECUTE FUNCTION level_up_log_changed()"
+    )
+    # Recent completions per guild, for the activity feed and stream; without
+    # it both scan all of user_achievements
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_achievements_guild_completed_at "
+            "ON user_achievements (guild_id, last_tier_achieved_at) WHERE completed"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_user_achievements_guild_completed_at")
+    op.execute("DROP TRIGGER IF EXISTS level_up_log_update ON levels")
+    op.execute("DROP FUNCTION IF EXISTS level_up_log_changed()")
+    op.drop_index('ix_level_up_log_guild_created_at', table_name='level_up_log')
+    op.drop_table('level_up_log')
@@ -0,0 +1,30 @@
+"""add levels last_xp_time index
+
+Revision ID: d20be4e329d2
+Revises: 522e5320eea9
+Create Date: 2026-10-18 15:13:34.236639
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd20be4e329d2'
+down_revision = '522e5320eea9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Serves the activity chart range scan and the recent-activity feed
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_levels_guild_last_xp_time "
+            "ON levels (guild_id, last_xp_time)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_levels_guild_last_xp_time")
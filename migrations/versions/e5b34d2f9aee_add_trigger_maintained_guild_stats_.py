@@ -0,0 +1,92 @@
+"""add trigger-maintained guild_stats member counts
+
+Revision ID: e5b34d2f9aee
+Revises: d20be4e329d2
+Create Date: 2026-10-18 15:17:14.066913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b34d2f9aee'
+down_revision = 'd20be4e329d2'
+branch_labels = None
+depends_on = None
+
+
+# Statement-level triggers read the changed rows from transition tables, so a
+# bulk load updates each guild's row once per statement instead of once per
+# member. Postgres only allows one event per trigger that has transition
+# tables, hence three triggers sharing one function.
+GUILD_STATS_FUNCTION = """
+CREATE OR REPLACE FUNCTION guild_stats_levels_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO guild_stats AS gs (guild_id, member_count)
+        SELECT guild_id, COUNT(*) FROM new_rows GROUP BY guild_id
+        ON CONFLICT (guild_id) DO UPDATE SET member_count = gs.member_count + EXCLUDED.member_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE guild_stats gs SET member_count = gs.member_count - d.removed
+        FROM (SELECT guild_id, COUNT(*) AS removed FROM old_rows GROUP BY guild_id) d
+        WHERE gs.guild_id = d.guild_id;
+    ELSE
+        -- XP updates never change membership; only touch guild_stats when rows moved guild
+        INSERT INTO guild_stats AS gs (guild_id, member_count)
+        SELECT guild_id, SUM(delta) FROM (
+            SELECT guild_id, 1 AS delta FROM new_rows
+            UNION ALL
+            SELECT guild_id, -1 FROM old_rows
+        ) moved
+        GROUP BY guild_id
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (guild_id) DO UPDATE SET member_count = gs.member_count + EXCLUDED.member_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION guild_stats_levels_truncated() RETURNS trigger AS $$
+BEGIN
+    UPDATE guild_stats SET member_count = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGERS = {
+    'guild_stats_levels_insert': "AFTER INSERT ON levels REFERENCING NEW TABLE AS new_rows",
+    'guild_stats_levels_update': "AFTER UPDATE ON levels REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    'guild_stats_levels_delete': "AFTER DELETE ON levels REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def upgrade():
+    op.create_table(
+        'guild_stats',
+        sa.Column('guild_id', sa.String(), nullable=False),
+        sa.Column('member_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('guild_id')
+    )
+    op.execute(GUILD_STATS_FUNCTION)
+    for name, definition in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER {name} {definition} FOR EACH STATEMENT EXECUTE FUNCTION guild_stats_levels_changed()")
+    op.execute(
+        "CREATE TRIGGER guild_stats_levels_truncate AFTER TRUNCATE ON levels "
+        "FOR EACH STATEMENT EXECUTE FUNCTION guild_stats_levels_truncated()"
+    )
+    # CREATE TRIGGER holds a lock that blocks writes to levels until this
+    # transaction commits, so the backfill can't miss or double-count a row.
+    op.execute("""
+        INSERT INTO guild_stats (guild_id, member_count)
+        SELECT guild_id, COUNT(*) FROM levels GROUP BY guild_id
+    """)
+
+
+def downgrade():
+    for name in list(TRIGGERS) + ['guild_stats_levels_truncate']:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON levels")
+    op.execute("DROP FUNCTION IF EXISTS guild_stats_levels_changed()")
+    op.execute("DROP FUNCTION IF EXISTS guild_stats_levels_truncated()")
+    op.drop_table('guild_stats')
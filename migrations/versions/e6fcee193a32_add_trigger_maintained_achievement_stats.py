@@ -0,0 +1,102 @@
+"""add trigger-maintained achievement_stats
+
+Revision ID: e6fcee193a32
+Revises: 8fca698fb59c
+Create Date: 2026-10-18 15:54:26.897707
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6fcee193a32'
+down_revision = '8fca698fb59c'
+branch_labels = None
+depends_on = None
+
+
+# Completed user_achievements rows per (guild, achievement), kept current by
+# statement-level triggers like guild_stats. The bot rewrites progress far
+# more often than it completes anything, so updates that don't flip
+# `completed` leave achievement_stats alone.
+ACHIEVEMENT_STATS_FUNCTION = """
+CREATE OR REPLACE FUNCTION achievement_stats_changed() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO achievement_stats AS s (guild_id, achievement_id, completed_count)
+        SELECT guild_id, base_achievement_id, COUNT(*) FROM new_rows
+        WHERE completed
+        GROUP BY guild_id, base_achievement_id
+        ON CONFLICT (guild_id, achievement_id) DO UPDATE SET completed_count = s.completed_count + EXCLUDED.completed_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE achievement_stats s SET completed_count = s.completed_count - d.removed
+        FROM (
+            SELECT guild_id, base_achievement_id, COUNT(*) AS removed FROM old_rows
+            WHERE completed
+            GROUP BY guild_id, base_achievement_id
+        ) d
+        WHERE s.guild_id = d.guild_id AND s.achievement_id = d.base_achievement_id;
+    ELSE
+        INSERT INTO achievement_stats AS s (guild_id, achievement_id, completed_count)
+        SELECT guild_id, base_achievement_id, SUM(delta) FROM (
+            SELECT guild_id, base_achievement_id, 1 AS delta FROM new_rows WHERE completed
+            UNION ALL
+            SELECT guild_id, base_achievement_id, -1 FROM old_rows WHERE completed
+        ) changed
+        GROUP BY guild_id, base_achievement_id
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (guild_id, achievement_id) DO UPDATE SET completed_count = s.completed_count + EXCLUDED.completed_count;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION achievement_stats_truncated() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM achievement_stats;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+TRIGGERS = {
+    'achievement_stats_insert': "AFTER INSERT ON user_achievements REFERENCING NEW TABLE AS new_rows",
+    'achievement_stats_update': "AFTER UPDATE ON user_achievements REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    'achievement_stats_delete': "AFTER DELETE ON user_achievements REFERENCING OLD TABLE AS old_rows",
+}
+
+
+def upgrade():
+    # No FK to achievements: a trigger failing on a row the bot wrote would
+    # fail the bot's write. Rows for deleted achievements are never joined
+    # and `flask guild-stats reconcile` removes them.
+    op.create_table(
+        'achievement_stats',
+        sa.Column('guild_id', sa.String(), nullable=False),
+        sa.Column('achievement_id', sa.Integer(), nullable=False),
+        sa.Column('completed_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('guild_id', 'achievement_id')
+    )
+    op.execute(ACHIEVEMENT_STATS_FUNCTION)
+    for name, definition in TRIGGERS.items():
+        op.execute(f"CREATE TRIGGER {name} {definition} FOR EACH STATEMENT EXECUTE FUNCTION achievement_stats_changed()")
+    op.execute(
+        "CREATE TRIGGER achievement_stats_truncate AFTER TRUNCATE ON user_achievements "
+        "FOR EACH STATEMENT EXECUTE FUNCTION achievement_stats_truncated()"
+    )
+    # CREATE TRIGGER keeps writers to user_achievements out until this commits
+    op.execute("""
+        INSERT INTO achievement_stats (guild_id, achievement_id, completed_count)
+        SELECT guild_id, base_achievement_id, COUNT(*) FROM user_achievements
+        WHERE completed
+        GROUP BY guild_id, base_achievement_id
+    """)
+
+
+def downgrade():
+    for name in list(TRIGGERS) + ['achievement_stats_truncate']:
+        op.execute(f"DROP TRIGGER IF EXISTS {name} ON user_achievements")
+    op.execute("DROP FUNCTION IF EXISTS achievement_stats_changed()")
+    op.execute("DROP FUNCTION IF EXISTS achievement_stats_truncated()")
+    op.drop_table('achievement_stats')
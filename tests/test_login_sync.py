@@ -0,0 +1,93 @@
+"""
+Statement budget of the database sync done at login (services/login_sync.py).
+
+Runs against the database in DATABASE_URL (a local or staging copy, never
+production) and is skipped when it isn't set. A user who administers 200
+guilds, all with the bot in them, logs in for the first time, again with
+nothing changed, and again with a quarter of the guilds swapped; every
+login must take at most two statements and one commit.
+"""
+import os
+
+import pytest
+
+if not os.environ.get('DATABASE_URL'):
+    pytest.skip('DATABASE_URL is not set', allow_module_level=True)
+
+from sqlalchemy import event, text
+
+from assets import create_app, db
+from assets.config import Config
+from assets.services.login_sync import sync_login
+
+USER_ID = '900000000000000003'
+GUILDS = 200
+MAX_STATEMENTS = 2
+MAX_COMMITS = 1
+
+
+class LoginSyncTestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_ENGINE_OPTIONS = dict(Config.SQLALCHEMY_ENGINE_OPTIONS)
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args'] = dict(
+        Config.SQLALCHEMY_ENGINE_OPTIONS['connect_args'],
+        sslmode=os.environ.get('DB_SSLMODE', 'prefer')
+    )
+
+
+@pytest.fixture
+def app():
+    app = create_app(LoginSyncTestConfig)
+    guild_ids = [f'test-login-sync-{i}' for i in range(GUILDS + GUILDS // 4)]
+    with app.app_context():
+        # Only the tables the sync touches, so an unmigrated database stays fit for `flask db upgrade`
+        db.metadata.create_all(db.engine, tables=[db.metadata.tables[name] for name in ('users', 'guilds', 'user_guild')])
+
+        def clean():
+            db.session.execute(text("DELETE FROM user_guild WHERE user_id = :user_id"), {'user_id': USER_ID})
+            db.session.execute(text("DELETE FROM users WHERE discord_id = :user_id"), {'user_id': USER_ID})
+            db.session.commit()
+
+        clean()
+        db.session.execute(text('''
+            INSERT INTO guilds (guild_id, name) SELECT id, 'Login sync test ' || id FROM unnest(CAST(:ids AS TEXT[])) AS id
+            ON CONFLICT (guild_id) DO NOTHING
+        '''), {'ids': guild_ids})
+        db.session.commit()
+        db.session.remove()
+        app.guild_ids = guild_ids
+        yield app
+        db.session.remove()
+        clean()
+        db.session.execute(text("DELETE FROM guilds WHERE guild_id = ANY(CAST(:ids AS TEXT[]))"), {'ids': guild_ids})
+        db.session.commit()
+
+
+def test_login_sync_statement_budget(app):
+    counts = {'statements': 0, 'commits': 0}
+
+    def on_execute(*args):
+        counts['statements'] += 1
+
+    def on_commit(*args):
+        counts['commits'] += 1
+
+    first = app.guild_ids[:GUILDS]
+    swapped = app.guild_ids[GUILDS // 4:]
+    discord_data = {'id': USER_ID, 'username': 'login-sync-test', 'discriminator': '0', 'email': '', 'avatar': None}
+
+    event.listen(db.engine, 'before_cursor_execute', on_execute)
+    event.listen(db.engine, 'commit', on_commit)
+    try:
+        for label, admin_guild_ids in (('first_login', first), ('unchanged', first), ('quarter_swapped', swapped)):
+            counts.update(statements=0, commits=0)
+            user, mutual = sync_login(discord_data, admin_guild_ids)
+            db.session.remove()
+
+            assert mutual == set(admin_guild_ids), label
+            assert user.role == ['admin'], label
+            assert counts['statements'] <= MAX_STATEMENTS, f"{label}: {counts['statements']} statements"
+            assert counts['commits'] == MAX_COMMITS, f"{label}: {counts['commits']} commits"
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_execute)
+        event.remove(db.engine, 'commit', on_commit)